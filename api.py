@@ -1,26 +1,74 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+import asyncio
+import logging
+import os
+import time
+import uuid
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
 from typing import Optional, List
-from library import Library, Book as LibraryBook
-from main import get_book_details_from_openlibrary
+from library import Library, Book as LibraryBook, SORT_OPTIONS
+from storage import open_storage
+from openlibrary import OpenLibraryClient, open_lookup_cache
+from importer import ImportReport, import_isbns
+from http_cache import ResponseCache, accepted_encodings, etag_for, is_not_modified, matching_etag, serialize, validators
+from changefeed import ChangeNotifier, stream_changes
+from circulation import LOAN_DAYS, CirculationError, open_circulation
+from dedupe import DuplicateBookError
+from export import MEDIA_TYPES, export_chunks, gzip_chunks
+from isbns import InvalidISBNError, canonical_isbn
+from datetime import date
+from metrics import REGISTRY, MetricsMiddleware
+from profiler import SamplingProfiler
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 
 # This dictionary will hold our single Library instance.
 app_state = {}
 
+logger = logging.getLogger(__name__)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # This code runs when the application starts up.
-    print("Server starting up...")
+    # The library and the API log through `logging`; LIBRARY_LOG_LEVEL=INFO
+    # shows every mutation, and the default keeps only warnings.
+    logging.basicConfig(level=os.environ.get("LIBRARY_LOG_LEVEL", "WARNING").upper())
+    logger.info("Server starting up...")
     # Create the single, shared Library instance and store it in the app_state.
-    app_state["library"] = Library()
-    print(f"Library loaded with {len(app_state['library'].books)} books.")
+    # The storage backend is picked from LIBRARY_STORAGE / LIBRARY_PATH.
+    app_state["library"] = Library(storage=open_storage())
+    logger.info("Library loaded with %d books.", len(app_state["library"]))
+    # One pooled, cached OpenLibrary client for every request, closed on shutdown.
+    app_state["openlibrary"] = OpenLibraryClient(cache=open_lookup_cache())
+    # Bulk imports running in the background, by job id, and when the
+    # finished ones finished, oldest first.
+    app_state["imports"] = {}
+    app_state["finished_imports"] = {}
+    # Serialized catalog responses, reused until the library changes.
+    app_state["responses"] = ResponseCache()
+    # Wakes the change streams whenever the library changes.
+    app_state["changes"] = ChangeNotifier(asyncio.get_running_loop())
+    app_state["library"].subscribe(app_state["changes"].notify)
+    # The sampling profiler behind /debug/profiler, if LIBRARY_PROFILING is set.
+    app_state["profiler"] = SamplingProfiler() if os.environ.get("LIBRARY_PROFILING") else None
+    # Loans, kept next to the library file.
+    app_state["circulation"] = await asyncio.to_thread(open_circulation, app_state["library"])
     yield
     # This code runs when the application is shutting down.
-    print("Server shutting down...")
-    app_state["library"].save_books()
-    print("Library data saved.")
+    logger.info("Server shutting down...")
+    if app_state["profiler"] is not None:
+        app_state["profiler"].stop()
+    # An import that is cut short adds none of its books.
+    running = [task for task, _ in app_state["imports"].values() if not task.done()]
+    for task in running:
+        task.cancel()
+    await asyncio.gather(*running, return_exceptions=True)
+    await app_state["openlibrary"].aclose()
+    await asyncio.to_thread(app_state["circulation"].close)
+    await asyncio.to_thread(app_state["library"].save_books)
+    await asyncio.to_thread(app_state["library"].close)
+    logger.info("Library data saved.")
 
 app = FastAPI(
     title="Library API",
@@ -36,7 +84,15 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Let the web UI read the total match count of a paged /books request.
+    expose_headers=["X-Total-Count", "X-Library-Version", "ETag", "Last-Modified"],
 )
+# Request latency per route, served on /metrics.
+app.add_middleware(MetricsMiddleware)
+
+# Handlers that use the Library are plain `def` functions, which FastAPI runs in
+# its thread pool: the Library's lock lets reads run side by side and writes one
+# at a time, and waiting for the lock or for storage never blocks the event loop.
 
 class Book(BaseModel):
     """Pydantic model for a book, used for API request and response validation."""
@@ -48,62 +104,430 @@ class Book(BaseModel):
     # Add the new date field, make it optional for incoming requests
     date_added: Optional[str] = None
 
-@app.get("/books", response_model=List[Book])
-async def list_all_books():
-    """Retrieve a list of all books in the library."""
+def json_response(content, status_code=200):
+    """
+    Serializes a response body with the configured JSON codec.
+
+    The library already returns well-formed books and loans, so they are
+    encoded directly instead of being validated again by a response model.
+    """
+    return Response(content=serialize(content), status_code=status_code, media_type="application/json")
+
+def cached_json(request: Request, key, build):
+    """
+    Answers a catalog GET from the response cache, with HTTP validators.
+
+    `build` returns (content, extra headers) and is only called when the
+    library changed since the cached response was made. A client that sends
+    the current ETag (or a recent enough If-Modified-Since) gets a 304.
+    """
     library = app_state["library"]
-    return [book.to_dict() for book in library.books]
+    # Read the version before the content, so a response is never tagged newer than it is.
+    version = library.version
+    headers = validators(version, library.last_modified)
+    if is_not_modified(request.headers, version, library.last_modified, library.previous_modified):
+        # Confirm the representation the client holds.
+        headers["ETag"] = matching_etag(request.headers.get("if-none-match", ""), version) or headers["ETag"]
+        return Response(status_code=304, headers=headers)
+    cache = app_state["responses"]
+    entry = cache.get(key, version)
+    if entry is None:
+        content, extra_headers = build()
+        entry = cache.put(key, version, serialize(content), extra_headers)
+    body, encoding = entry.body_for(request.headers.get("accept-encoding"))
+    headers.update(entry.headers)
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+        headers["ETag"] = etag_for(version, encoding)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get("/books", response_model=List[Book])
+def list_all_books(
+    request: Request,
+    q: Optional[str] = Query(None, description="Matches title, author, ISBN or year."),
+    author: Optional[str] = Query(None, description="Matches the author only."),
+    year_from: Optional[int] = None,
+    year_to: Optional[int] = None,
+    available: Optional[bool] = None,
+    sort: Optional[str] = Query(None, description=f"One of: {', '.join(SORT_OPTIONS)}. Defaults to the order books were added in."),
+    limit: Optional[int] = Query(None, ge=1),
+    offset: int = Query(0, ge=0),
+):
+    """
+    Retrieve books in the library, optionally filtered, sorted and paged.
+
+    Without a `limit` every matching book is returned. The total number of
+    matches is sent in the X-Total-Count header. Responses carry an ETag and
+    are cached until the library changes.
+    """
+    if sort is not None and sort not in SORT_OPTIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown sort option '{sort}'")
+
+    def build():
+        books, total = app_state["library"].query(
+            q=q, author=author, year_from=year_from, year_to=year_to, available=available,
+            sort=sort, limit=limit, offset=offset,
+        )
+        return books, {"X-Total-Count": str(total)}
+
+    key = ("books", q, author, year_from, year_to, available, sort, limit, offset)
+    return cached_json(request, key, build)
+
+@app.get("/books/changes")
+def get_changes(since: int):
+    """
+    Report the changes made after library version `since`.
+
+    Catalog responses carry their version in the X-Library-Version header.
+    If the version is too old to catch up from, `reset` is true and the
+    client should reload the books it shows. Apply changes idempotently: a
+    response may already include some of them.
+    """
+    version, changes = app_state["library"].changes_since(since)
+    if changes is None:
+        return {"version": version, "reset": True, "changes": []}
+    return {"version": version, "reset": False, "changes": changes}
+
+@app.get("/books/changes/stream")
+async def stream_book_changes(request: Request, since: Optional[int] = None,
+                              last_event_id: Optional[int] = Header(None)):
+    """
+    Push changes as server-sent events while the connection stays open.
+
+    Starts from the Last-Event-ID a reconnecting EventSource sends, which
+    is newer than the `since` it first connected with, or from `since`, or
+    from the current version.
+    """
+    if last_event_id is not None:
+        since = last_event_id
+    if since is None:
+        since = await asyncio.to_thread(lambda: app_state["library"].version)
+    events = stream_changes(app_state["library"], app_state["changes"], since, request.is_disconnected)
+    return StreamingResponse(events, media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/books/duplicates")
+def get_duplicates(request: Request, limit: Optional[int] = Query(None, ge=1)):
+    """
+    Find clusters of books that are probably the same work entered more than once.
+
+    Titles and authors are compared fuzzily, ignoring case, accents, word
+    order of names and initials, so other editions, "N/A" ISBNs and spelling
+    variants are grouped together. Clusters come largest first; the total
+    number is sent in the X-Total-Count header.
+    """
+    def build():
+        clusters = app_state["library"].duplicates()
+        return {"clusters": clusters[:limit]}, {"X-Total-Count": str(len(clusters))}
+
+    return cached_json(request, ("duplicates", limit), build)
+
+@app.get("/books/export")
+def export_books(request: Request, output_format: str = Query("ndjson", alias="format",
+                                                              description=f"One of: {', '.join(MEDIA_TYPES)}.")):
+    """
+    Download the whole catalog as NDJSON, CSV or a JSON array, for backups and analytics.
+
+    The response is streamed as it is produced, a chunk of books at a time,
+    so memory stays flat for any catalog size and writers are only held up
+    while a chunk is read. It is gzip-compressed for clients that accept it.
+    Changes made while the export runs may or may not be included.
+    """
+    if output_format not in MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unknown export format '{output_format}'")
+    # A sync generator: Starlette runs each step in the thread pool, off the event loop.
+    chunks = export_chunks(app_state["library"], output_format)
+    headers = {"Content-Disposition": f'attachment; filename="library.{output_format}"', "Vary": "Accept-Encoding"}
+    if "gzip" in accepted_encodings(request.headers.get("accept-encoding")):
+        chunks = gzip_chunks(chunks)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(chunks, media_type=MEDIA_TYPES[output_format], headers=headers)
 
 @app.get("/books/{isbn}", response_model=Book)
-async def get_single_book(isbn: str):
+def get_single_book(isbn: str, request: Request):
     """Retrieve a single book by its ISBN."""
+    def build():
+        book = app_state["library"].find_book(isbn)
+        if book is None:
+            raise HTTPException(status_code=404, detail="Book not found")
+        return book, {}
+
+    # Every notation of an ISBN shares one cache entry.
+    return cached_json(request, ("book", canonical_isbn(isbn) or isbn), build)
+
+# Finished bulk imports can be polled for this many seconds, and only the
+# most recent ones are kept.
+IMPORT_JOB_TTL = 3600
+MAX_FINISHED_IMPORTS = 100
+
+def forget_finished_imports():
+    """Drops finished import jobs older than IMPORT_JOB_TTL, and the oldest beyond MAX_FINISHED_IMPORTS."""
+    finished = app_state["finished_imports"]
+    expired = time.monotonic() - IMPORT_JOB_TTL
+    while finished:
+        job_id, finished_at = next(iter(finished.items()))
+        if finished_at > expired and len(finished) <= MAX_FINISHED_IMPORTS:
+            break
+        del finished[job_id]
+        del app_state["imports"][job_id]
+
+class BulkImportRequest(BaseModel):
+    """Request body for a bulk import of ISBNs."""
+    isbns: List[str]
+    concurrency: int = Field(8, ge=1, le=32)
+    rate: float = Field(5.0, gt=0, description="Maximum OpenLibrary lookups started per second.")
+
+@app.post("/books/bulk", status_code=202)
+async def start_bulk_import(request: BulkImportRequest):
+    """
+    Start importing books for a list of ISBNs from OpenLibrary.
+
+    The import runs in the background; poll `/books/bulk/{job_id}` for its
+    progress and per-ISBN failures.
+    """
+    report = ImportReport(total=len(request.isbns))
+    job_id = uuid.uuid4().hex
+    task = asyncio.create_task(import_isbns(
+        app_state["library"], app_state["openlibrary"], request.isbns,
+        concurrency=request.concurrency, rate=request.rate, report=report,
+    ))
+    app_state["imports"][job_id] = (task, report)
+
+    def finished(task):
+        app_state["finished_imports"][job_id] = time.monotonic()
+        forget_finished_imports()
+
+    task.add_done_callback(finished)
+    return {"job_id": job_id, **report.to_dict()}
+
+@app.get("/books/bulk/{job_id}")
+async def get_bulk_import(job_id: str):
+    """Report the progress of a bulk import; finished imports are forgotten after an hour."""
+    forget_finished_imports()
+    job = app_state["imports"].get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    task, report = job
+    if task.done() and task.exception() is not None:
+        raise HTTPException(status_code=500, detail=f"Import failed: {task.exception()}")
+    return {"job_id": job_id, **report.to_dict()}
+
+@app.get("/search", response_model=List[Book])
+def search_books(q: str, limit: int = Query(20, ge=1, le=100)):
+    """
+    Full-text search over titles and authors, best matches first.
+
+    Accents and case are ignored, and every term matches as a prefix, so
+    partially typed words already find results.
+    """
     library = app_state["library"]
-    book = library.find_book(isbn)
-    if book is None:
-        raise HTTPException(status_code=404, detail="Book not found")
-    return book.to_dict()
+    return json_response(library.search(q, limit))
+
+@app.get("/stats")
+def get_stats(request: Request, top_authors: int = Query(10, ge=0, le=1000)):
+    """
+    Counts of the collection: totals, available versus checked out, the
+    authors with the most books, and books by year, decade and month added.
+
+    The counts are kept up to date by the library on every change, and the
+    response is cached with an ETag like the catalog.
+    """
+    return cached_json(request, ("stats", top_authors), lambda: (app_state["library"].stats(top_authors), {}))
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Latency histograms and error counts of this process, in the Prometheus text format."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def get_profiler():
+    profiler = app_state["profiler"]
+    if profiler is None:
+        raise HTTPException(status_code=404, detail="Profiling is off; start the server with LIBRARY_PROFILING=1.")
+    return profiler
+
+@app.post("/debug/profiler")
+async def start_profiler(interval: float = Query(0.005, gt=0, le=1)):
+    """Start sampling every thread's stack every `interval` seconds."""
+    if not get_profiler().start(interval):
+        raise HTTPException(status_code=409, detail="The profiler is already running.")
+    return {"running": True, "interval": interval}
+
+@app.delete("/debug/profiler", response_class=PlainTextResponse)
+async def stop_profiler():
+    """Stop sampling and return the samples as collapsed stacks, ready for a flame graph tool."""
+    report = await asyncio.to_thread(get_profiler().stop)
+    if report is None:
+        raise HTTPException(status_code=409, detail="The profiler is not running.")
+    return PlainTextResponse(report)
+
+@app.get("/openlibrary/cache/stats")
+async def openlibrary_cache_stats():
+    """Report hit/miss counters and sizes of the OpenLibrary lookup cache."""
+    return app_state["openlibrary"].cache.info()
 
 @app.get("/openlibrary/{isbn}")
 async def fetch_openlibrary_info(isbn: str):
     """Fetch book details from OpenLibrary without adding to the library."""
-    book_data = get_book_details_from_openlibrary(isbn)
+    book_data = await app_state["openlibrary"].get_book_details(isbn)
     if not book_data:
         raise HTTPException(status_code=404, detail="Book not found on OpenLibrary.")
     return book_data
 
 @app.post("/books", response_model=Book, status_code=201)
-async def add_new_book(book: Book):
-    """Add a new book to the library."""
+def add_new_book(book: Book, check_duplicates: bool = False, check_isbn: bool = False):
+    """
+    Add a new book to the library.
+
+    A valid ISBN-10 or ISBN-13, with or without hyphens, is stored as its
+    ISBN-13. One with a wrong check digit is kept as entered, or with
+    `check_isbn=true` refused with a 422. With `check_duplicates=true`, a
+    book that looks like one already in the library under another ISBN is
+    refused with a 409 listing the matches.
+    """
     library = app_state["library"]
-    if any(b.isbn == book.isbn for b in library.books):
-        raise HTTPException(status_code=400, detail="Book with this ISBN already exists")
-    
     new_book = LibraryBook(**book.model_dump(exclude_none=True))
-    library.add_book(new_book)
-    # Find the book again to get the version with the timestamp
-    added_book = library.find_book(new_book.isbn)
-    return added_book.to_dict()
+    # The duplicate check and the insert happen under one lock, so two
+    # concurrent requests for the same ISBN cannot both succeed.
+    try:
+        added = library.add_book(new_book, check_duplicates=check_duplicates, check_isbn=check_isbn)
+    except InvalidISBNError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except DuplicateBookError as e:
+        candidates = [{"book": match.to_dict(), "score": round(score, 3)} for match, score in e.candidates]
+        raise HTTPException(status_code=409, detail={"message": str(e), "candidates": candidates})
+    if not added:
+        raise HTTPException(status_code=400, detail="Book with this ISBN already exists")
+    # add_book stamped date_added on the book we passed in
+    return json_response(new_book, status_code=201)
 
 @app.put("/books/{isbn}", response_model=Book)
-async def update_existing_book(isbn: str, updated_book: Book):
-    """Update an existing book's details."""
+def update_existing_book(isbn: str, updated_book: Book):
+    """
+    Update an existing book's details.
+
+    `available` is only changed when the request sets it, and a book on loan
+    cannot be made available (409); return it instead.
+    """
     library = app_state["library"]
-    book_to_update = library.find_book(isbn)
-    if book_to_update is None:
+    update_data = updated_book.model_dump(exclude={'isbn'}, exclude_none=True, exclude_unset=True)
+    with app_state["circulation"].changing_books() as on_loan:
+        if update_data.get("available") and on_loan(isbn):
+            raise HTTPException(status_code=409, detail="Book is on loan; return it to make it available.")
+        updated_book_data = library.update_book(isbn, **update_data)
+    if updated_book_data is None:
         raise HTTPException(status_code=404, detail="Book not found")
-    
-    update_data = updated_book.model_dump(exclude={'isbn'}, exclude_none=True)
-    library.update_book(isbn, **update_data)
-    
-    updated_book_data = library.find_book(isbn)
-    return updated_book_data.to_dict()
+    return json_response(updated_book_data)
+
+class BookChanges(BaseModel, extra="forbid"):
+    """Fields to change on every book of a batch; fields left out are kept."""
+    title: Optional[str] = None
+    author: Optional[str] = None
+    year: Optional[int] = None
+    available: Optional[bool] = None
+
+class BatchUpdateRequest(BaseModel):
+    isbns: List[str] = Field(..., min_length=1)
+    changes: BookChanges
+
+class BatchRemoveRequest(BaseModel):
+    isbns: List[str] = Field(..., min_length=1)
+
+def apply_batch(isbns, apply, refuse_lent=False):
+    """
+    Applies `apply(library, isbn)` to every ISBN in one batch, or to none of them.
+
+    Every ISBN is checked first, under the same lock as the changes, and no
+    book can be checked out or returned meanwhile. If any is unknown, or with
+    `refuse_lent=True` on loan, nothing changes and a 404 or 409 lists the
+    result for each ISBN.
+    """
+    library = app_state["library"]
+    with app_state["circulation"].changing_books() as on_loan:
+        # Notations of one book resolve to the key it is stored under, so it is changed once.
+        keys, missing = {}, set()
+        for isbn in isbns:
+            key = library._key_for(isbn)
+            if key is None:
+                missing.add(isbn)
+            keys.setdefault(key or isbn, isbn)
+        isbns = list(keys.values())
+        if missing:
+            results = [{"isbn": isbn, "status": "not_found" if isbn in missing else "unchanged"} for isbn in isbns]
+            raise HTTPException(status_code=404, detail={"message": "Some books were not found; nothing was changed.",
+                                                         "results": results})
+        lent = {isbn for isbn in isbns if on_loan(isbn)} if refuse_lent else set()
+        if lent:
+            results = [{"isbn": isbn, "status": "on_loan" if isbn in lent else "unchanged"} for isbn in isbns]
+            raise HTTPException(status_code=409, detail={"message": "Some books are on loan; nothing was changed.",
+                                                         "results": results})
+        return [apply(library, isbn) for isbn in isbns]
+
+@app.patch("/books")
+def update_books(request: BatchUpdateRequest):
+    """
+    Apply the same changes to many books at once, with a single write to storage.
+
+    Books on loan cannot be made available (409); return them instead.
+    """
+    changes = request.changes.model_dump(exclude_none=True)
+    def update(library, isbn):
+        book = library.update_book(isbn, **changes)
+        return {"isbn": isbn, "status": "updated" if book is not None else "not_found", "book": book}
+    return json_response({"results": apply_batch(request.isbns, update, refuse_lent=bool(changes.get("available")))})
+
+@app.delete("/books")
+def remove_books(request: BatchRemoveRequest):
+    """Remove many books at once, with a single write to storage. Books on loan are refused (409)."""
+    def remove(library, isbn):
+        return {"isbn": isbn, "status": "removed" if library.remove_book(isbn) else "not_found"}
+    return {"results": apply_batch(request.isbns, remove, refuse_lent=True)}
 
 @app.delete("/books/{isbn}", status_code=204)
-async def remove_existing_book(isbn: str):
-    """Remove a book from the library."""
+def remove_existing_book(isbn: str):
+    """Remove a book from the library. A book on loan has to be returned first (409)."""
     library = app_state["library"]
-    if not library.find_book(isbn):
+    with app_state["circulation"].changing_books() as on_loan:
+        if on_loan(isbn):
+            raise HTTPException(status_code=409, detail="Book is on loan; return it before removing it.")
+        removed = library.remove_book(isbn)
+    if not removed:
         raise HTTPException(status_code=404, detail="Book not found")
-    
-    library.remove_book(isbn)
     return {}
+
+class CheckoutRequest(BaseModel):
+    borrower: str = Field(..., min_length=1)
+    days: int = Field(LOAN_DAYS, ge=1)
+
+@app.post("/books/{isbn}/checkout", status_code=201)
+def checkout_book(isbn: str, request: CheckoutRequest):
+    """Lend a book to a borrower; it stays unavailable until it is returned."""
+    try:
+        loan = app_state["circulation"].checkout(isbn, request.borrower, request.days)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Book not found")
+    except CirculationError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return json_response(loan, status_code=201)
+
+@app.post("/books/{isbn}/return")
+def return_book(isbn: str):
+    """Return a book that is on loan."""
+    try:
+        loan = app_state["circulation"].check_in(isbn)
+    except CirculationError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return json_response(loan)
+
+@app.get("/books/{isbn}/loans")
+def get_book_loans(isbn: str):
+    """Every loan of a book, oldest first."""
+    return json_response(app_state["circulation"].history(isbn))
+
+@app.get("/loans")
+def get_borrower_loans(borrower: str):
+    """The books a borrower currently has on loan."""
+    return json_response(app_state["circulation"].on_loan_to(borrower))
+
+@app.get("/loans/overdue")
+def get_overdue_loans(as_of: Optional[date] = None):
+    """Loans still out past their due date as of a day (default today), earliest due first."""
+    return json_response(app_state["circulation"].overdue(as_of))
@@ -0,0 +1 @@
+"""Micro-benchmarks for the library hot paths. Run them from the repository root, e.g. `python -m benchmarks.bench_isbn_index`."""
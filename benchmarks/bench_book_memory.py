@@ -0,0 +1,90 @@
+"""
+Memory per book and serialization throughput of the Book representations.
+
+Compares the original plain dataclass serialized with dataclasses.asdict
+against the slotted Book with its hand-written to_dict, and the columnar store.
+Usage: python -m benchmarks.bench_book_memory [count]
+"""
+import json
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass, asdict
+
+from book import Book
+from isbns import make_isbn
+from columns import ColumnarBookMap
+
+
+@dataclass
+class PlainBook:
+    """The Book class as it was before it was slotted."""
+    title: str
+    author: str
+    isbn: str
+    year: int
+    available: bool = True
+    date_added: str = None
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def records(count):
+    """Yields synthetic book fields; authors and dates repeat as in a real catalog."""
+    for i in range(count):
+        yield (f"Title {i}", f"Author {i % 2000}", make_isbn(i), 1900 + i % 120, True, "2025-01-21T00:00:00")
+
+
+def bytes_per_book(build, count):
+    """Measures the memory retained by `build(count)`, per book."""
+    tracemalloc.start()
+    kept = build(count)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return size / count
+
+
+def build_objects(cls, count):
+    # Strings are rebuilt per record, so only interning shares them.
+    return {fields[2]: cls(*fields) for fields in records(count)}
+
+
+def build_interned(count):
+    books = {}
+    for fields in records(count):
+        book = Book(*fields)
+        book.author = sys.intern(book.author)
+        book.date_added = sys.intern(book.date_added)
+        books[book.isbn] = book
+    return books
+
+
+def build_columns(count):
+    return ColumnarBookMap((fields[2], Book(*fields)) for fields in records(count))
+
+
+def serialize_per_second(books, repeats=3):
+    """Measures how many books per second go through to_dict and json.dumps."""
+    start = time.perf_counter()
+    for _ in range(repeats):
+        json.dumps([book.to_dict() for book in books], ensure_ascii=False)
+    return len(books) * repeats / (time.perf_counter() - start)
+
+
+def main(count):
+    print(f"{count:,} books")
+    print(f"  plain dataclass        {bytes_per_book(lambda n: build_objects(PlainBook, n), count):8.1f} bytes/book")
+    print(f"  slotted Book           {bytes_per_book(lambda n: build_objects(Book, n), count):8.1f} bytes/book")
+    print(f"  slotted Book, interned {bytes_per_book(build_interned, count):8.1f} bytes/book")
+    print(f"  columnar map           {bytes_per_book(build_columns, count):8.1f} bytes/book")
+
+    plain = list(build_objects(PlainBook, count).values())
+    slotted = list(build_objects(Book, count).values())
+    print(f"  asdict + json.dumps    {serialize_per_second(plain):12,.0f} books/s")
+    print(f"  to_dict + json.dumps   {serialize_per_second(slotted):12,.0f} books/s")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
@@ -0,0 +1,49 @@
+"""
+Encode and decode times of each installed JSON codec.
+
+For every codec in `jsoncodec.CODECS` this times saving and loading a JSON
+library, indented and compact, and serializing the whole catalog as the
+/books endpoint does. The old path, `json.dumps` over a list of
+`to_dict()` results, is timed too for comparison.
+Usage: python -m benchmarks.bench_codecs [sizes...]
+"""
+import json
+import os
+import sys
+import tempfile
+
+from benchmarks.catalog import make_books
+from benchmarks.suite import best_time
+from jsoncodec import CODECS
+from storage import JSONStorage, index_by_isbn
+
+
+def run(size, directory, repeat=3):
+    """Returns {name: (best seconds, bytes or None)} for each codec and layout."""
+    books = index_by_isbn(make_books(size))
+    path = os.path.join(directory, "library.json")
+    results = {}
+    results["response_stdlib_to_dict"] = (best_time(lambda: json.dumps(
+        [book.to_dict() for book in books.values()], ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+        repeat), None)
+    for name, codec in CODECS.items():
+        results[f"response_{name}"] = (best_time(lambda: codec.dumps(list(books.values())), repeat), None)
+        for compact in (False, True):
+            layout = "compact" if compact else "indented"
+            storage = JSONStorage(path, compact=compact, codec=name)
+            results[f"save_{name}_{layout}"] = (best_time(lambda: storage.save(books), repeat), os.path.getsize(path))
+            results[f"load_{name}_{layout}"] = (best_time(storage.load, repeat), None)
+    return results
+
+
+def main(sizes):
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            for name, (seconds, size_bytes) in run(size, directory).items():
+                file_size = f"{size_bytes / 1e6:8.1f} MB" if size_bytes is not None else ""
+                print(f"{size:>9,} books  {name:<26} {seconds * 1000:10.2f} ms  {file_size}")
+        print()
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [1_000, 10_000, 100_000])
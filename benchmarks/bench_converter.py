@@ -0,0 +1,89 @@
+"""
+Throughput and peak memory of the LibraryThing converter.
+
+Writes a synthetic export of the requested size (in megabytes; pass e.g. 4096
+for a multi-GB export) to a temporary directory, then converts it with the
+streaming converter to each output format. The original approach of loading
+the whole export with json.load is measured too, for exports small enough to
+fit in memory.
+Usage: python -m benchmarks.bench_converter [megabytes]
+"""
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+
+from converter import convert_library_format, convert_record
+from isbns import isbn10, make_isbn
+
+# Above this size only the streaming converter is run.
+WHOLE_FILE_LIMIT_MB = 512
+
+
+def write_export(path, megabytes):
+    """Writes a LibraryThing-shaped export of about `megabytes` MB, one record at a time."""
+    target = megabytes * 1024 * 1024
+    written = count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("{")
+        while written < target:
+            isbn = make_isbn(count)
+            record = {
+                "title": f"Kitap {count} ve Gece", "primaryauthor": f"Yazar {count % 5000}",
+                "isbn": {"0": isbn, "2": isbn10(isbn)}, "date": str(1900 + count % 120),
+                "entrydate": "2024-05-01", "tags": ["roman", "türk edebiyatı"], "collections": ["Your library"],
+            }
+            line = f'{"," if count else ""}\n  "{count}": {json.dumps(record, ensure_ascii=False)}'
+            f.write(line)
+            written += len(line)
+            count += 1
+        f.write("\n}")
+    return count
+
+
+def convert_whole_file(input_filename, output_filename):
+    """The converter as it was before streaming: json.load, a full list, json.dump."""
+    with open(input_filename, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    converted = [convert_record(book_data) for book_data in data.values()]
+    with open(output_filename, 'w', encoding='utf-8') as f:
+        json.dump(converted, f, indent=4, ensure_ascii=False)
+    return len(converted)
+
+
+def measure(convert, source, directory):
+    """Returns (seconds, peak traced MB) for a conversion, from a timed run and a separate traced run."""
+    # tracemalloc slows allocation-heavy code several times over, so timing and tracing are separate runs.
+    # Each run writes a fresh output, so a database target starts out empty both times.
+    start = time.perf_counter()
+    convert(source, os.path.join(directory, "timed"))
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    convert(source, os.path.join(directory, "traced"))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1024 / 1024
+
+
+def main(megabytes):
+    with tempfile.TemporaryDirectory() as directory:
+        export = os.path.join(directory, "export.json")
+        count = write_export(export, megabytes)
+        print(f"{count:,} records, {os.path.getsize(export) / 1024 / 1024:,.0f} MB export")
+
+        runs = [(f"streaming, {output_format:<6}", lambda source, target, output_format=output_format:
+                 convert_library_format(source, target, output_format)) for output_format in ("json", "ndjson", "sqlite")]
+        if megabytes <= WHOLE_FILE_LIMIT_MB:
+            runs.append(("json.load, json   ", convert_whole_file))
+        for name, convert in runs:
+            with tempfile.TemporaryDirectory(dir=directory) as outputs, redirect_stdout(io.StringIO()):
+                elapsed, peak = measure(convert, export, outputs)
+            print(f"  {name} {elapsed:8.2f} s {count / elapsed:12,.0f} records/s  peak {peak:8.1f} MB")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 64)
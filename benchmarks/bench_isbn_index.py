@@ -0,0 +1,54 @@
+"""
+Per-operation latency of ISBN lookups, duplicate checks and removals.
+
+Compares the dict index kept by `Library` with the linear scan it replaced.
+Usage: python -m benchmarks.bench_isbn_index [sizes...]
+"""
+import logging
+import random
+import sys
+import time
+
+from benchmarks.catalog import MemoryStorage, make_books
+from library import Book, Library
+
+
+def per_op_us(func, args):
+    """Runs func once per argument and returns the mean latency in microseconds."""
+    start = time.perf_counter()
+    for arg in args:
+        func(arg)
+    return (time.perf_counter() - start) / len(args) * 1e6
+
+
+def run(size, samples=200):
+    books = make_books(size)
+    library = Library(storage=MemoryStorage(books))
+    targets = [book.isbn for book in random.sample(books, samples)]
+
+    linear_find = lambda isbn: next((b for b in books if b.isbn == isbn), None)
+    linear_samples = targets[:max(1, samples // 20)]  # the scan is slow at 1M
+    # Every duplicate add logs a warning; keep that out of the output and the timings.
+    logger = logging.getLogger("library")
+    level = logger.level
+    logger.setLevel(logging.CRITICAL)
+    try:
+        return {
+            "find (linear scan)": per_op_us(linear_find, linear_samples),
+            "find (index)": per_op_us(library.find_book, targets),
+            "add duplicate check": per_op_us(lambda isbn: library.add_book(Book("t", "a", isbn, 2000)), targets),
+            "remove": per_op_us(library.remove_book, targets),
+        }
+    finally:
+        logger.setLevel(level)
+
+
+def main(sizes):
+    for size in sizes:
+        for name, micros in run(size).items():
+            print(f"{size:>9,} books  {name:<22} {micros:10.2f} us/op")
+        print()
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000])
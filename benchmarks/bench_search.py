@@ -0,0 +1,52 @@
+"""
+Query latency of the full-text search index.
+
+Builds a SearchIndex over synthetic titles and authors and times a mix of
+whole-word, multi-term and search-as-you-type prefix queries. Title words are
+drawn from a Zipf-like distribution, so a few words (like "the" or "ve" in a
+real catalog) appear in a large share of all titles.
+Usage: python -m benchmarks.bench_search [sizes...]
+"""
+import random
+import sys
+import time
+
+from book import Book
+from isbns import make_isbn
+from search import SearchIndex
+
+COMMON_WORDS = ["ve", "bir", "the", "of", "and", "problem", "paradoks", "önce", "istanbul", "ışık",
+                "gece", "deniz", "yalnız", "zaman", "kitap", "roman", "hikaye", "sessiz", "kırmızı", "savaş"]
+SURNAMES = ["Yalom", "London", "Woolf", "Pamuk", "Kemal", "Atay", "Meyer", "Tolstoy", "Orwell", "Ali"]
+QUERIES = ["ve", "problem", "isik gece", "paradoks zaman yol", "tolst", "pamuk kitap", "kirmizi b", "w12"]
+
+
+def make_books(count, seed=0, vocabulary=50_000):
+    """Builds `count` books with Zipf-distributed title words."""
+    rng = random.Random(seed)
+    words = COMMON_WORDS + [f"w{i}" for i in range(vocabulary - len(COMMON_WORDS))]
+    weights = [1 / rank for rank in range(1, len(words) + 1)]
+    titles = rng.choices(words, weights, k=count * 4)
+    return [
+        Book(" ".join(titles[i * 4:i * 4 + 4]), f"{rng.choice(SURNAMES)}, A{i % 5000}", make_isbn(i), 2000)
+        for i in range(count)
+    ]
+
+
+def run(size, repeats=20):
+    index = SearchIndex()
+    start = time.perf_counter()
+    index.rebuild((book.isbn, book) for book in make_books(size))
+    print(f"{size:>9,} books  index build {time.perf_counter() - start:8.2f} s")
+    for query in QUERIES:
+        start = time.perf_counter()
+        for _ in range(repeats):
+            index.search(query, limit=20)
+        millis = (time.perf_counter() - start) / repeats * 1e3
+        print(f"{size:>9,} books  {query!r:<24} {millis:10.3f} ms/query")
+    print()
+
+
+if __name__ == "__main__":
+    for size in [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]:
+        run(size)
@@ -0,0 +1,51 @@
+"""
+Cold-start time of a JSON library, with and without the binary snapshot.
+
+A start is opening the Library and serving one lookup, which is what the API
+and the CLI do before they are useful. Parsing library.json grows with the
+catalog; opening the snapshot should take about the same time at every size.
+Usage: python -m benchmarks.bench_startup [sizes...]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.catalog import write_library
+from isbns import make_isbn
+from library import Library
+from storage import JSONStorage
+
+
+def start(path, snapshot):
+    """Returns the seconds taken to open the library at `path` and look up one book."""
+    begin = time.perf_counter()
+    library = Library(storage=JSONStorage(path, snapshot=snapshot))
+    library.find_book(make_isbn(0))
+    elapsed = time.perf_counter() - begin
+    library.close()
+    return elapsed
+
+
+def run(size, directory, repeat=3):
+    """Returns {name: best seconds} for starting a library of `size` books from JSON and from its snapshot."""
+    path = os.path.join(directory, "library.json")
+    write_library(path, size)
+    # The first start with snapshots on parses the JSON file and writes the snapshot.
+    start(path, snapshot=True)
+    return {
+        "startup_json": min(start(path, snapshot=False) for _ in range(repeat)),
+        "startup_snapshot": min(start(path, snapshot=True) for _ in range(repeat)),
+    }
+
+
+def main(sizes):
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            for name, seconds in run(size, directory).items():
+                print(f"{size:>9,} books  {name:<18} {seconds * 1000:10.2f} ms")
+        print()
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [1_000, 10_000, 100_000, 1_000_000])
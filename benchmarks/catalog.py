@@ -0,0 +1,68 @@
+"""
+Synthetic catalogs for the benchmarks.
+
+Everything here is deterministic, so two runs (or two commits) measure the
+same data.
+"""
+import json
+from contextlib import nullcontext
+
+from book import Book
+from isbns import make_isbn
+from storage import index_by_isbn
+
+SURNAMES = ["Yalom", "London", "Woolf", "Pamuk", "Kemal", "Atay", "Meyer", "Tolstoy", "Orwell", "Ali"]
+WORDS = ["Gece", "Deniz", "Zaman", "Kitap", "Sessiz", "Kırmızı", "Problem", "Paradoks", "Istanbul", "Işık"]
+
+
+def make_books(count, start=0):
+    """Builds `count` books with unique ISBNs, numbered from `start`."""
+    return [
+        Book(f"{WORDS[i % 10]} {WORDS[i // 10 % 10]} {i}", f"{SURNAMES[i % 10]} {i % 1000}", make_isbn(i),
+             1900 + i % 120, i % 7 != 0, f"2024-{i % 12 + 1:02d}-01T12:00:00")
+        for i in range(start, start + count)
+    ]
+
+
+def write_library(path, count):
+    """Writes a library.json of `count` books, in the format the Library saves."""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump([book.to_dict() for book in make_books(count)], f, indent=4, ensure_ascii=False)
+
+
+def write_export(path, count):
+    """Writes a LibraryThing export of `count` records, for the converter."""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("{")
+        for i, book in enumerate(make_books(count)):
+            record = {"title": book.title, "primaryauthor": book.author, "isbn": {"0": book.isbn},
+                      "date": str(book.year), "entrydate": "2024-05-01", "collections": ["Your library"]}
+            f.write(f'{"," if i else ""}\n  "{i}": {json.dumps(record, ensure_ascii=False)}')
+        f.write("\n}")
+
+
+class MemoryStorage:
+    """A storage backend that writes nothing, so only the Library itself is measured."""
+
+    filename = ":memory:"
+
+    def __init__(self, books=()):
+        self._books = books
+
+    def load(self):
+        return index_by_isbn(self._books)
+
+    def transaction(self):
+        return nullcontext()
+
+    def version(self):
+        return None
+
+    def persist(self, records, books):
+        return None
+
+    def save(self, books):
+        pass
+
+    def close(self):
+        pass
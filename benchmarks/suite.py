@@ -0,0 +1,249 @@
+"""
+The benchmark suite: startup and the Library, API and converter hot paths on catalogs of 1k to 1M books.
+
+Every case runs against a synthetic catalog of each requested size (see
+`benchmarks.catalog`) and reports its best time out of `--repeat` runs,
+per operation. Results are written as JSON so runs on different commits can
+be compared: with `--baseline`, every case is checked against an earlier
+results file, and the run exits with status 1 if any case got slower than
+`--threshold` allows (0.25 means 25% slower).
+
+Usage: python -m benchmarks.suite [--sizes 1000 10000 100000] [--cases find_book ...]
+                                  [--repeat 5] [--output results.json]
+                                  [--baseline results.json] [--threshold 0.25]
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+
+from benchmarks import bench_startup
+from benchmarks.catalog import MemoryStorage, make_books, write_export, write_library
+from converter import convert_library_format
+from library import Library
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+# Lookups and mutations per timed run of the per-book cases.
+SAMPLES = 1000
+
+
+def best_time(run, repeat, setup=None):
+    """Returns the best wall time of `repeat` calls of run(), calling setup() untimed before each."""
+    best = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+# Each case takes (size, working directory, repeat) and returns {case name: seconds per operation}.
+
+def bench_load_save(size, directory, repeat):
+    path = os.path.join(directory, "library.json")
+    write_library(path, size)
+    library = Library(filename=path)
+    results = {
+        "load_books": best_time(library.load_books, repeat),
+        "save_books": best_time(library.save_books, repeat),
+    }
+    library.close()
+    return results
+
+
+def bench_find_book(size, directory, repeat):
+    library = Library(storage=MemoryStorage(make_books(size)))
+    isbns = [book.isbn for book in random.Random(0).choices(make_books(size), k=SAMPLES)]
+    def run():
+        for isbn in isbns:
+            library.find_book(isbn)
+    return {"find_book": best_time(run, repeat) / SAMPLES}
+
+
+def bench_add_remove(size, directory, repeat):
+    library = Library(storage=MemoryStorage(make_books(size)))
+    new_books = []
+    def fresh_books():
+        # add_book stamps date_added on the books it is given, so every run adds new ones.
+        new_books[:] = make_books(SAMPLES, start=size)
+    def add():
+        for book in new_books:
+            library.add_book(book)
+    def remove():
+        for book in new_books:
+            library.remove_book(book.isbn)
+    added = removed = float("inf")
+    for _ in range(repeat):
+        fresh_books()
+        added = min(added, best_time(add, 1))
+        removed = min(removed, best_time(remove, 1))
+    return {"add_book": added / SAMPLES, "remove_book": removed / SAMPLES}
+
+
+def bench_api_list(size, directory, repeat):
+    from fastapi.testclient import TestClient
+    import api
+
+    path = os.path.join(directory, "library.json")
+    write_library(path, size)
+    environ = {"LIBRARY_STORAGE": "json", "LIBRARY_PATH": path,
+               "OPENLIBRARY_CACHE_PATH": os.path.join(directory, "openlibrary_cache.db")}
+    saved = {name: os.environ.get(name) for name in environ}
+    os.environ.update(environ)
+    try:
+        with redirect_stdout(io.StringIO()), TestClient(api.app) as client:
+            def get(params=None):
+                response = client.get("/books", params=params)
+                response.raise_for_status()
+                return response
+            return {
+                # Serialized from scratch: the response cache is emptied before each run.
+                "api_list_books": best_time(get, repeat, setup=api.app_state["responses"].clear),
+                "api_list_books_cached": best_time(get, repeat),
+                "api_list_page_sorted": best_time(lambda: get({"sort": "title_asc", "limit": 50, "offset": size // 2}),
+                                                  repeat, setup=api.app_state["responses"].clear),
+                # Streamed, never cached: every run serializes the whole catalog again.
+                "api_export_ndjson": best_time(lambda: client.get("/books/export", headers={"Accept-Encoding": "identity"}),
+                                               repeat),
+            }
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def bench_dedupe(size, directory, repeat):
+    library = Library(storage=MemoryStorage(make_books(size)))
+    def forget_index():
+        library._indexes.pop("duplicates", None)
+    candidates = make_books(SAMPLES, start=size)
+    def check():
+        for book in candidates:
+            library.possible_duplicates(book)
+    return {
+        # The first report builds the duplicate index; later ones only compare the blocks.
+        "dedupe_first_report": best_time(library.duplicates, repeat, setup=forget_index),
+        "dedupe_report": best_time(library.duplicates, repeat),
+        "dedupe_check": best_time(check, repeat) / SAMPLES,
+    }
+
+
+def bench_converter(size, directory, repeat):
+    source = os.path.join(directory, "export.json")
+    write_export(source, size)
+    results = {}
+    for output_format in ("json", "ndjson", "sqlite"):
+        target = os.path.join(directory, f"converted.{output_format}")
+        def run():
+            with redirect_stdout(io.StringIO()):
+                convert_library_format(source, target, output_format)
+        results[f"convert_{output_format}"] = best_time(run, repeat)
+    return results
+
+
+CASES = {
+    "startup": bench_startup.run,
+    "load_save": bench_load_save,
+    "find_book": bench_find_book,
+    "add_remove": bench_add_remove,
+    "api_list": bench_api_list,
+    "dedupe": bench_dedupe,
+    "converter": bench_converter,
+}
+
+
+def git_commit():
+    """Returns the commit being measured, or None outside a git checkout."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(sizes, cases, repeat):
+    """Runs the chosen cases at every size and returns the results document."""
+    results = []
+    for size in sizes:
+        for case in cases:
+            with tempfile.TemporaryDirectory() as directory:
+                for name, seconds in CASES[case](size, directory, repeat).items():
+                    results.append({"name": name, "size": size, "seconds": seconds})
+                    print(f"{size:>9,} books  {name:<24} {format_seconds(seconds):>12}")
+    return {
+        "commit": git_commit(),
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def format_seconds(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
+
+
+def compare(baseline, current, threshold):
+    """
+    Returns (name, size, baseline seconds, current seconds, ratio) for every
+    case in both documents whose ratio current/baseline exceeds 1 + threshold.
+    """
+    before = {(result["name"], result["size"]): result["seconds"] for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        old = before.get((result["name"], result["size"]))
+        if old:
+            ratio = result["seconds"] / old
+            if ratio > 1 + threshold:
+                regressions.append((result["name"], result["size"], old, result["seconds"], ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="catalog sizes in books, e.g. 1000 1000000")
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=list(CASES))
+    parser.add_argument("--repeat", type=int, default=5, help="runs per case; the best one counts")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="a results file from an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="fail if a case is this much slower than the baseline (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    document = run_suite(args.sizes, args.cases, args.repeat)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(document, f, indent=4)
+        print(f"Results written to '{args.output}'.")
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, document, args.threshold)
+        for name, size, old, new, ratio in regressions:
+            print(f"REGRESSION {name} at {size:,} books: {format_seconds(old)} -> {format_seconds(new)} ({ratio:.2f}x)")
+        if regressions:
+            return 1
+        print(f"No case is more than {args.threshold:.0%} slower than '{args.baseline}' ({baseline.get('commit')}).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,25 @@
+from dataclasses import dataclass
+
+@dataclass(slots=True)
+class Book:
+    """Represents a single book in the library."""
+    title: str
+    author: str
+    isbn: str
+    year: int
+    available: bool = True
+    # New field to track when the book was added
+    date_added: str = None
+
+    def to_dict(self):
+        """Converts the Book object to a dictionary."""
+        # Written out by hand: dataclasses.asdict deep-copies every field and is
+        # several times slower, which adds up when serializing the whole catalog.
+        return {
+            "title": self.title,
+            "author": self.author,
+            "isbn": self.isbn,
+            "year": self.year,
+            "available": self.available,
+            "date_added": self.date_added,
+        }
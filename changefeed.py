@@ -0,0 +1,64 @@
+"""
+Server-sent events for the Library's change feed.
+
+`ChangeNotifier` wakes up waiting asyncio tasks when the Library changes;
+the Library reports changes from whichever thread made them. `stream_changes`
+turns the feed into an SSE stream: a `changes` event with the records after
+the client's version, a `reset` event when the client is too far behind and
+must reload, and a comment line as a keep-alive when nothing happened.
+"""
+import asyncio
+import json
+
+
+class ChangeNotifier:
+    """Lets asyncio tasks wait for the next change, which may be reported from any thread."""
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._event = asyncio.Event()
+
+    def notify(self, version=None):
+        """Wakes every waiter. Safe to call from any thread; fits `Library.subscribe`."""
+        self._loop.call_soon_threadsafe(self._fire)
+
+    def _fire(self):
+        self._event.set()
+        self._event = asyncio.Event()
+
+    def next_change(self):
+        """Returns an awaitable event that is set by the next notification."""
+        return self._event
+
+
+def format_event(event, data, event_id=None):
+    """Formats one server-sent event."""
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
+
+
+async def stream_changes(library, notifier, since, is_disconnected, poll_interval=15.0):
+    """
+    Yields SSE messages for every change after version `since`, until the client disconnects.
+
+    Besides waking on notifications, the feed is checked every
+    `poll_interval` seconds, which picks up changes made by other worker
+    processes and keeps idle connections alive.
+    """
+    while not await is_disconnected():
+        # Take the event before reading the feed, so a change in between is not missed.
+        next_change = notifier.next_change()
+        version, changes = await asyncio.to_thread(library.changes_since, since)
+        if changes is None:
+            yield format_event("reset", {"version": version}, version)
+        elif changes:
+            yield format_event("changes", {"version": version, "changes": changes}, version)
+        else:
+            yield ": keep-alive\n\n"
+        since = version
+        try:
+            await asyncio.wait_for(next_change.wait(), poll_interval)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,293 @@
+"""
+Circulation: checking books out to borrowers and back in.
+
+Every loan is kept as history. The loans currently out are indexed three
+ways, so the everyday questions never scan the catalog or the history: by
+ISBN (is this book out?), by borrower (what does X have?), and by due date,
+kept sorted so that "overdue as of a day" is a binary search. A book's
+`available` flag follows its loans: code that edits or removes books
+does it inside `changing_books`, and leaves a book that is out as it is.
+
+Loans are stored in an append-only journal next to the library file, which
+belongs to a single process. A library in SQLite, which several API workers
+can share, keeps its loans in a `loans` table of the same database instead
+(`SQLiteCirculation`), where the database itself answers those questions.
+"""
+import os
+import sqlite3
+from bisect import bisect_left, insort
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import date, timedelta
+from journal import Journal
+from locks import RWLock
+from storage import SQLiteStorage
+
+# The default loan period, in days.
+LOAN_DAYS = 14
+
+
+class CirculationError(Exception):
+    """A checkout or return that the current loans do not allow."""
+
+
+@dataclass(slots=True)
+class Loan:
+    """One checkout of a book; dates are ISO strings, `returned` is None while it is out."""
+    loan_id: int
+    isbn: str
+    borrower: str
+    checked_out: str
+    due: str
+    returned: str = None
+
+    def to_dict(self):
+        return {
+            "loan_id": self.loan_id,
+            "isbn": self.isbn,
+            "borrower": self.borrower,
+            "checked_out": self.checked_out,
+            "due": self.due,
+            "returned": self.returned,
+        }
+
+
+class Circulation:
+    """Keeps the loans of a Library and the indexes that answer questions about them."""
+
+    def __init__(self, library, path, today=date.today):
+        self.library = library
+        self._today = today
+        self._lock = RWLock()
+        # Every loan by id, oldest first.
+        self._loans = {}
+        # The history of each book, as loan ids.
+        self._history = {}
+        # Loans that are out: by ISBN, by borrower (an ordered set of ids per
+        # borrower), and as sorted (due date, loan id) pairs.
+        self._out_by_isbn = {}
+        self._out_by_borrower = {}
+        self._due = []
+        self._journal = Journal(path)
+        for record in self._journal.records():
+            self._apply(record)
+        self._next_id = max(self._loans, default=0) + 1
+
+    def _apply(self, record):
+        """Applies one journal record to the loans and their indexes."""
+        if record["op"] == "checkout":
+            loan = Loan(**record["loan"])
+            self._loans[loan.loan_id] = loan
+            self._history.setdefault(loan.isbn, []).append(loan.loan_id)
+            self._out_by_isbn[loan.isbn] = loan
+            self._out_by_borrower.setdefault(loan.borrower, {})[loan.loan_id] = None
+            insort(self._due, (loan.due, loan.loan_id))
+        elif record["op"] == "return":
+            loan = self._loans[record["loan_id"]]
+            loan.returned = record["returned"]
+            del self._out_by_isbn[loan.isbn]
+            borrowed = self._out_by_borrower[loan.borrower]
+            del borrowed[loan.loan_id]
+            if not borrowed:
+                del self._out_by_borrower[loan.borrower]
+            del self._due[bisect_left(self._due, (loan.due, loan.loan_id))]
+
+    def _stored_isbn(self, isbn):
+        """Returns the ISBN the library keeps a book under, given any notation of it (see `Library.find_book`)."""
+        if isbn in self._history:
+            return isbn
+        book = self.library.find_book(isbn)
+        return book.isbn if book is not None else isbn
+
+    def checkout(self, isbn, borrower, days=LOAN_DAYS):
+        """
+        Lends a book to a borrower for `days` days and returns the new Loan.
+
+        Raises KeyError if the library has no such book and CirculationError
+        if it is already on loan.
+        """
+        borrower = borrower.strip()
+        if not borrower:
+            raise CirculationError("A borrower is required.")
+        with self._lock.write():
+            book = self.library.find_book(isbn)
+            if book is None:
+                raise KeyError(isbn)
+            isbn = book.isbn
+            if isbn in self._out_by_isbn:
+                raise CirculationError(f"Book with ISBN {isbn} is already on loan.")
+            today = self._today()
+            loan = Loan(self._next_id, isbn, borrower, today.isoformat(), (today + timedelta(days=days)).isoformat())
+            record = {"op": "checkout", "loan": loan.to_dict()}
+            self._journal.append(record)
+            self._apply(record)
+            self._next_id += 1
+            self.library.update_book(isbn, available=False)
+        return self._loans[loan.loan_id]
+
+    def check_in(self, isbn):
+        """Returns a book that is on loan and returns the closed Loan. Raises CirculationError if it is not out."""
+        with self._lock.write():
+            loan = self._out_by_isbn.get(self._stored_isbn(isbn))
+            if loan is None:
+                raise CirculationError(f"Book with ISBN {isbn} is not on loan.")
+            isbn = loan.isbn
+            record = {"op": "return", "loan_id": loan.loan_id, "returned": self._today().isoformat()}
+            self._journal.append(record)
+            self._apply(record)
+            self.library.update_book(isbn, available=True)
+        return loan
+
+    def current_loan(self, isbn):
+        """Returns the loan a book is out on, or None."""
+        with self._lock.read():
+            return self._out_by_isbn.get(self._stored_isbn(isbn))
+
+    @contextmanager
+    def changing_books(self):
+        """
+        Holds off checkouts and returns while the caller changes books in one `Library.batch`.
+
+        Yields a function that tells whether a book, in any notation, is on loan.
+        """
+        with self._lock.read(), self.library.batch():
+            yield lambda isbn: self._stored_isbn(isbn) in self._out_by_isbn
+
+    def on_loan_to(self, borrower):
+        """Returns the loans a borrower currently has, oldest first."""
+        with self._lock.read():
+            return [self._loans[loan_id] for loan_id in self._out_by_borrower.get(borrower.strip(), ())]
+
+    def history(self, isbn):
+        """Returns every loan of a book, oldest first."""
+        with self._lock.read():
+            return [self._loans[loan_id] for loan_id in self._history.get(self._stored_isbn(isbn), ())]
+
+    def overdue(self, as_of=None):
+        """Returns the loans still out whose due date is before `as_of` (default today), earliest due first."""
+        as_of = (as_of or self._today()).isoformat()
+        with self._lock.read():
+            return [self._loans[loan_id] for due, loan_id in self._due[:bisect_left(self._due, (as_of,))]]
+
+    def close(self):
+        self._journal.close()
+
+
+class SQLiteCirculation:
+    """
+    Keeps the loans of a Library stored in SQLite in a table of the same database.
+
+    Every worker sharing the database sees the same loans. A checkout or
+    return runs in one `Library.batch`, so the loan and the book's
+    `available` flag are committed together under the database's write
+    lock, and two workers can never lend the same book or hand out the same
+    loan id.
+    """
+
+    _COLUMNS = "loan_id, isbn, borrower, checked_out, due, returned"
+
+    def __init__(self, library, today=date.today):
+        self.library = library
+        self._today = today
+        self._db = library.storage.connection
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS loans (
+                loan_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                isbn TEXT NOT NULL,
+                borrower TEXT NOT NULL,
+                checked_out TEXT NOT NULL,
+                due TEXT NOT NULL,
+                returned TEXT
+            );
+            CREATE INDEX IF NOT EXISTS loans_isbn ON loans (isbn);
+            CREATE UNIQUE INDEX IF NOT EXISTS loans_out ON loans (isbn) WHERE returned IS NULL;
+            CREATE INDEX IF NOT EXISTS loans_out_by_borrower ON loans (borrower) WHERE returned IS NULL;
+            CREATE INDEX IF NOT EXISTS loans_out_by_due ON loans (due) WHERE returned IS NULL;
+        """)
+        self._db.commit()
+
+    def _select(self, where, params):
+        rows = self._db.execute(f"SELECT {self._COLUMNS} FROM loans WHERE {where}", params).fetchall()
+        return [Loan(*row) for row in rows]
+
+    def _stored_isbn(self, isbn):
+        """Returns the ISBN the library keeps a book under, given any notation of it (see `Library.find_book`)."""
+        if self._db.execute("SELECT 1 FROM loans WHERE isbn = ?", (isbn,)).fetchone() is not None:
+            return isbn
+        book = self.library.find_book(isbn)
+        return book.isbn if book is not None else isbn
+
+    def checkout(self, isbn, borrower, days=LOAN_DAYS):
+        """Lends a book like `Circulation.checkout`."""
+        borrower = borrower.strip()
+        if not borrower:
+            raise CirculationError("A borrower is required.")
+        with self.library.batch():
+            book = self.library.find_book(isbn)
+            if book is None:
+                raise KeyError(isbn)
+            today = self._today()
+            loan = Loan(None, book.isbn, borrower, today.isoformat(), (today + timedelta(days=days)).isoformat())
+            try:
+                # The unique index on loans that are out refuses a second one for the same book.
+                (loan.loan_id,) = self._db.execute(
+                    "INSERT INTO loans (isbn, borrower, checked_out, due) VALUES (?, ?, ?, ?) RETURNING loan_id",
+                    (loan.isbn, loan.borrower, loan.checked_out, loan.due),
+                ).fetchone()
+            except sqlite3.IntegrityError:
+                raise CirculationError(f"Book with ISBN {loan.isbn} is already on loan.")
+            self.library.update_book(loan.isbn, available=False)
+        return loan
+
+    def check_in(self, isbn):
+        """Returns a book like `Circulation.check_in`."""
+        with self.library.batch():
+            loans = self._select("isbn = ? AND returned IS NULL", (self._stored_isbn(isbn),))
+            if not loans:
+                raise CirculationError(f"Book with ISBN {isbn} is not on loan.")
+            loan = loans[0]
+            loan.returned = self._today().isoformat()
+            self._db.execute("UPDATE loans SET returned = ? WHERE loan_id = ?", (loan.returned, loan.loan_id))
+            self.library.update_book(loan.isbn, available=True)
+        return loan
+
+    def current_loan(self, isbn):
+        """Returns the loan a book is out on, or None."""
+        loans = self._select("isbn = ? AND returned IS NULL", (self._stored_isbn(isbn),))
+        return loans[0] if loans else None
+
+    @contextmanager
+    def changing_books(self):
+        """Holds off checkouts and returns like `Circulation.changing_books`: the batch holds the database's write lock."""
+        with self.library.batch():
+            yield lambda isbn: self.current_loan(isbn) is not None
+
+    def on_loan_to(self, borrower):
+        """Returns the loans a borrower currently has, oldest first."""
+        return self._select("borrower = ? AND returned IS NULL ORDER BY loan_id", (borrower.strip(),))
+
+    def history(self, isbn):
+        """Returns every loan of a book, oldest first."""
+        return self._select("isbn = ? ORDER BY loan_id", (self._stored_isbn(isbn),))
+
+    def overdue(self, as_of=None):
+        """Returns the loans still out whose due date is before `as_of` (default today), earliest due first."""
+        as_of = (as_of or self._today()).isoformat()
+        return self._select("returned IS NULL AND due < ? ORDER BY due, loan_id", (as_of,))
+
+    def close(self):
+        """Nothing to do: the loans are committed with every change, and the Library closes the database."""
+
+
+def open_circulation(library):
+    """
+    Opens the loans of a library.
+
+    A library stored in SQLite keeps them in the same database. Otherwise
+    they are kept in LIBRARY_LOANS_PATH, by default next to the library
+    file as `<library file>.loans`.
+    """
+    if isinstance(library.storage, SQLiteStorage):
+        return SQLiteCirculation(library)
+    path = os.environ.get("LIBRARY_LOANS_PATH") or f"{library.filename}.loans"
+    return Circulation(library, path)
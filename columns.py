@@ -0,0 +1,91 @@
+"""
+A column-oriented in-memory store for very large catalogs.
+
+Instead of one Book object per record, `ColumnarBookMap` keeps one list or
+array per field. Authors and dates are interned, so a prolific author's name is
+stored once, and years and availability flags live in compact typed arrays.
+Books are materialized on access; like the SQLite backend, a Book returned from
+the map is a copy and changes must be written back with `map[key] = book`,
+which `Library.update_book` already does.
+"""
+import sys
+from array import array
+from collections.abc import MutableMapping
+from book import Book
+
+
+class ColumnarBookMap(MutableMapping):
+    """A mapping of ISBN to Book stored as parallel columns."""
+
+    # Rebuild the columns once this share of the rows are deleted.
+    COMPACT_RATIO = 0.5
+
+    def __init__(self, items=()):
+        self._rows = {}
+        self._titles = []
+        self._authors = []
+        self._isbns = []
+        self._years = array('i')
+        self._available = bytearray()
+        self._dates = []
+        self._deleted = 0
+        for key, book in items:
+            self[key] = book
+
+    def __getitem__(self, key):
+        row = self._rows[key]
+        return Book(self._titles[row], self._authors[row], self._isbns[row], self._years[row],
+                    bool(self._available[row]), self._dates[row])
+
+    def __setitem__(self, key, book):
+        author = sys.intern(book.author)
+        date_added = sys.intern(book.date_added) if book.date_added is not None else None
+        row = self._rows.get(key)
+        if row is None:
+            self._rows[key] = len(self._titles)
+            self._titles.append(book.title)
+            self._authors.append(author)
+            self._isbns.append(book.isbn)
+            self._years.append(book.year)
+            self._available.append(bool(book.available))
+            self._dates.append(date_added)
+            return
+        self._titles[row] = book.title
+        self._authors[row] = author
+        self._isbns[row] = book.isbn
+        self._years[row] = book.year
+        self._available[row] = bool(book.available)
+        self._dates[row] = date_added
+
+    def __delitem__(self, key):
+        row = self._rows.pop(key)
+        # Leave a hole so later rows keep their positions; `_compact`
+        # squeezes the holes out once enough of them pile up.
+        self._titles[row] = None
+        self._deleted += 1
+        if self._deleted > len(self._titles) * self.COMPACT_RATIO:
+            self._compact()
+
+    def _compact(self):
+        # The rows dict is already in row order.
+        keep = list(self._rows.items())
+        rows = [row for key, row in keep]
+        self._titles = [self._titles[row] for row in rows]
+        self._authors = [self._authors[row] for row in rows]
+        self._isbns = [self._isbns[row] for row in rows]
+        self._years = array('i', (self._years[row] for row in rows))
+        self._available = bytearray(self._available[row] for row in rows)
+        self._dates = [self._dates[row] for row in rows]
+        self._rows = {key: position for position, (key, row) in enumerate(keep)}
+        self._deleted = 0
+
+    def __contains__(self, key):
+        return key in self._rows
+
+    def __iter__(self):
+        # The rows dict is insertion-ordered, and updates keep their row, so
+        # this matches the order of a plain dict.
+        return iter(self._rows)
+
+    def __len__(self):
+        return len(self._rows)
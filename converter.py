@@ -1,71 +1,322 @@
+"""
+Converts a LibraryThing JSON export to the format used by our app.
+
+The export is parsed and converted one record at a time, so memory use stays
+the same however large the export is. The output can be a JSON array (the
+library.json format), newline-delimited JSON, or a SQLite library database.
+JSON output is encoded with the fastest installed `jsoncodec` codec; a JSON
+array is indented like library.json unless `--compact` is given:
+
+    python converter.py [export.json] [output] [--format json|ndjson|sqlite] [--compact]
+"""
 import json
+import os
+import re
+import sys
 from datetime import datetime
+from book import Book
+from isbns import MISSING, canonical_isbn, has_wrong_check_digit, placeholder_isbn
+from jsoncodec import get_codec
+from storage import SQLiteStorage
+
+OUTPUT_FORMATS = ("json", "ndjson", "sqlite")
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# json.dumps builds a new encoder for every call that passes options; reuse one.
+_encode = json.JSONEncoder(ensure_ascii=False).encode
+
+
+def convert_isbn(book_data, book_id=None):
+    """
+    Picks the ISBN of a LibraryThing record.
+
+    Exports give it under "isbn" (a dict of forms, a list or a string) and
+    sometimes "originalisbn". The first valid ISBN wins and is converted to
+    its ISBN-13; if none is valid, the first one given is kept as it is,
+    as the Library keeps it, and `convert_library_format` reports how many
+    were. A record without any gets a placeholder of its own, "N/A-<book
+    id>", so such records do not all end up under the same key.
+    """
+    isbn_info = book_data.get('isbn')
+    if isinstance(isbn_info, dict):
+        candidates = list(isbn_info.values())
+    elif isinstance(isbn_info, list):
+        candidates = list(isbn_info)
+    else:
+        candidates = [isbn_info]
+    candidates.append(book_data.get('originalisbn'))
+    candidates = [candidate.strip() for candidate in candidates if isinstance(candidate, str) and candidate.strip()]
+    for candidate in candidates:
+        canonical = canonical_isbn(candidate)
+        if canonical is not None:
+            return canonical
+    if candidates:
+        return candidates[0]
+    return placeholder_isbn(book_id) if book_id is not None else MISSING
+
+
+def convert_record(book_data, book_id=None):
+    """Normalizes one LibraryThing record, with the given book id, into our book fields."""
+    title = book_data.get('title', 'N/A')
+    author = book_data.get('primaryauthor', 'N/A')
+    isbn = convert_isbn(book_data, book_id)
+
+    try:
+        year = int(book_data.get('date', '0'))
+    except (ValueError, TypeError):
+        year = 0
+
+    # Use the 'entrydate' from the original file for the 'date_added' field
+    # This provides a more meaningful timestamp for your existing books.
+    date_added_str = book_data.get('entrydate', datetime.now().strftime('%Y-%m-%d'))
+    try:
+        # Convert to ISO format for consistent sorting
+        date_added_iso = datetime.strptime(date_added_str, '%Y-%m-%d').isoformat()
+    except ValueError:
+        date_added_iso = datetime.now().isoformat()
+
+    return {
+        "title": title,
+        "author": author,
+        "isbn": isbn,
+        "year": year,
+        "available": True,
+        "date_added": date_added_iso
+    }
+
+
+class _StreamParser:
+    """Decodes JSON values one at a time from a text file, reading it in chunks."""
+
+    def __init__(self, f, chunk_size):
+        self._f = f
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    def _read_more(self):
+        chunk = self._f.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        # Drop what has been consumed so the buffer never holds more than the current value.
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def peek(self):
+        """Skips whitespace and returns the next character, or "" at the end of the file."""
+        while True:
+            self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._read_more():
+                return ""
+
+    def expect(self, characters):
+        """Consumes the next character, which must be one of `characters`."""
+        character = self.peek()
+        if not character or character not in characters:
+            self.fail(f"Expecting one of {characters!r}")
+        self._pos += 1
+        return character
+
+    def fail(self, message):
+        raise json.JSONDecodeError(message, self._buffer, self._pos)
+
+    def value(self):
+        """Decodes the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                # A value that runs to the end of the buffer may be cut short (e.g. a number).
+                if end < len(self._buffer) or self._eof:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            self._read_more()
+
 
-def convert_library_format(input_filename, output_filename):
+def iter_export(f, chunk_size=1 << 16):
+    """
+    Yields the (book id, record) pairs of a LibraryThing export one at a time.
+
+    The export is one big JSON object; it is read `chunk_size` characters at
+    a time and only the record being decoded is held in memory.
+    """
+    parser = _StreamParser(f, chunk_size)
+    parser.expect("{")
+    if parser.peek() == "}":
+        parser.expect("}")
+    else:
+        while True:
+            if parser.peek() != '"':
+                parser.expect('"')
+            book_id = parser.value()
+            parser.expect(":")
+            yield book_id, parser.value()
+            if parser.expect(",}") == "}":
+                break
+    if parser.peek():
+        parser.fail("Extra data")
+
+
+def _dump_indented(record):
+    """Formats a flat record as `json.dump(list, f, indent=4)` formats a list item."""
+    # The C encoder is skipped whenever indent is set, so format the fields by hand.
+    fields = ",\n".join(f"        {_encode(key)}: {_encode(value)}"
+                        for key, value in record.items())
+    return f"    {{\n{fields}\n    }}" if fields else "    {}"
+
+
+def write_json_array(records, f, compact=False):
+    """
+    Writes flat records to a binary file as a JSON array.
+
+    The array is indented exactly as `json.dump(list, f, indent=4)` would,
+    or with `compact=True` written without whitespace, which is smaller and
+    several times faster to produce.
+    """
+    dumps = get_codec().dumps
+    count = 0
+    for record in records:
+        if compact:
+            f.write(b"[" if count == 0 else b",")
+            f.write(dumps(record))
+        else:
+            f.write(b"[\n" if count == 0 else b",\n")
+            f.write(_dump_indented(record).encode("utf-8"))
+        count += 1
+    f.write((b"]" if compact else b"\n]") if count else b"[]")
+    return count
+
+
+def write_ndjson(records, f):
+    """Writes records to a binary file as newline-delimited JSON, one record per line."""
+    dumps = get_codec().dumps
+    count = 0
+    for record in records:
+        f.write(dumps(record))
+        f.write(b"\n")
+        count += 1
+    return count
+
+
+def write_to_storage(records, storage, batch_size=1000):
+    """
+    Adds records to a storage backend, persisting them `batch_size` at a time.
+
+    Records whose ISBN is already stored are skipped, as in
+    `storage.migrate_json_to_sqlite`. Memory stays flat with backends that do
+    not hold the catalog in memory, such as `SQLiteStorage`. Returns a
+    (copied, skipped) tuple of counts.
+    """
+    books = storage.load()
+    copied = skipped = 0
+    batch = []
+    for record in records:
+        book = Book(**record)
+        if book.isbn in books:
+            skipped += 1
+            continue
+        books[book.isbn] = book
+        batch.append({"op": "add", "book": record})
+        copied += 1
+        if len(batch) >= batch_size:
+            storage.persist(batch, books)
+            batch = []
+    if batch:
+        storage.persist(batch, books)
+    return copied, skipped
+
+
+def convert_library_format(input_filename, output_filename, output_format="json", chunk_size=1 << 16,
+                           compact=False):
     """
     Converts a LibraryThing JSON export to the format used by our app,
     ensuring correct handling of UTF-8 characters and adding the date_added field.
+
+    `output_format` is "json" (the library.json format), "ndjson" or
+    "sqlite"; with `compact=True` a JSON array is written without
+    indentation. Records are streamed from the export to the output, so the
+    export never has to fit in memory. File outputs are written to a
+    temporary file first and only replace `output_filename` once the whole
+    export has converted; a SQLite database keeps the batches committed
+    before an error. Returns the number of books written.
     """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format '{output_format}'. Choose one of: {', '.join(OUTPUT_FORMATS)}.")
     try:
-        with open(input_filename, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        source = open(input_filename, 'r', encoding='utf-8')
     except FileNotFoundError:
         print(f"Error: The file '{input_filename}' was not found.")
         return
-    except json.JSONDecodeError:
-        print(f"Error: The file '{input_filename}' is not a valid JSON file.")
-        return
 
-    converted_books = []
-    for book_id, book_data in data.items():
-        title = book_data.get('title', 'N/A')
-        author = book_data.get('primaryauthor', 'N/A')
-        
-        isbn_info = book_data.get('isbn')
-        isbn = "N/A"
-        if isinstance(isbn_info, dict):
-            isbn = isbn_info.get('0', 'N/A')
-        elif isinstance(isbn_info, list) and isbn_info:
-            isbn = isbn_info[0]
-        elif isinstance(isbn_info, str):
-            isbn = isbn_info
-        
-        if isbn == "N/A" and 'originalisbn' in book_data:
-            isbn = book_data['originalisbn']
+    flagged = 0
 
+    def convert(book_id, book_data):
+        nonlocal flagged
+        record = convert_record(book_data, book_id)
+        if has_wrong_check_digit(record["isbn"]):
+            flagged += 1
+        return record
+
+    with source:
+        records = (convert(book_id, book_data) for book_id, book_data in iter_export(source, chunk_size))
         try:
-            year = int(book_data.get('date', '0'))
-        except (ValueError, TypeError):
-            year = 0
-            
-        # Use the 'entrydate' from the original file for the 'date_added' field
-        # This provides a more meaningful timestamp for your existing books.
-        date_added_str = book_data.get('entrydate', datetime.now().strftime('%Y-%m-%d'))
-        try:
-            # Convert to ISO format for consistent sorting
-            date_added_iso = datetime.strptime(date_added_str, '%Y-%m-%d').isoformat()
-        except ValueError:
-            date_added_iso = datetime.now().isoformat()
-
-
-        new_book = {
-            "title": title,
-            "author": author,
-            "isbn": isbn,
-            "year": year,
-            "available": True,
-            "date_added": date_added_iso
-        }
-        converted_books.append(new_book)
+            if output_format == "sqlite":
+                storage = SQLiteStorage(output_filename)
+                try:
+                    count, skipped = write_to_storage(records, storage)
+                finally:
+                    storage.close()
+                if skipped:
+                    print(f"Skipped {skipped} records whose ISBN was already present.")
+            else:
+                temp_filename = output_filename + ".tmp"
+                try:
+                    with open(temp_filename, 'wb') as f:
+                        if output_format == "json":
+                            count = write_json_array(records, f, compact)
+                        else:
+                            count = write_ndjson(records, f)
+                    os.replace(temp_filename, output_filename)
+                finally:
+                    if os.path.exists(temp_filename):
+                        os.remove(temp_filename)
+        except json.JSONDecodeError:
+            print(f"Error: The file '{input_filename}' is not a valid JSON file.")
+            return
+        except IOError as e:
+            print(f"Error writing to file '{output_filename}': {e}")
+            return
 
-    try:
-        with open(output_filename, 'w', encoding='utf-8') as f:
-            json.dump(converted_books, f, indent=4, ensure_ascii=False)
-        print(f"Successfully converted {len(converted_books)} books.")
-        print(f"New file saved as '{output_filename}'")
-    except IOError as e:
-        print(f"Error writing to file '{output_filename}': {e}")
+    print(f"Successfully converted {count} books.")
+    if flagged:
+        print(f"Kept {flagged} ISBNs with a wrong check digit as they are.")
+    print(f"New file saved as '{output_filename}'")
+    return count
 
 
 if __name__ == "__main__":
-    convert_library_format('librarything_umuthasanoglu.json', 'library.json')
+    args = sys.argv[1:]
+    output_format = "json"
+    if "--format" in args:
+        position = args.index("--format")
+        output_format = args[position + 1] if position + 1 < len(args) else ""
+        del args[position:position + 2]
+    compact = "--compact" in args
+    if compact:
+        args.remove("--compact")
+    source = args[0] if args else 'librarything_umuthasanoglu.json'
+    target = args[1] if len(args) > 1 else ('library.db' if output_format == "sqlite" else 'library.json')
+    try:
+        convert_library_format(source, target, output_format, compact=compact)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
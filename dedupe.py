@@ -0,0 +1,266 @@
+"""
+Finds books that are probably the same work entered more than once.
+
+Imported catalogs hold near-duplicates that an ISBN check cannot catch: the
+same title and author under different ISBNs (other editions, or the "N/A"
+placeholders of records without one), and spelling or transliteration variants such as
+"Dostoyevski, Fyodor" and "Fyodor Dostoevsky". Comparing every pair of books
+would take hours on a large catalog, so `DuplicateIndex` only compares books
+that share a blocking key:
+
+* the author's surname (taken to be the longest word of the name) plus one
+  of the MinHash values of the title words, so titles by the same author
+  that share most of their words usually land in the same block. Words of
+  three letters or fewer are left out, as they are mostly articles and
+  conjunctions ("The Brothers Karamazov", "Suç ve Ceza");
+* the normalized title, for the same title under differently spelled authors;
+* the canonical ISBN, for repeated records of a real ISBN, even when one
+  was entered as ISBN-10 and the other as ISBN-13.
+
+Each pair in a block is then scored by the trigram similarity of the titles
+and of the authors; an author whose names are all part of the other's, such
+as "F. Dostoevsky" and "Fyodor Dostoevsky", counts as the same. Titles that carry different numbers ("Volume 1" and
+"Volume 2") are never duplicates. Blocks that are too large to compare
+pairwise, e.g. a prolific author, are compared in sorted-neighbourhood
+fashion instead: sorted by title, each book against the next few. Checking
+a single book skips them.
+
+Text is normalized like `search.normalize`, so case and accents never matter.
+"""
+import zlib
+from functools import lru_cache
+from isbns import canonical_isbn, is_placeholder
+from search import tokenize
+
+# Pairs that score at least this much are reported as duplicates.
+MIN_SCORE = 0.75
+# Titles less similar than this are never duplicates, whatever the authors.
+MIN_TITLE_SIMILARITY = 0.6
+# How much the title counts towards a pair's score; the author makes up the rest.
+TITLE_WEIGHT = 0.7
+# Author similarity assumed when either author is unknown.
+UNKNOWN_AUTHOR_SIMILARITY = 0.5
+UNKNOWN = frozenset({"", "unknown", "anonymous"})
+# Blocks larger than this are compared against a sliding window of neighbours.
+MAX_BLOCK = 50
+WINDOW = 5
+# Fixed masks that turn one token hash into independent MinHash orderings.
+_MINHASH_MASKS = (0x5BD1E995, 0x9E3779B9, 0x85EBCA6B)
+
+
+class DuplicateBookError(ValueError):
+    """Raised by `Library.add_book(check_duplicates=True)` for a probable duplicate; `candidates` are (book, score) pairs."""
+
+    def __init__(self, book, candidates):
+        super().__init__(f"'{book.title}' by {book.author} looks like a book already in the library.")
+        self.book = book
+        self.candidates = candidates
+
+
+@lru_cache(maxsize=1 << 16)
+def _author_key(author):
+    """Returns (normalized name, surname) for an author; catalogs repeat authors a lot, so results are cached."""
+    # Word order and initials vary between catalogs: "Tolkien, J.R.R." is "J. R. R. Tolkien".
+    names = sorted(token for token in tokenize(author) if len(token) > 1)
+    return " ".join(names), max(names, key=len) if names else ""
+
+
+class _Profile:
+    """The normalized fields of one book that blocking and scoring use."""
+
+    __slots__ = ("title", "author", "surname", "numbers", "isbn", "_title_grams", "_author_grams")
+
+    def __init__(self, book):
+        title_tokens = tokenize(book.title)
+        self.title = " ".join(title_tokens)
+        self.author, self.surname = _author_key(book.author)
+        self.numbers = frozenset(filter(str.isdigit, title_tokens))
+        self.isbn = None if is_placeholder(book.isbn) else canonical_isbn(book.isbn) or book.isbn
+        self._title_grams = self._author_grams = None
+
+    def blocking_keys(self):
+        keys = []
+        if self.title:
+            keys.append(("title", self.title))
+            if self.author not in UNKNOWN:
+                words = self.title.split()
+                words = {word for word in words if len(word) > 3} or words
+                hashes = [zlib.crc32(word.encode("utf-8")) for word in words]
+                surname = self.surname
+                for i, mask in enumerate(_MINHASH_MASKS):
+                    keys.append(("author", surname, i, min(map(mask.__xor__, hashes))))
+        if self.isbn is not None:
+            keys.append(("isbn", self.isbn))
+        return keys
+
+    def title_grams(self):
+        if self._title_grams is None:
+            self._title_grams = _trigrams(self.title)
+        return self._title_grams
+
+    def author_grams(self):
+        if self._author_grams is None:
+            self._author_grams = _trigrams(self.author)
+        return self._author_grams
+
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def _jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _containment(a, b):
+    """The share of the shorter list of names that also appears in the other one."""
+    shorter, longer = (a, b) if len(a) <= len(b) else (b, a)
+    return sum(name in longer for name in shorter) / len(shorter)
+
+
+def score(a, b):
+    """Returns how likely two profiles are the same book, from 0 to 1, or 0 if they cannot be."""
+    if a.isbn is not None and a.isbn == b.isbn:
+        return 1.0
+    if not a.title or a.numbers != b.numbers:
+        return 0.0
+    title = 1.0 if a.title == b.title else _jaccard(a.title_grams(), b.title_grams())
+    if title < MIN_TITLE_SIMILARITY:
+        return 0.0
+    if a.author in UNKNOWN or b.author in UNKNOWN:
+        author = UNKNOWN_AUTHOR_SIMILARITY
+    else:
+        author = 1.0 if a.author == b.author else max(_jaccard(a.author_grams(), b.author_grams()),
+                                                     _containment(a.author.split(), b.author.split()))
+    return TITLE_WEIGHT * title + (1 - TITLE_WEIGHT) * author
+
+
+class DuplicateIndex:
+    """Maps blocking keys to the books that have them, so candidate duplicates are found without pairwise scans."""
+
+    def __init__(self):
+        # mapping key -> _Profile
+        self._profiles = {}
+        # blocking key -> set of mapping keys
+        self._blocks = {}
+
+    def rebuild(self, items):
+        self._profiles = {}
+        self._blocks = {}
+        for key, book in items:
+            self.add(key, book)
+
+    def add(self, key, book):
+        profile = _Profile(book)
+        self._profiles[key] = profile
+        for block in profile.blocking_keys():
+            self._blocks.setdefault(block, set()).add(key)
+
+    def discard(self, key, book):
+        profile = self._profiles.pop(key, None)
+        if profile is None:
+            return
+        for block in profile.blocking_keys():
+            keys = self._blocks.get(block)
+            if keys is None:
+                continue
+            keys.discard(key)
+            if not keys:
+                del self._blocks[block]
+
+    def candidates(self, book, exclude=None):
+        """Returns [(mapping key, score)] of the indexed books that are probably duplicates of `book`, best first."""
+        profile = _Profile(book)
+        scores = {}
+        for block in profile.blocking_keys():
+            keys = self._blocks.get(block, ())
+            # Sorting an oversized block for every check would cost more than the
+            # check is worth; the other blocking keys still find most matches.
+            if len(keys) > MAX_BLOCK:
+                continue
+            for key in keys:
+                if key != exclude and key not in scores:
+                    scores[key] = score(profile, self._profiles[key])
+        return sorted(((key, s) for key, s in scores.items() if s >= MIN_SCORE), key=lambda item: -item[1])
+
+    def _pairs(self, keys):
+        """Yields the pairs of a block worth scoring."""
+        if len(keys) <= MAX_BLOCK:
+            keys = list(keys)
+            for i, a in enumerate(keys):
+                for b in keys[i + 1:]:
+                    yield a, b
+            return
+        ordered = sorted(keys, key=lambda key: self._profiles[key].title)
+        for i, a in enumerate(ordered):
+            for b in ordered[i + 1:i + 1 + WINDOW]:
+                yield a, b
+
+    def clusters(self):
+        """
+        Groups the indexed books into clusters of probable duplicates.
+
+        Returns [(score, [mapping keys])], largest clusters first; the score
+        is that of the weakest link that joined the cluster.
+        """
+        parent = {}
+        weakest = {}
+
+        def find(key):
+            root = key
+            while parent.get(root, root) != root:
+                root = parent[root]
+            while key != root:
+                parent[key], key = root, parent[key]
+            return root
+
+        profiles = self._profiles
+        for keys in self._blocks.values():
+            if len(keys) < 2:
+                continue
+            # A pair that shares several blocks is scored again; that is cheaper than remembering every pair.
+            for a, b in self._pairs(keys):
+                s = score(profiles[a], profiles[b])
+                if s < MIN_SCORE:
+                    continue
+                parent.setdefault(a, a)
+                parent.setdefault(b, b)
+                root_a, root_b = find(a), find(b)
+                if root_a != root_b:
+                    parent[root_b] = root_a
+                    weakest[root_a] = min(s, weakest.get(root_a, 1.0), weakest.pop(root_b, 1.0))
+
+        members = {}
+        for key in profiles:
+            if key in parent:
+                members.setdefault(find(key), []).append(key)
+        clusters = [(weakest[root], keys) for root, keys in members.items() if len(keys) > 1]
+        clusters.sort(key=lambda cluster: (-len(cluster[1]), -cluster[0]))
+        return clusters
+
+
+def print_report(clusters):
+    """Prints duplicate clusters as returned by `Library.duplicates`."""
+    if not clusters:
+        print("No duplicates found.")
+        return
+    print(f"Found {len(clusters)} groups of possible duplicates:")
+    for cluster in clusters:
+        print(f"\n{cluster['score']:.0%} similar:")
+        for book in cluster["books"]:
+            print(f"  {book.title} by {book.author} (ISBN: {book.isbn}, {book.year})")
+
+
+if __name__ == "__main__":
+    # Imported here: the Library itself uses this module.
+    from library import Library
+    from storage import open_storage
+
+    library = Library(storage=open_storage())
+    try:
+        print_report(library.duplicates())
+    finally:
+        library.close()
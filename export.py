@@ -0,0 +1,136 @@
+"""
+Exports the whole catalog as NDJSON, CSV or a JSON array.
+
+The export is produced as a stream of byte chunks, one per chunk of books
+read from `Library.iter_books`, so memory stays flat however large the
+catalog is and writers are only held up while a chunk is read. The API
+streams it from /books/export; the CLI and this module write it to a file:
+
+    python export.py backup.ndjson.gz
+
+The format is taken from the file name (.ndjson, .csv or .json) and a .gz
+suffix compresses the output with gzip.
+"""
+import csv
+import io
+import os
+import sys
+import zlib
+from jsoncodec import get_codec
+from library import Library
+from storage import open_storage
+
+# Media types of the export formats, by format name.
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+    "json": "application/json",
+}
+
+# The CSV columns, in the order `Book.to_dict` lists the fields.
+CSV_FIELDS = ("title", "author", "isbn", "year", "available", "date_added")
+
+# Books read from the Library per output chunk.
+CHUNK_SIZE = 1000
+
+
+def _ndjson(chunks):
+    dumps = get_codec().dumps
+    for books in chunks:
+        yield b"".join([dumps(book) + b"\n" for book in books])
+
+
+def _json(chunks):
+    dumps = get_codec().dumps
+    separator = b"["
+    for books in chunks:
+        yield separator + b",".join([dumps(book) for book in books])
+        separator = b","
+    # An empty catalog never sent the opening bracket.
+    yield b"]" if separator == b"," else b"[]"
+
+
+def _csv(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_FIELDS)
+    for books in chunks:
+        writer.writerows((book.title, book.author, book.isbn, book.year, book.available, book.date_added)
+                         for book in books)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    # Only the header is left over when there were no books.
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+_WRITERS = {"ndjson": _ndjson, "csv": _csv, "json": _json}
+
+
+def export_chunks(library, output_format="ndjson", chunk_size=CHUNK_SIZE):
+    """Yields the catalog in `output_format` as byte chunks; raises ValueError for an unknown format."""
+    writer = _WRITERS.get(output_format)
+    if writer is None:
+        raise ValueError(f"Unknown export format '{output_format}'. Choose one of: {', '.join(_WRITERS)}.")
+    return writer(library.iter_books(chunk_size))
+
+
+def gzip_chunks(chunks, compresslevel=6):
+    """Compresses a stream of byte chunks into one gzip stream, chunk by chunk."""
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def format_for(filename):
+    """Returns (format, gzipped) for an export file name such as "backup.csv.gz"; the format defaults to ndjson."""
+    name = filename.lower()
+    gzipped = name.endswith(".gz")
+    if gzipped:
+        name = name[:-3]
+    extension = os.path.splitext(name)[1].lstrip(".")
+    return (extension if extension in _WRITERS else "ndjson"), gzipped
+
+
+def export_library(library, filename, output_format=None, gzipped=None):
+    """
+    Writes the catalog to `filename` and returns the number of bytes written.
+
+    The format and compression are taken from the file name unless given.
+    The file is written next to its final name and moved into place once
+    complete, so an interrupted export never leaves a truncated file behind.
+    """
+    default_format, default_gzipped = format_for(filename)
+    chunks = export_chunks(library, output_format or default_format)
+    if gzipped is None:
+        gzipped = default_gzipped
+    if gzipped:
+        chunks = gzip_chunks(chunks)
+    temp_filename = filename + ".tmp"
+    size = 0
+    try:
+        with open(temp_filename, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+        os.replace(temp_filename, filename)
+    finally:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+    return size
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python export.py <output file (.ndjson, .csv or .json, optionally .gz)>")
+        sys.exit(1)
+    library = Library(storage=open_storage())
+    try:
+        size = export_library(library, sys.argv[1])
+        print(f"Exported the library to '{sys.argv[1]}' ({size:,} bytes).")
+    finally:
+        library.close()
@@ -0,0 +1,196 @@
+"""
+HTTP caching helpers for the catalog endpoints.
+
+Responses are tagged with the Library's version as their ETag, so a client
+that already has the current version gets a 304 instead of the body. Bodies
+are serialized once per version and kept in `ResponseCache`, together with
+their gzip (and, if the optional `brotli` package is installed, brotli)
+encodings, so repeated requests skip validation, serialization and
+compression entirely. A compressed body is a different representation, so
+its ETag says which coding it is in, e.g. "7-gzip".
+"""
+import gzip
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from jsoncodec import get_codec
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Smaller bodies are sent as they are; compressing them saves next to nothing.
+MIN_COMPRESS_SIZE = 1024
+
+
+# Content codings a body may be sent in, besides identity.
+ENCODINGS = ("gzip", "br")
+
+
+def etag_for(version, encoding=None):
+    """Returns the strong ETag of a version of a response in a content coding (None for identity)."""
+    return f'"{version}-{encoding}"' if encoding else f'"{version}"'
+
+
+def validators(version, last_modified):
+    """Returns the headers that let clients revalidate a response instead of downloading it again."""
+    return {
+        "ETag": etag_for(version),
+        # The same version, for clients of the change feed (/books/changes).
+        "X-Library-Version": str(version),
+        "Last-Modified": formatdate(last_modified, usegmt=True),
+        # Always revalidate: the catalog can change at any moment.
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding",
+    }
+
+
+def is_not_modified(request_headers, version, last_modified, previous_modified=None):
+    """
+    Tells whether a conditional request already holds the current version.
+
+    HTTP dates have whole seconds, so an If-Modified-Since equal to the
+    second of `last_modified` only proves the client is current if nothing
+    else changed in that second: the change before it, `previous_modified`
+    (None if there was none), must fall in an earlier second.
+    """
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        return matching_etag(if_none_match, version) is not None
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        second = int(last_modified)
+        if second < since:
+            return True
+        return second == since and (previous_modified is None or int(previous_modified) < second)
+    return False
+
+
+def matching_etag(if_none_match, version):
+    """Returns the tag of an If-None-Match header that names `version`, in any content coding, or None."""
+    current = {etag_for(version, encoding) for encoding in (None, *ENCODINGS)}
+    for tag in if_none_match.split(","):
+        tag = tag.strip().removeprefix("W/")
+        if tag in current:
+            return tag
+        if tag == "*":
+            return etag_for(version)
+    return None
+
+
+def accepted_encodings(accept_encoding):
+    """Returns the set of content codings an Accept-Encoding header allows, lower-cased."""
+    accepted = set()
+    for coding in (accept_encoding or "").split(","):
+        name, *params = coding.split(";")
+        quality = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+def choose_encoding(accept_encoding):
+    """Picks the best content coding the client accepts, or None for identity."""
+    accepted = accepted_encodings(accept_encoding)
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def serialize(content):
+    """
+    Encodes compact UTF-8 JSON, like FastAPI's default JSONResponse, with the configured `jsoncodec` codec.
+
+    Books and loans can be passed as they are rather than as dicts.
+    """
+    return get_codec().dumps(content)
+
+
+class CachedResponse:
+    """A serialized response body, its extra headers and its compressed forms."""
+
+    def __init__(self, version, body, headers):
+        self.version = version
+        self.body = body
+        self.headers = headers
+        self._encoded = {}
+
+    def encoded(self, encoding):
+        """Returns the body in the given content coding, compressing it on first use."""
+        body = self._encoded.get(encoding)
+        if body is None:
+            if encoding == "br":
+                body = brotli.compress(self.body)
+            else:
+                body = gzip.compress(self.body, compresslevel=6)
+            self._encoded[encoding] = body
+        return body
+
+    def body_for(self, accept_encoding):
+        """Returns (body, content coding or None) for a client's Accept-Encoding header."""
+        encoding = choose_encoding(accept_encoding) if len(self.body) >= MIN_COMPRESS_SIZE else None
+        if encoding is None:
+            return self.body, None
+        return self.encoded(encoding), encoding
+
+
+class ResponseCache:
+    """
+    A bounded LRU cache of serialized responses, keyed by request.
+
+    Each entry remembers the Library version it was built from; once the
+    Library has changed, the entry is treated as missing and replaced, and
+    entries of older versions are dropped as soon as a newer one is cached.
+    At most `maxsize` entries are kept, and at most `max_bytes` of bodies;
+    their compressed copies are smaller still.
+    """
+
+    def __init__(self, maxsize=128, max_bytes=64 * 1024 * 1024):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.version != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, version, body, headers=None):
+        entry = CachedResponse(version, body, headers or {})
+        with self._lock:
+            for old_key in [old_key for old_key, old in self._entries.items() if old.version < version]:
+                self._drop(old_key)
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = entry
+            self._size += len(body)
+            while len(self._entries) > self.maxsize or (self._size > self.max_bytes and len(self._entries) > 1):
+                self._drop(next(iter(self._entries)))
+        return entry
+
+    def _drop(self, key):
+        self._size -= len(self._entries.pop(key).body)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
@@ -0,0 +1,133 @@
+"""
+Bulk import of books by ISBN.
+
+Looks up thousands of ISBNs on OpenLibrary concurrently, under a concurrency
+limit and a rate limit, skips the ones already in the library and adds the rest
+with a single write. Run it from the command line with a file that has one ISBN
+per line:
+
+    python importer.py isbns.txt
+"""
+import asyncio
+import sys
+from dataclasses import dataclass, field, asdict
+import httpx
+from book import Book
+from isbns import InvalidISBNError, normalize_isbn
+from library import Library
+from openlibrary import OpenLibraryClient, RateLimiter, open_lookup_cache
+from storage import open_storage
+
+
+@dataclass
+class ImportReport:
+    """Progress and outcome of a bulk import."""
+    total: int = 0
+    done: int = 0
+    added: list = field(default_factory=list)
+    # ISBNs that were already in the library
+    skipped: list = field(default_factory=list)
+    # {"isbn": ..., "error": ...} for every ISBN that could not be imported
+    failed: list = field(default_factory=list)
+    finished: bool = False
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def read_isbns(filename):
+    """Reads one ISBN per line, ignoring blank lines and lines starting with '#'."""
+    with open(filename, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+
+
+async def import_isbns(library, client, isbns, concurrency=8, rate=5.0, progress=None, report=None):
+    """
+    Imports books for a list of ISBNs and returns an `ImportReport`.
+
+    Up to `concurrency` lookups run at once and at most `rate` of them start
+    per second; cached lookups are not rate limited. Repeated ISBNs are looked
+    up once, whatever their notation, ISBNs already in the library are skipped,
+    and ISBNs with a wrong check digit fail without a lookup. All found books are
+    added through `Library.add_books` in one write. `progress`, if given, is
+    called with the report after each lookup; pass your own `report` to watch
+    it from elsewhere while the import runs.
+    """
+    report = report if report is not None else ImportReport()
+    unique, invalid = [], []
+    for isbn in dict.fromkeys(isbn.strip() for isbn in isbns if isbn.strip()):
+        try:
+            # A lookup cannot find an ISBN with a wrong check digit, so report it instead.
+            unique.append(normalize_isbn(isbn, strict=True))
+        except InvalidISBNError as e:
+            invalid.append({"isbn": isbn, "error": str(e)})
+    unique = list(dict.fromkeys(unique))
+    report.failed.extend(invalid)
+    # The library is read and written in a worker thread, so waiting for its
+    # lock never stalls the event loop.
+    existing = await asyncio.to_thread(lambda: {isbn for isbn in unique if library.find_book(isbn) is not None})
+    pending = []
+    for isbn in unique:
+        if isbn in existing:
+            report.skipped.append(isbn)
+        else:
+            pending.append(isbn)
+    report.total = len(unique) + len(invalid)
+    report.done = len(report.skipped) + len(invalid)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = RateLimiter(rate) if rate else None
+    found = {}
+
+    async def enrich(isbn):
+        async with semaphore:
+            try:
+                book_data = await client.lookup(isbn, limiter)
+            except (httpx.HTTPError, ValueError) as e:
+                report.failed.append({"isbn": isbn, "error": str(e) or type(e).__name__})
+            else:
+                if book_data is None:
+                    report.failed.append({"isbn": isbn, "error": "Not found on OpenLibrary"})
+                else:
+                    found[isbn] = Book(**book_data)
+        report.done += 1
+        if progress is not None:
+            progress(report)
+
+    await asyncio.gather(*(enrich(isbn) for isbn in pending))
+
+    # Keep the order of the input rather than the order lookups finished in.
+    added = await asyncio.to_thread(library.add_books, [found[isbn] for isbn in pending if isbn in found])
+    report.added = [book.isbn for book in added]
+    report.finished = True
+    return report
+
+
+def print_progress(report):
+    """Prints a one-line progress update, overwriting the previous one."""
+    print(f"\rLooked up {report.done}/{report.total} ISBNs, {len(report.failed)} failed", end="", flush=True)
+
+
+def print_summary(report):
+    """Prints the outcome of an import, including every failure."""
+    print(f"\nAdded {len(report.added)} books, skipped {len(report.skipped)} already in the library, "
+          f"{len(report.failed)} failed.")
+    for failure in report.failed:
+        print(f"  {failure['isbn']}: {failure['error']}")
+
+
+async def _main(filename):
+    library = Library(storage=open_storage())
+    try:
+        async with OpenLibraryClient(cache=open_lookup_cache()) as client:
+            report = await import_isbns(library, client, read_isbns(filename), progress=print_progress)
+        print_summary(report)
+    finally:
+        library.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python importer.py <file with one ISBN per line>")
+        sys.exit(1)
+    asyncio.run(_main(sys.argv[1]))
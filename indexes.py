@@ -0,0 +1,171 @@
+"""
+Secondary indexes that the Library keeps alongside its ISBN mapping.
+
+An index is built from the collection the first time it is needed and is then
+updated on every mutation through three hooks: `rebuild(items)` with all
+(key, book) pairs, `add(key, book)` and `discard(key, book)`. `key` is the
+book's key in the Library's mapping: its ISBN, or a private tuple for a repeated
+ISBN. Updates are a `discard` with the old values followed by an `add`.
+"""
+from bisect import bisect_left, insort
+from isbns import canonical_isbn
+
+
+def _tiebreak(key):
+    """Renders a mapping key as a string that is unique across all books."""
+    if isinstance(key, tuple):
+        return f"{key[0]}\x00{key[1]}"
+    return key
+
+
+class SortedIndex:
+    """Keeps the library's books ordered by a single sort key."""
+
+    def __init__(self, sort_key):
+        self._sort_key = sort_key
+        # Entries are (sort value, unique tiebreak, mapping key); the tiebreak
+        # keeps comparisons from ever reaching the mapping key itself.
+        self._entries = []
+
+    def __len__(self):
+        return len(self._entries)
+
+    def rebuild(self, items):
+        self._entries = sorted((self._sort_key(book), _tiebreak(key), key) for key, book in items)
+
+    def add(self, key, book):
+        insort(self._entries, (self._sort_key(book), _tiebreak(key), key))
+
+    def discard(self, key, book):
+        probe = (self._sort_key(book), _tiebreak(key))
+        position = bisect_left(self._entries, probe)
+        if position < len(self._entries) and self._entries[position][:2] == probe:
+            del self._entries[position]
+
+    def keys(self, reverse=False, start=0, stop=None):
+        """Returns the mapping keys in sort order, optionally sliced."""
+        entries = self._entries
+        if reverse:
+            # Slice from the end without copying the whole list.
+            size = len(entries)
+            stop = size if stop is None else min(stop, size)
+            return [entries[size - 1 - i][2] for i in range(start, stop)]
+        return [entry[2] for entry in entries[start:stop]]
+
+    def iter_keys(self, reverse=False):
+        """Yields every mapping key in sort order."""
+        entries = reversed(self._entries) if reverse else self._entries
+        for entry in entries:
+            yield entry[2]
+
+
+class IsbnIndex:
+    """
+    Resolves any notation of an ISBN to the keys of the books stored under it.
+
+    Books keep the ISBN they were stored with, which for older records may
+    be an ISBN-10 or hyphenated; this maps the canonical ISBN-13 of each to
+    its keys, in the order they were added. Books whose ISBN is not a valid
+    ISBN are only found by their exact key, so they are not indexed.
+    """
+
+    def __init__(self):
+        self._keys = {}
+
+    def rebuild(self, items):
+        self._keys = {}
+        for key, book in items:
+            self.add(key, book)
+
+    def add(self, key, book):
+        canonical = canonical_isbn(book.isbn)
+        if canonical is not None:
+            self._keys.setdefault(canonical, []).append(key)
+
+    def discard(self, key, book):
+        canonical = canonical_isbn(book.isbn)
+        keys = self._keys.get(canonical)
+        if keys is not None and key in keys:
+            keys.remove(key)
+            if not keys:
+                del self._keys[canonical]
+
+    def get(self, isbn):
+        """Returns the key of the first book stored under any notation of `isbn`, or None."""
+        canonical = canonical_isbn(isbn)
+        keys = self._keys.get(canonical) if canonical is not None else None
+        return keys[0] if keys else None
+
+
+class CollectionStats:
+    """
+    Counts of the library's books by author, year, decade, month added and availability.
+
+    Every mutation adjusts a handful of counters, so reading the statistics
+    never walks the collection. Authors are also kept ranked by count, which
+    makes the top authors a slice.
+    """
+
+    def __init__(self):
+        self.rebuild(())
+
+    def rebuild(self, items):
+        self.total = 0
+        self.available = 0
+        self._by_author = {}
+        self._by_year = {}
+        self._by_decade = {}
+        self._by_month = {}
+        # (-count, author) for every author, so the most prolific come first.
+        self._ranking = []
+        for key, book in items:
+            self.add(key, book)
+
+    @staticmethod
+    def _count(counts, value, delta):
+        count = counts.get(value, 0) + delta
+        if count:
+            counts[value] = count
+        else:
+            del counts[value]
+        return count
+
+    def _count_author(self, author, delta):
+        before = self._by_author.get(author, 0)
+        if before:
+            del self._ranking[bisect_left(self._ranking, (-before, author))]
+        after = self._count(self._by_author, author, delta)
+        if after:
+            insort(self._ranking, (-after, author))
+
+    def _apply(self, book, delta):
+        self.total += delta
+        if book.available:
+            self.available += delta
+        self._count_author(book.author, delta)
+        self._count(self._by_year, book.year, delta)
+        self._count(self._by_decade, book.year - book.year % 10, delta)
+        if book.date_added:
+            self._count(self._by_month, book.date_added[:7], delta)
+
+    def add(self, key, book):
+        self._apply(book, 1)
+
+    def discard(self, key, book):
+        self._apply(book, -1)
+
+    def top_authors(self, n):
+        """Returns (author, count) for the `n` authors with the most books, most first; ties by name."""
+        return [(author, -count) for count, author in self._ranking[:n]]
+
+    def to_dict(self, top_authors=10):
+        return {
+            "total": self.total,
+            "available": self.available,
+            "checked_out": self.total - self.available,
+            "authors": len(self._by_author),
+            "top_authors": [{"author": author, "count": count} for author, count in self.top_authors(top_authors)],
+            "by_year": dict(sorted(self._by_year.items())),
+            "by_decade": dict(sorted(self._by_decade.items())),
+            "by_month_added": dict(sorted(self._by_month.items())),
+        }
@@ -0,0 +1,108 @@
+"""
+ISBN validation and canonical forms.
+
+The same book can be written as an ISBN-10 or an ISBN-13, with or without
+hyphens and spaces: "975-470-907-6", "9754709076" and "9789754709070" are
+one book. Its canonical form is the bare ISBN-13, which is what the Library
+stores for new books and what lookups and caches are keyed on.
+
+Only strings shaped like an ISBN (ten characters ending in a digit or X,
+or thirteen digits, once separators are removed) are checked. Anything else,
+such as the short numbers of a hand-made catalog or the "N/A" placeholder of
+records without an ISBN, is kept as it is. So is an ISBN with a wrong check
+digit, everywhere books are stored: the Library and the converter keep it
+and flag it with a warning, and only the places where a person can correct
+it on the spot ask first: the CLI asks for confirmation, and the API with
+`check_isbn=true` answers 422.
+"""
+_SEPARATORS = str.maketrans("", "", "- ")
+
+# What `converter.py` wrote for every record without an ISBN, before those got a placeholder of their own.
+MISSING = "N/A"
+_UNKNOWN = frozenset({"", "NONE", "UNKNOWN"})
+
+
+class InvalidISBNError(ValueError):
+    """Raised for text that is shaped like an ISBN but has the wrong check digit."""
+
+
+def _compact(text):
+    return text.strip().translate(_SEPARATORS).upper()
+
+
+def _is_isbn10_shaped(digits):
+    return len(digits) == 10 and digits[:9].isdigit() and (digits[9].isdigit() or digits[9] == "X")
+
+
+def _is_isbn13_shaped(digits):
+    return len(digits) == 13 and digits.isdigit()
+
+
+def _isbn10_check(first9):
+    """The check character of an ISBN-10 with these first nine digits."""
+    remainder = -sum((10 - i) * int(digit) for i, digit in enumerate(first9)) % 11
+    return "X" if remainder == 10 else str(remainder)
+
+
+def _isbn13_check(first12):
+    """The check digit of an ISBN-13 with these first twelve digits."""
+    return str(-sum(int(digit) * (3 if i % 2 else 1) for i, digit in enumerate(first12)) % 10)
+
+
+def canonical_isbn(text):
+    """Returns the bare ISBN-13 for a valid ISBN-10 or ISBN-13 in any notation, or None for anything else."""
+    digits = _compact(text)
+    if _is_isbn13_shaped(digits):
+        return digits if _isbn13_check(digits[:12]) == digits[12] else None
+    if _is_isbn10_shaped(digits) and _isbn10_check(digits[:9]) == digits[9]:
+        core = "978" + digits[:9]
+        return core + _isbn13_check(core)
+    return None
+
+
+def isbn10(isbn13):
+    """Returns the ISBN-10 form of a canonical ISBN-13, or None if it has none (979 prefix)."""
+    if not isbn13.startswith("978"):
+        return None
+    first9 = isbn13[3:12]
+    return first9 + _isbn10_check(first9)
+
+
+def has_wrong_check_digit(text):
+    """Tells whether text is shaped like an ISBN but fails its checksum, which is almost always a typo."""
+    digits = _compact(text)
+    return (_is_isbn10_shaped(digits) or _is_isbn13_shaped(digits)) and canonical_isbn(text) is None
+
+
+def normalize_isbn(text, strict=False):
+    """
+    Returns the ISBN to store for a new book.
+
+    A valid ISBN becomes its canonical ISBN-13; anything else is kept as it
+    is, without surrounding whitespace. That includes ISBN-shaped text with
+    a wrong check digit, which callers flag with `has_wrong_check_digit`,
+    unless `strict=True` makes it raise `InvalidISBNError` instead.
+    """
+    canonical = canonical_isbn(text)
+    if canonical is not None:
+        return canonical
+    if strict and has_wrong_check_digit(text):
+        raise InvalidISBNError(f"'{text}' is not a valid ISBN: its check digit is wrong.")
+    return text.strip()
+
+
+def make_isbn(number):
+    """A valid ISBN-13 for a serial number below one billion, for synthetic catalogs: 978, the number, a check digit."""
+    core = f"978{number:09d}"
+    return core + _isbn13_check(core)
+
+
+def placeholder_isbn(record_id):
+    """A unique stand-in for the ISBN of a record that has none, e.g. "N/A-1042"."""
+    return f"{MISSING}-{record_id}"
+
+
+def is_placeholder(isbn):
+    """Tells whether an ISBN field only says that the ISBN is unknown."""
+    text = isbn.strip().upper()
+    return text in _UNKNOWN or text == MISSING or text.startswith(MISSING + "-")
@@ -1,98 +1,586 @@
-import json
-from dataclasses import dataclass, asdict
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from collections import deque
+from dataclasses import replace
 from datetime import datetime
+from itertools import islice
+from book import Book
+from dedupe import DuplicateBookError, DuplicateIndex
+from indexes import CollectionStats, IsbnIndex, SortedIndex
+from isbns import canonical_isbn, has_wrong_check_digit, normalize_isbn
+from locks import RWLock
+from metrics import LIBRARY_OPERATION_SECONDS
+from search import SearchIndex
+from storage import JSONStorage, index_by_isbn, remove_isbn
 
-@dataclass
-class Book:
-    """Represents a single book in the library."""
-    title: str
-    author: str
-    isbn: str
-    year: int
-    available: bool = True
-    # New field to track when the book was added
-    date_added: str = None
-
-    def to_dict(self):
-        """Converts the Book object to a dictionary."""
-        return asdict(self)
+# Sort keys for the orderings the Library maintains, by field name.
+SORT_KEYS = {
+    "title": lambda book: book.title.casefold(),
+    "author": lambda book: book.author.casefold(),
+    "year": lambda book: book.year,
+    "date_added": lambda book: book.date_added or "",
+}
+
+# The sort options offered by the web UI, mapped to (field, descending).
+SORT_OPTIONS = {
+    "date_added_desc": ("date_added", True),
+    "date_added_asc": ("date_added", False),
+    "title_asc": ("title", False),
+    "title_desc": ("title", True),
+    "author_asc": ("author", False),
+    "author_desc": ("author", True),
+    "year_desc": ("year", True),
+    "year_asc": ("year", False),
+}
+
+# How many recent changes the Library remembers for `changes_since`.
+CHANGE_LOG_SIZE = 1000
+
+# Every mutation is logged at INFO (and a rejected one at WARNING), with the
+# ISBN as a structured `isbn` field. Nothing is formatted while the level is off.
+logger = logging.getLogger(__name__)
+
+# The latency series of each timed Library operation, looked up once.
+_timing = {operation: LIBRARY_OPERATION_SECONDS.labels(operation=operation) for operation in
+           ("load", "save", "find", "query", "search", "duplicates", "add", "add_many", "update",
+                      "remove")}
 
 class Library:
     """Manages the collection of books in the library."""
 
-    def __init__(self, filename="library.json"):
-        """Initializes the Library, loading books from the specified file."""
-        self.filename = filename
-        self.books = self.load_books()
-
-    def add_book(self, book: Book):
-        """Adds a new book to the library if the ISBN doesn't already exist."""
-        if any(b.isbn == book.isbn for b in self.books):
-            print(f"Error: Book with ISBN {book.isbn} already exists.")
-            return False
-        
-        # Set the date_added timestamp for the new book
-        book.date_added = datetime.now().isoformat()
-        
-        self.books.append(book)
-        self.save_books()
-        print(f"Book '{book.title}' added successfully.")
+    def __init__(self, filename="library.json", journal=False, storage=None):
+        """
+        Initializes the Library, loading books from the specified file.
+
+        With `journal=True`, mutations are appended to `<filename>.journal`
+        instead of rewriting the whole file. A different backend, such as
+        `storage.SQLiteStorage`, can be passed in as `storage`.
+
+        A Library can be shared between threads: reads run concurrently, and
+        mutations, including the write to storage, run one at a time. With a
+        storage backend that several processes can share, each process keeps
+        its own indexes and rebuilds them once another process has written.
+        """
+        self.storage = storage if storage is not None else JSONStorage(filename, journal=journal)
+        self.filename = self.storage.filename
+        self._books = self.load_books()
+        # Secondary indexes, built on first use and kept in sync on every mutation.
+        self._indexes = {}
+        self._lock = RWLock()
+        # The storage version the indexes reflect. Stores that do not count
+        # versions themselves start from the load time in microseconds, so a
+        # version seen before a restart is never handed out again (and the
+        # number stays exact in JavaScript).
+        self._version = self.storage.version()
+        if self._version is None:
+            self._version = time.time_ns() // 1000
+        self._last_modified = time.time()
+        # When the collection changed before that, if it has since the Library was created.
+        self._previous_modified = None
+        # Recent (version, record) pairs, and the version after which the log is complete.
+        self._changes = deque()
+        self._changes_floor = self._version
+        # Called with the new version after every mutation; see `subscribe`.
+        self._listeners = []
+        # While a `batch` is open: the thread running it, the records it will
+        # persist, and the (key, previous book or None) pairs that undo it.
+        self._batch_owner = None
+        self._batch_records = None
+        self._undo = None
+
+    def __len__(self):
+        """Returns the number of books without loading them."""
+        with self._reading():
+            return len(self._books)
+
+    @property
+    def books(self):
+        """Returns all books in the library, in the order they were added."""
+        with self._reading():
+            return list(self._books.values())
+
+    @books.setter
+    def books(self, books):
+        """Replaces the in-memory collection and rebuilds the ISBN index."""
+        with self._lock.write():
+            self._books = index_by_isbn(books)
+            self._indexes = {}
+            self._changed(self._version + 1)
+            self._changes_floor = self._version
+
+    def iter_books(self, chunk_size=1000):
+        """
+        Yields all books in lists of up to `chunk_size`, in the order they were added.
+
+        Unlike `books`, the read lock is only held while a chunk is gathered,
+        so a slow consumer, such as an export streamed to an HTTP client, does
+        not hold up writers. The keys are listed when iteration starts: books
+        added later are left out, books removed in the meantime are skipped,
+        and a book updated in the meantime is yielded as it is when its chunk
+        is read. For the in-memory backends the key list holds references to
+        the existing keys only, far smaller than the books themselves.
+        """
+        with self._reading():
+            keys = list(self._books)
+        for start in range(0, len(keys), chunk_size):
+            with self._reading():
+                books = self._books
+                chunk = [book for book in map(books.get, keys[start:start + chunk_size]) if book is not None]
+            if chunk:
+                yield chunk
+
+    @property
+    def version(self):
+        """
+        A number that changes whenever the collection changes, in this process or another.
+
+        Equal versions mean identical contents, so it can serve as an HTTP ETag.
+        """
+        with self._reading_current():
+            return self._version
+
+    @property
+    def last_modified(self):
+        """The time, in seconds since the epoch, when this Library last saw the collection change."""
+        return self._last_modified
+
+    @property
+    def previous_modified(self):
+        """When the collection changed before `last_modified`, or None if this Library has not seen it change."""
+        return self._previous_modified
+
+    def _changed(self, version):
+        self._version = version
+        self._previous_modified = self._last_modified
+        self._last_modified = time.time()
+
+    def _get_index(self, name, factory):
+        """
+        Returns the named secondary index, building it from the collection if needed.
+
+        Called with the lock held; concurrent readers may both build a missing
+        index, and either copy is correct.
+        """
+        index = self._indexes.get(name)
+        if index is None:
+            index = factory()
+            index.rebuild(self._books.items())
+            self._indexes[name] = index
+        return index
+
+    def _refresh(self):
+        """
+        Drops the secondary indexes if another process has changed the store since they were built.
+
+        Called with the write lock held, as it replaces state that readers use.
+        """
+        version = self.storage.version()
+        if version is not None and version != self._version:
+            self._indexes = {}
+            self._changed(version)
+            # What the other process changed is unknown, so older versions cannot be caught up.
+            self._changes.clear()
+            self._changes_floor = version
+
+    def _in_batch(self):
+        return self._batch_owner == threading.get_ident()
+
+    @contextmanager
+    def _reading(self):
+        """Holds the read lock, unless this thread's batch already holds the write lock."""
+        if self._in_batch():
+            yield
+            return
+        with self._lock.read():
+            yield
+
+    @contextmanager
+    def _reading_current(self):
+        """
+        Holds the read lock, with the indexes first brought up to date with the store.
+
+        `_refresh` replaces shared state, so when another process has changed
+        the store it runs under the write lock, before the read lock is taken.
+        """
+        if not self._in_batch():
+            version = self.storage.version()
+            if version is not None and version != self._version:
+                with self._lock.write():
+                    self._refresh()
+        with self._reading():
+            yield
+
+    @contextmanager
+    def _writing(self):
+        """Holds the write lock and a storage transaction, with the indexes brought up to date."""
+        if self._in_batch():
+            # The batch already holds both and collects the records.
+            yield
+            return
+        with self._lock.write(), self.storage.transaction():
+            self._refresh()
+            before = self._version
+            yield
+            version = self._version
+        if version != before:
+            for listener in self._listeners:
+                listener(version)
+
+    @contextmanager
+    def batch(self):
+        """
+        Groups mutations so they are applied together and written to storage once.
+
+        Inside `with library.batch():` the library is locked for this thread
+        alone; any mutation and lookup can be used, and the records of all
+        mutations are persisted in a single write when the block ends. If the
+        block raises, every change it made is undone and nothing is written.
+        Nested batches join the outer one.
+        """
+        if self._in_batch():
+            yield
+            return
+        with self._writing():
+            self._batch_owner = threading.get_ident()
+            self._batch_records = []
+            self._undo = []
+            try:
+                yield
+            except BaseException:
+                self._rollback()
+                raise
+            else:
+                records = self._batch_records
+            finally:
+                self._batch_owner = self._batch_records = self._undo = None
+            if records:
+                self._persist(*records)
+
+    def _rollback(self):
+        """Restores the books a failed batch changed."""
+        for key, book in reversed(self._undo):
+            if book is None:
+                self._books.pop(key, None)
+            else:
+                self._books[key] = book
+        # The indexes are rebuilt from the restored collection on next use.
+        self._indexes = {}
+
+    def _store(self, key, book):
+        """Puts a book into the collection, remembering what it replaced if a batch is open."""
+        if self._undo is not None:
+            self._undo.append((key, self._books.get(key)))
+        self._books[key] = book
+
+    def subscribe(self, listener):
+        """
+        Registers `listener(version)` to be called after every mutation.
+
+        Listeners run on the mutating thread, after the library lock is
+        released. Changes made by other processes are not reported; they
+        show up in `version` and `changes_since`.
+        """
+        self._listeners.append(listener)
+
+    def changes_since(self, since):
+        """
+        Returns (current version, change records after `since`).
+
+        The records are the ones given to the storage backend (`{"op": "add",
+        "book": {...}}`, `{"op": "update", "isbn": ..., "changes": {...}}` or
+        `{"op": "remove", "isbn": ...}`), each with the version it created.
+        The records are None when `since` is too old for the change log, or
+        unknown, and the caller has to reload everything instead.
+        """
+        with self._reading_current():
+            if since == self._version:
+                return self._version, []
+            if since < self._changes_floor or since > self._version:
+                return self._version, None
+            return self._version, [dict(record, version=version) for version, record in self._changes if version > since]
+
+    def _index_add(self, key, book):
+        for index in self._indexes.values():
+            index.add(key, book)
+
+    def _index_discard(self, key, book):
+        for index in self._indexes.values():
+            index.discard(key, book)
+
+    def _other_notation(self, isbn):
+        """
+        Returns the key of a book stored under another notation of a valid ISBN, or None. Called with the lock held.
+
+        E.g. "975-470-907-6" finds a book stored as "9754709076" or "9789754709070".
+        A store that can look this up itself, like SQLite's indexed column, is
+        asked directly rather than through an index that goes stale whenever
+        another process writes.
+        """
+        canonical = canonical_isbn(isbn)
+        if canonical is None:
+            return None
+        key_for_isbn = getattr(self._books, "key_for_isbn", None)
+        if key_for_isbn is not None:
+            return key_for_isbn(canonical)
+        return self._get_index("isbn", IsbnIndex).get(canonical)
+
+    def _key_for(self, isbn):
+        """Returns the key of the book with this ISBN in any notation, or None. Called with the lock held."""
+        return isbn if isbn in self._books else self._other_notation(isbn)
+
+    def add_book(self, book: Book, check_duplicates=False, check_isbn=False):
+        """
+        Adds a new book to the library if the ISBN doesn't already exist.
+
+        A valid ISBN is stored as its canonical ISBN-13, and the book counts
+        as existing if it is stored under any notation of it. An ISBN with a
+        wrong check digit is kept as entered and logged as a warning; with
+        `check_isbn=True` it raises `isbns.InvalidISBNError` instead.
+
+        With `check_duplicates=True`, a book that looks like one already in
+        the library under another ISBN (see `possible_duplicates`) is not
+        added either; `dedupe.DuplicateBookError` is raised with the matches.
+        """
+        book.isbn = normalize_isbn(book.isbn, strict=check_isbn)
+        self._flag_isbn(book.isbn)
+        with _timing["add"].time(), self._writing():
+            if self._key_for(book.isbn) is not None:
+                logger.warning("Book with ISBN %s already exists.", book.isbn, extra={"isbn": book.isbn})
+                return False
+            if check_duplicates:
+                candidates = self._possible_duplicates(book)
+                if candidates:
+                    logger.warning("Book '%s' looks like a duplicate of %s.", book.title,
+                                   ", ".join(candidate.isbn for candidate, score in candidates),
+                                   extra={"isbn": book.isbn})
+                    raise DuplicateBookError(book, candidates)
+
+            # Set the date_added timestamp for the new book
+            book.date_added = datetime.now().isoformat()
+
+            self._store(book.isbn, book)
+            self._index_add(book.isbn, book)
+            self._persist({"op": "add", "book": book.to_dict()})
+        logger.info("Book '%s' added successfully.", book.title, extra={"isbn": book.isbn})
         return True
 
+    def add_books(self, books):
+        """
+        Adds many books with a single write to storage.
+
+        Each book goes through `add_book` in one `batch`: books whose ISBN is
+        already in the library (or earlier in `books`) are skipped, and the
+        others are stamped with `date_added`. Returns the list of books that
+        were added.
+        """
+        with _timing["add_many"].time(), self.batch():
+            return [book for book in books if self.add_book(book)]
+
+    @staticmethod
+    def _flag_isbn(isbn):
+        if has_wrong_check_digit(isbn):
+            logger.warning("ISBN %s has a wrong check digit; it is kept as entered.", isbn, extra={"isbn": isbn})
+
     def remove_book(self, isbn: str):
-        """Removes a book from the library by its ISBN."""
-        initial_count = len(self.books)
-        self.books = [book for book in self.books if book.isbn != isbn]
-        if len(self.books) < initial_count:
-            self.save_books()
-            print(f"Book with ISBN {isbn} removed successfully.")
+        """Removes a book from the library by its ISBN, in any notation. Returns whether it was found."""
+        with _timing["remove"].time(), self._writing():
+            isbn = self._key_for(isbn) or isbn
+            removed = remove_isbn(self._books, isbn)
+            for key, book in removed:
+                if self._undo is not None:
+                    self._undo.append((key, book))
+                self._index_discard(key, book)
+            if removed:
+                self._persist({"op": "remove", "isbn": isbn})
+        if removed:
+            logger.info("Book with ISBN %s removed successfully.", isbn, extra={"isbn": isbn})
         else:
-            print(f"Error: Book with ISBN {isbn} not found.")
+            logger.warning("Book with ISBN %s not found.", isbn, extra={"isbn": isbn})
+        return bool(removed)
 
     def list_books(self):
         """Lists all the books in the library."""
-        if not self.books:
+        books = self.books
+        if not books:
             print("The library is empty.")
             return
-        for book in self.books:
+        for book in books:
             status = "Available" if book.available else "Checked Out"
             print(f"Title: {book.title}, Author: {book.author}, ISBN: {book.isbn}, Year: {book.year}, Status: {status}")
 
     def find_book(self, isbn: str):
-        """Finds and returns a book by its ISBN."""
-        for book in self.books:
-            if book.isbn == isbn:
+        """Finds and returns a book by its ISBN, in any notation: ISBN-10 or ISBN-13, with or without hyphens."""
+        with _timing["find"].time():
+            with self._reading():
+                book = self._books.get(isbn)
+            if book is not None or canonical_isbn(isbn) is None:
                 return book
-        return None
+            # The ISBN index has to reflect other processes' changes too.
+            with self._reading_current():
+                key = self._other_notation(isbn)
+                return self._books.get(key) if key is not None else None
 
     def update_book(self, isbn: str, **kwargs):
-        """Updates the details of a book identified by its ISBN."""
-        book_to_update = self.find_book(isbn)
+        """Updates the details of a book identified by its ISBN, in any notation. Returns the updated book, or None."""
+        with _timing["update"].time(), self._writing():
+            isbn = self._key_for(isbn) or isbn
+            book_to_update = self._books.get(isbn)
+            if book_to_update:
+                changes = {key: value for key, value in kwargs.items() if hasattr(book_to_update, key)}
+                self._index_discard(isbn, book_to_update)
+                # Store a changed copy instead of changing the book in place, so
+                # a reader still holding the old book never sees half an update.
+                book_to_update = replace(book_to_update, **changes)
+                self._store(isbn, book_to_update)
+                self._index_add(isbn, book_to_update)
+                self._persist({"op": "update", "isbn": isbn, "changes": changes})
         if book_to_update:
-            for key, value in kwargs.items():
-                if hasattr(book_to_update, key):
-                    setattr(book_to_update, key, value)
-            self.save_books()
-            print(f"Book with ISBN {isbn} updated successfully.")
+            logger.info("Book with ISBN %s updated successfully.", isbn, extra={"isbn": isbn})
+        else:
+            logger.warning("Book with ISBN %s not found.", isbn, extra={"isbn": isbn})
+        return book_to_update
+
+    def query(self, q=None, author=None, year_from=None, year_to=None, available=None,
+              sort=None, limit=None, offset=0):
+        """
+        Returns one page of books matching the filters, plus the total number of matches.
+
+        `q` matches title, author, ISBN or year; `author` matches the author
+        only. Both are case-insensitive substring matches. `sort` is one of
+        SORT_OPTIONS, or None for the order the books were added in. Sorted
+        pages are read from an ordering that is kept sorted between calls, so
+        nothing is re-sorted per query.
+        """
+        with _timing["query"].time(), self._reading_current():
+            return self._query(q, author, year_from, year_to, available, sort, limit, offset)
+
+    def _query(self, q, author, year_from, year_to, available, sort, limit, offset):
+        stop = None if limit is None else offset + limit
+        if sort is None:
+            ordering = None
+            all_keys = iter(self._books)
         else:
-            print(f"Error: Book with ISBN {isbn} not found.")
+            field, descending = SORT_OPTIONS[sort]
+            ordering = self._get_index(f"sort:{field}", lambda: SortedIndex(SORT_KEYS[field]))
+            all_keys = ordering.iter_keys(descending)
+
+        filters = []
+        if q:
+            needle = q.casefold()
+            filters.append(lambda book: needle in book.title.casefold() or needle in book.author.casefold()
+                           or needle in book.isbn.casefold() or needle in str(book.year))
+        if author:
+            author_needle = author.casefold()
+            filters.append(lambda book: author_needle in book.author.casefold())
+        if year_from is not None:
+            filters.append(lambda book: book.year >= year_from)
+        if year_to is not None:
+            filters.append(lambda book: book.year <= year_to)
+        if available is not None:
+            filters.append(lambda book: book.available == available)
+
+        if not filters:
+            if ordering is None:
+                return list(islice(self._books.values(), offset, stop)), len(self._books)
+            books = (self._books.get(key) for key in ordering.keys(descending, offset, stop))
+            # Another process may have removed a book since the index was checked.
+            return [book for book in books if book is not None], len(ordering)
+
+        total = 0
+        page = []
+        for key in all_keys:
+            book = self._books.get(key)
+            if book is not None and all(matches(book) for matches in filters):
+                if total >= offset and (stop is None or total < stop):
+                    page.append(book)
+                total += 1
+        return page, total
+
+    def search(self, query, limit=20):
+        """
+        Returns up to `limit` books whose title or author match every query term.
+
+        Matching is accent- and case-insensitive and treats each term as a
+        prefix; results are ranked best first. See `search.SearchIndex`.
+        """
+        with _timing["search"].time(), self._reading_current():
+            index = self._get_index("search", SearchIndex)
+            books = (self._books.get(key) for key, score in index.search(query, limit))
+            # Another process may have removed a book since the index was checked.
+            return [book for book in books if book is not None]
+
+    def possible_duplicates(self, book):
+        """
+        Returns [(book, score)] for the books in the library that are probably the same as `book`, best first.
+
+        Titles and authors are compared fuzzily, so other editions and
+        spelling variants are found too. See `dedupe.DuplicateIndex`.
+        """
+        with _timing["duplicates"].time(), self._reading_current():
+            return self._possible_duplicates(book)
+
+    def _possible_duplicates(self, book):
+        index = self._get_index("duplicates", DuplicateIndex)
+        found = ((self._books.get(key), score) for key, score in index.candidates(book))
+        return [(match, score) for match, score in found if match is not None]
+
+    def duplicates(self):
+        """
+        Returns the clusters of books that are probably duplicates of each other, largest first.
+
+        Each cluster is a dict with the `books` and a `score` from 0 to 1: the
+        similarity of the least similar pair that put a book in the cluster.
+        The index behind it is kept up to date on every change, so only the
+        first report has to read the whole collection.
+        """
+        with _timing["duplicates"].time(), self._reading_current():
+            clusters = []
+            for score, keys in self._get_index("duplicates", DuplicateIndex).clusters():
+                books = [book for book in map(self._books.get, keys) if book is not None]
+                if len(books) > 1:
+                    clusters.append({"score": round(score, 3), "books": books})
+            return clusters
+
+    def stats(self, top_authors=10):
+        """
+        Returns counts of the collection: totals, availability, the top authors, and books by year, decade and month added.
+
+        The counts are kept up to date on every mutation, so this never walks
+        the collection once they exist. See `indexes.CollectionStats`.
+        """
+        with self._reading_current():
+            return self._get_index("stats", CollectionStats).to_dict(top_authors)
 
     def load_books(self):
-        """Loads books from the JSON file, ensuring UTF-8 encoding is used."""
-        try:
-            with open(self.filename, 'r', encoding='utf-8') as f:
-                books_data = json.load(f)
-                loaded_books = []
-                for data in books_data:
-                    # For backward compatibility, add a default date if it's missing
-                    if 'date_added' not in data:
-                        data['date_added'] = datetime(1970, 1, 1).isoformat()
-                    loaded_books.append(Book(**data))
-                return loaded_books
-        except (FileNotFoundError, json.JSONDecodeError):
-            return []
+        """Loads the collection from the storage backend."""
+        with _timing["load"].time():
+            return self.storage.load()
+
+    def _persist(self, *records):
+        """
+        Makes one or more mutations durable through the storage backend in one go. Called from `_writing`.
+
+        Inside a batch the records are only collected; the batch persists them when it ends.
+        """
+        if self._batch_records is not None:
+            self._batch_records.extend(records)
+            return
+        version = self.storage.persist(records, self._books)
+        # The indexes already include these mutations, so they are current for the new version.
+        self._changed(version if version is not None else self._version + 1)
+        for record in records:
+            while len(self._changes) >= CHANGE_LOG_SIZE:
+                self._changes_floor = self._changes.popleft()[0]
+            self._changes.append((self._version, record))
 
     def save_books(self):
-        """Saves the current list of books to the JSON file using UTF-8."""
-        with open(self.filename, 'w', encoding='utf-8') as f:
-            json.dump([book.to_dict() for book in self.books], f, indent=4, ensure_ascii=False)
+        """Saves the whole collection through the storage backend."""
+        with _timing["save"].time(), self._lock.write():
+            self.storage.save(self._books)
+
+    def close(self):
+        """Flushes and releases the storage backend."""
+        with self._lock.write():
+            self.storage.close()
@@ -0,0 +1,53 @@
+"""
+A readers-writer lock for sharing one Library between threads.
+
+Any number of readers may hold the lock together, while a writer holds it
+alone. Waiting writers take priority over newly arriving readers, so a steady
+stream of reads cannot starve writes. The lock is not reentrant: code holding
+it must not try to take it again.
+"""
+import threading
+from contextlib import contextmanager
+
+
+class RWLock:
+    """Allows many concurrent readers or a single writer."""
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        """Holds the lock shared for the duration of the `with` block."""
+        with self._condition:
+            while self._writing or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        """Holds the lock exclusively for the duration of the `with` block."""
+        with self._condition:
+            self._waiting_writers += 1
+            try:
+                while self._writing or self._readers:
+                    self._condition.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
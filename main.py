@@ -1,6 +1,15 @@
-import httpx
-import json
+import asyncio
+import logging
+import os
+import sys
+from circulation import CirculationError, open_circulation
+from dedupe import DuplicateBookError, print_report
+from export import export_library
+from isbns import InvalidISBNError, normalize_isbn
+from importer import import_isbns, print_progress, print_summary, read_isbns
 from library import Library, Book
+from openlibrary import OpenLibraryClient, open_lookup_cache
+from storage import open_storage
 
 def display_menu():
     """Displays the main menu of the library application."""
@@ -11,50 +20,39 @@ def display_menu():
     print("4. Find a book by ISBN")
     print("5. Update a book")
     print("6. Add book from OpenLibrary")
-    print("7. Exit")
+    print("7. Bulk import ISBNs from a file")
+    print("8. Check out a book")
+    print("9. Return a book")
+    print("10. List a borrower's loans")
+    print("11. List overdue loans")
+    print("12. Find duplicate books")
+    print("13. Export the library to a file")
+    print("14. Exit")
 
-def get_book_details_from_openlibrary(isbn: str):
+def get_book_details_from_openlibrary(isbn: str, transport=None):
     """
-    Fetches book details from OpenLibrary using the most reliable search API.
+    Fetches book details from OpenLibrary for synchronous callers.
+
+    This opens a client for a single lookup; code that makes many lookups
+    should keep one `OpenLibraryClient` around instead, as `main` and the API do.
     """
-    search_api_url = f"https://openlibrary.org/search.json?isbn={isbn}"
-    try:
-        with httpx.Client() as client:
-            response = client.get(search_api_url, follow_redirects=True)
-            response.raise_for_status()
-            data = response.json()
-
-            # Check if any documents were found
-            if data.get('numFound', 0) == 0 or not data.get('docs'):
-                print(f"No book found with ISBN {isbn} on OpenLibrary.")
-                return None
-
-            # Use the first result
-            book_data = data['docs'][0]
-            
-            title = book_data.get('title', 'N/A')
-            author_names = ", ".join(book_data.get('author_name', ['N/A']))
-            
-            # The year is often the first published year
-            year = book_data.get('first_publish_year', 0)
-
-            return {
-                'title': title,
-                'author': author_names,
-                'year': year,
-                'isbn': isbn
-            }
-            
-    except (httpx.RequestError, httpx.HTTPStatusError, json.JSONDecodeError) as e:
-        print(f"Failed to fetch or parse data from OpenLibrary: {e}")
-        return None
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-        return None
+    async def fetch():
+        async with OpenLibraryClient(transport=transport) as client:
+            return await client.get_book_details(isbn)
+    return asyncio.run(fetch())
 
 def main():
     """The main function to run the library application."""
-    library = Library()
+    # The library reports what it did through logging; show it like the rest of the menu output.
+    # LIBRARY_LOG_LEVEL=WARNING keeps only the errors.
+    logging.basicConfig(level=os.environ.get("LIBRARY_LOG_LEVEL", "INFO").upper(), format="%(message)s", stream=sys.stdout)
+    # The storage backend is picked from LIBRARY_STORAGE / LIBRARY_PATH.
+    library = Library(storage=open_storage())
+    circulation = open_circulation(library)
+    # One client and event loop for the whole session, so OpenLibrary
+    # connections are reused between lookups.
+    loop = asyncio.new_event_loop()
+    openlibrary = OpenLibraryClient(cache=open_lookup_cache())
 
     while True:
         display_menu()
@@ -67,13 +65,31 @@ def main():
             try:
                 year = int(input("Enter publication year: "))
                 book = Book(title, author, isbn, year)
-                library.add_book(book)
             except ValueError:
                 print("Invalid year. Please enter a number.")
+                continue
+            try:
+                normalize_isbn(isbn, strict=True)
+            except InvalidISBNError as e:
+                print(e)
+                if input("Add it anyway? (y/n): ").strip().lower() != "y":
+                    continue
+            try:
+                library.add_book(book, check_duplicates=True)
+            except DuplicateBookError as e:
+                print("This book may already be in the library:")
+                for match, score in e.candidates:
+                    print(f"  {match.title} by {match.author} (ISBN: {match.isbn}), {score:.0%} similar")
+                if input("Add it anyway? (y/n): ").strip().lower() == "y":
+                    library.add_book(book)
 
         elif choice == '2':
             isbn = input("Enter ISBN of the book to remove: ")
-            library.remove_book(isbn)
+            with circulation.changing_books() as on_loan:
+                if on_loan(isbn):
+                    print("This book is on loan; return it before removing it.")
+                else:
+                    library.remove_book(isbn)
 
         elif choice == '3':
             library.list_books()
@@ -112,12 +128,71 @@ def main():
 
         elif choice == '6':
             isbn = input("Enter ISBN to fetch from OpenLibrary: ")
-            book_data = get_book_details_from_openlibrary(isbn)
+            book_data = loop.run_until_complete(openlibrary.get_book_details(isbn))
             if book_data:
                 book = Book(**book_data)
                 library.add_book(book)
 
         elif choice == '7':
+            filename = input("Enter the path of a file with one ISBN per line: ")
+            try:
+                isbns = read_isbns(filename)
+            except OSError as e:
+                print(f"Could not read '{filename}': {e}")
+                continue
+            report = loop.run_until_complete(import_isbns(library, openlibrary, isbns, progress=print_progress))
+            print_summary(report)
+
+        elif choice == '8':
+            isbn = input("Enter ISBN of the book to check out: ")
+            borrower = input("Enter borrower: ")
+            try:
+                loan = circulation.checkout(isbn, borrower)
+                print(f"Checked out to {loan.borrower}, due {loan.due}.")
+            except KeyError:
+                print("Book not found.")
+            except CirculationError as e:
+                print(e)
+
+        elif choice == '9':
+            isbn = input("Enter ISBN of the book to return: ")
+            try:
+                loan = circulation.check_in(isbn)
+                print(f"Returned by {loan.borrower}.")
+            except CirculationError as e:
+                print(e)
+
+        elif choice == '10':
+            borrower = input("Enter borrower: ")
+            loans = circulation.on_loan_to(borrower)
+            if not loans:
+                print("No books on loan.")
+            for loan in loans:
+                print(f"{loan.isbn}, due {loan.due}")
+
+        elif choice == '11':
+            loans = circulation.overdue()
+            if not loans:
+                print("No overdue loans.")
+            for loan in loans:
+                print(f"{loan.isbn} with {loan.borrower}, due {loan.due}")
+
+        elif choice == '12':
+            print_report(library.duplicates())
+
+        elif choice == '13':
+            filename = input("Enter the export file name (.ndjson, .csv or .json, add .gz to compress): ")
+            try:
+                size = export_library(library, filename)
+                print(f"Exported the library to '{filename}' ({size:,} bytes).")
+            except OSError as e:
+                print(f"Could not write '{filename}': {e}")
+
+        elif choice == '14':
+            circulation.close()
+            library.close()
+            loop.run_until_complete(openlibrary.aclose())
+            loop.close()
             print("Exiting the application.")
             break
         else:
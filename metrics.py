@@ -0,0 +1,228 @@
+"""
+Counters and latency histograms, rendered in the Prometheus text format.
+
+A deliberately small stand-in for a metrics client: metrics are registered
+once at import time, carry a fixed set of label names, and are updated from
+any thread. `REGISTRY.render()` produces what the API serves on /metrics.
+Each process keeps its own numbers.
+"""
+import threading
+import time
+from bisect import bisect_left
+
+# Latency buckets in seconds, from 100 microseconds (an in-memory lookup) to 10 seconds (a slow remote call).
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    """A number that only goes up, per combination of label values."""
+
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels[name] for name in self.labelnames), 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram:
+    """Counts observations (usually durations in seconds) into cumulative buckets."""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # label values -> _Series
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def labels(self, **labels):
+        """
+        Returns the series for one combination of label values.
+
+        Hot paths look their series up once and keep it, which skips the
+        label handling on every observation.
+        """
+        key = tuple(labels[name] for name in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(key, _Series(self.buckets))
+        return series
+
+    def observe(self, value, **labels):
+        self.labels(**labels).observe(value)
+
+    def time(self, **labels):
+        """Returns a context manager that observes how long its `with` block took, even if it raises."""
+        return self.labels(**labels).time()
+
+    def count(self, **labels):
+        return sum(self.labels(**labels).snapshot()[0])
+
+    def samples(self):
+        with self._lock:
+            series = sorted(self._series.items())
+        for key, entry in series:
+            counts, total = entry.snapshot()
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [("le", _format_value(float(bound)))])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class _Series:
+    """The bucket counts and sum of a histogram for one combination of label values."""
+
+    __slots__ = ("_buckets", "_counts", "_sum", "_lock")
+
+    def __init__(self, buckets):
+        self._buckets = buckets
+        # One count per bucket, the last one for +Inf; not cumulative.
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        position = bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[position] += 1
+            self._sum += value
+
+    def time(self):
+        return _Timer(self)
+
+    def snapshot(self):
+        with self._lock:
+            return list(self._counts), self._sum
+
+
+class _Timer:
+    # A class rather than a @contextmanager generator: it is entered on every
+    # Library lookup, and this is several times cheaper.
+    __slots__ = ("_series", "_start")
+
+    def __init__(self, series):
+        self._series = series
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self._series.observe(time.perf_counter() - self._start)
+
+
+class Registry:
+    """The metrics of a process, in registration order."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+LIBRARY_OPERATION_SECONDS = REGISTRY.histogram(
+    "library_operation_seconds", "Time spent in Library operations, including waiting for the lock.", ["operation"])
+OPENLIBRARY_REQUEST_SECONDS = REGISTRY.histogram(
+    "openlibrary_request_seconds", "Latency of OpenLibrary lookups that went to the network.", ["outcome"])
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "Latency of API requests, by route template.", ["method", "route", "status"])
+ERRORS = REGISTRY.counter(
+    "library_errors_total", "Errors, by where they happened and their type.", ["source", "kind"])
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that records every HTTP request in HTTP_REQUEST_SECONDS.
+
+    Requests are labelled with the route template (`/books/{isbn}`), not the
+    path, so the number of series stays bounded. Unhandled exceptions are
+    counted in ERRORS before they propagate. A streaming response is timed
+    until it ends.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_and_record_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_record_status)
+        except Exception as e:
+            ERRORS.inc(source="api", kind=type(e).__name__)
+            raise
+        finally:
+            # The router stores the matched route in the scope.
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, method=scope["method"], route=route,
+                                         status=str(status))
@@ -0,0 +1,278 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import httpx
+from isbns import canonical_isbn
+from metrics import ERRORS, OPENLIBRARY_REQUEST_SECONDS
+
+SEARCH_API_URL = "https://openlibrary.org/search.json"
+
+# Responses worth retrying: rate limiting and server-side failures.
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+logger = logging.getLogger(__name__)
+
+
+def parse_search_response(isbn: str, data: dict):
+    """Turns an OpenLibrary search.json response into our book fields, or None if nothing was found."""
+    # Check if any documents were found
+    if data.get('numFound', 0) == 0 or not data.get('docs'):
+        logger.info("No book found with ISBN %s on OpenLibrary.", isbn, extra={"isbn": isbn})
+        return None
+
+    # Use the first result
+    book_data = data['docs'][0]
+
+    title = book_data.get('title', 'N/A')
+    author_names = ", ".join(book_data.get('author_name', ['N/A']))
+
+    # The year is often the first published year
+    year = book_data.get('first_publish_year', 0)
+
+    return {
+        'title': title,
+        'author': author_names,
+        'year': year,
+        'isbn': isbn
+    }
+
+
+# Returned by LookupCache.get when it holds nothing for an ISBN.
+MISS = object()
+
+
+class LookupCache:
+    """
+    A TTL cache of OpenLibrary lookups with a memory tier and a disk tier.
+
+    Recent results live in a bounded in-memory LRU; every result is also
+    written to a small SQLite file so it survives restarts. "Not found" results
+    are cached too, with a shorter TTL, so unknown ISBNs are not looked up
+    again on every request. Failed requests are never cached. Expired rows
+    are deleted when the cache is opened.
+    """
+
+    def __init__(self, path="openlibrary_cache.db", maxsize=1024, ttl=7 * 24 * 3600, negative_ttl=3600, clock=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._clock = clock
+        # isbn -> (expires_at, book fields or None)
+        self._memory = OrderedDict()
+        self.stats = {"hits": 0, "disk_hits": 0, "negative_hits": 0, "misses": 0}
+        self._db = None
+        # Results are written through a connection of their own, so that a
+        # commit on a worker thread (see `aput`) never holds up the reads.
+        self._writer = None
+        self._write_lock = threading.Lock()
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS lookups (isbn TEXT PRIMARY KEY, value TEXT, expires_at REAL NOT NULL)")
+            self._db.execute("DELETE FROM lookups WHERE expires_at <= ?", (clock(),))
+            self._db.commit()
+            self._writer = sqlite3.connect(path, check_same_thread=False)
+
+    def _remember(self, isbn, expires_at, value):
+        self._memory[isbn] = (expires_at, value)
+        self._memory.move_to_end(isbn)
+        if len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    def get(self, isbn):
+        """Returns the cached book fields, None for a cached "not found", or MISS."""
+        now = self._clock()
+        entry = self._memory.get(isbn)
+        if entry is not None and entry[0] <= now:
+            del self._memory[isbn]
+            entry = None
+        if entry is not None:
+            self._memory.move_to_end(isbn)
+            self.stats["hits"] += 1
+        elif self._db is not None:
+            row = self._db.execute("SELECT expires_at, value FROM lookups WHERE isbn = ?", (isbn,)).fetchone()
+            if row is not None and row[0] > now:
+                entry = (row[0], json.loads(row[1]) if row[1] is not None else None)
+                self._remember(isbn, *entry)
+                self.stats["disk_hits"] += 1
+        if entry is None:
+            self.stats["misses"] += 1
+            return MISS
+        if entry[1] is None:
+            self.stats["negative_hits"] += 1
+        return entry[1]
+
+    def put(self, isbn, value):
+        """Caches the book fields for an ISBN, or None to remember that it was not found."""
+        self._store(isbn, self._remember_result(isbn, value), value)
+
+    async def aput(self, isbn, value):
+        """Like `put`, but writes to disk on a worker thread instead of the event loop."""
+        expires_at = self._remember_result(isbn, value)
+        if self._writer is not None:
+            await asyncio.to_thread(self._store, isbn, expires_at, value)
+
+    def _remember_result(self, isbn, value):
+        """Adds a result to the memory tier and returns when it expires."""
+        expires_at = self._clock() + (self.ttl if value is not None else self.negative_ttl)
+        self._remember(isbn, expires_at, value)
+        return expires_at
+
+    def _store(self, isbn, expires_at, value):
+        with self._write_lock:
+            # The cache may have been closed while this waited for a thread.
+            if self._writer is None:
+                return
+            self._writer.execute(
+                "INSERT OR REPLACE INTO lookups (isbn, value, expires_at) VALUES (?, ?, ?)",
+                (isbn, json.dumps(value, ensure_ascii=False) if value is not None else None, expires_at),
+            )
+            self._writer.commit()
+
+    def info(self):
+        """Returns the hit/miss counters along with the current sizes of both tiers."""
+        info = dict(self.stats, memory_entries=len(self._memory), maxsize=self.maxsize,
+                    ttl=self.ttl, negative_ttl=self.negative_ttl)
+        if self._db is not None:
+            info["disk_entries"] = self._db.execute("SELECT COUNT(*) FROM lookups").fetchone()[0]
+        return info
+
+    def close(self):
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def open_lookup_cache():
+    """
+    Creates the lookup cache configured by environment variables.
+
+    OPENLIBRARY_CACHE_PATH (default "openlibrary_cache.db"; empty for memory
+    only), OPENLIBRARY_CACHE_SIZE, OPENLIBRARY_CACHE_TTL and
+    OPENLIBRARY_CACHE_NEGATIVE_TTL (both in seconds).
+    """
+    return LookupCache(
+        path=os.environ.get("OPENLIBRARY_CACHE_PATH", "openlibrary_cache.db"),
+        maxsize=int(os.environ.get("OPENLIBRARY_CACHE_SIZE", 1024)),
+        ttl=float(os.environ.get("OPENLIBRARY_CACHE_TTL", 7 * 24 * 3600)),
+        negative_ttl=float(os.environ.get("OPENLIBRARY_CACHE_NEGATIVE_TTL", 3600)),
+    )
+
+
+class RateLimiter:
+    """Spaces out calls so that no more than `rate` of them start per second."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next_start = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Waits until the next call is allowed to start."""
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            if self._next_start > now:
+                await asyncio.sleep(self._next_start - now)
+                now = self._next_start
+            self._next_start = now + self.interval
+
+
+class OpenLibraryClient:
+    """
+    An async client for the OpenLibrary search API.
+
+    One instance wraps a single long-lived `httpx.AsyncClient`, so connections
+    (and their TLS sessions) are pooled and reused across lookups. Requests
+    time out instead of hanging, and transient failures are retried with
+    exponential backoff. Create it once, e.g. in the API's lifespan hook, and
+    close it with `aclose` or by using it as an async context manager.
+    Pass a `LookupCache` to answer repeated lookups without a remote call.
+    """
+
+    def __init__(self, transport=None, timeout=10.0, retries=3, backoff=0.5, max_connections=20, cache=None):
+        self.cache = cache
+        self.retries = retries
+        self.backoff = backoff
+        self._client = httpx.AsyncClient(
+            transport=transport,
+            timeout=httpx.Timeout(timeout, connect=min(timeout, 5.0)),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            follow_redirects=True,
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        """Closes the pooled connections and the cache."""
+        await self._client.aclose()
+        if self.cache is not None:
+            self.cache.close()
+
+    async def _get(self, url, params):
+        """Sends a GET request, retrying transient failures with exponential backoff."""
+        for attempt in range(self.retries + 1):
+            try:
+                response = await self._client.get(url, params=params)
+                if response.status_code not in RETRY_STATUS_CODES or attempt == self.retries:
+                    response.raise_for_status()
+                    return response
+            except httpx.TransportError:
+                if attempt == self.retries:
+                    raise
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    async def lookup(self, isbn: str, limiter=None):
+        """
+        Looks up an ISBN, returning None if OpenLibrary does not know it.
+
+        Unlike `get_book_details`, request and parsing errors are raised, so
+        callers can tell a failure from a miss. A `RateLimiter` passed as
+        `limiter` throttles the remote calls; cache hits do not wait for it.
+        A valid ISBN is looked up, cached and returned as its ISBN-13, so
+        every notation of it shares one cache entry.
+        """
+        isbn = canonical_isbn(isbn) or isbn.strip()
+        if self.cache is not None:
+            cached = self.cache.get(isbn)
+            if cached is not MISS:
+                return cached
+        if limiter is not None:
+            await limiter.acquire()
+        start = time.perf_counter()
+        try:
+            response = await self._get(SEARCH_API_URL, {"isbn": isbn})
+            book_data = parse_search_response(isbn, response.json())
+        except Exception as e:
+            OPENLIBRARY_REQUEST_SECONDS.observe(time.perf_counter() - start, outcome="error")
+            ERRORS.inc(source="openlibrary", kind=type(e).__name__)
+            raise
+        OPENLIBRARY_REQUEST_SECONDS.observe(time.perf_counter() - start, outcome="found" if book_data else "not_found")
+        if self.cache is not None:
+            await self.cache.aput(isbn, book_data)
+        return book_data
+
+    async def get_book_details(self, isbn: str):
+        """
+        Fetches book details from OpenLibrary using the most reliable search API.
+        """
+        try:
+            return await self.lookup(isbn)
+        except (httpx.RequestError, httpx.HTTPStatusError, json.JSONDecodeError) as e:
+            logger.warning("Failed to fetch or parse data from OpenLibrary: %s", e, extra={"isbn": isbn})
+            return None
+        except Exception as e:
+            logger.exception("An unexpected error occurred: %s", e, extra={"isbn": isbn})
+            return None
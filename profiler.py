@@ -0,0 +1,77 @@
+"""
+A sampling profiler that can be switched on and off while the process runs.
+
+While it runs, a background thread looks at the stack of every other thread
+each `interval` seconds and counts how often each distinct stack was seen.
+It measures wall-clock time, so threads waiting on a lock or on I/O show up
+too. The report uses the "collapsed stack" format that flame graph tools
+read: one line per stack, frames from outermost to innermost separated by
+semicolons, then the number of samples. Nothing is sampled while it is off.
+"""
+import os
+import sys
+import threading
+from collections import Counter
+
+
+def _collapse(frame):
+    """Renders a thread's stack as `outer;...;inner` frame names."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    """Samples the stacks of all threads of the process between `start` and `stop`."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._samples = Counter()
+        self._samples_lock = threading.Lock()
+        self._thread = None
+        self._stopping = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self, interval=None):
+        """Starts sampling from scratch. Returns False if the profiler was already running."""
+        with self._lock:
+            if self._thread is not None:
+                return False
+            if interval is not None:
+                self.interval = interval
+            with self._samples_lock:
+                self._samples = Counter()
+            self._stopping = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(self._stopping,), name="sampling-profiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        """Stops sampling and returns the report, or None if the profiler was not running."""
+        with self._lock:
+            if self._thread is None:
+                return None
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+        return self.report()
+
+    def _run(self, stopping):
+        own = threading.get_ident()
+        while not stopping.wait(self.interval):
+            stacks = [_collapse(frame) for thread_id, frame in sys._current_frames().items() if thread_id != own]
+            with self._samples_lock:
+                self._samples.update(stacks)
+
+    def report(self):
+        """Returns the samples so far as collapsed stacks, most frequent first."""
+        with self._samples_lock:
+            samples = self._samples.most_common()
+        return "".join(f"{stack} {count}\n" for stack, count in samples)
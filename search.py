@@ -0,0 +1,263 @@
+"""
+An inverted full-text index over book titles and authors.
+
+Text is Unicode-normalized, stripped of accents and case-folded before it is
+split into tokens, so "Ademden Önce", "ademden once" and "ADEMDEN ÖNCE" all
+produce the same tokens. Every query term is matched as a prefix, which makes
+the index suitable for search-as-you-type, and results are ranked by where and
+how exactly the terms matched.
+"""
+import heapq
+import re
+import unicodedata
+from bisect import bisect_left, insort
+from functools import cached_property
+from itertools import product
+
+# Letters that Unicode does not decompose into a base letter plus an accent.
+_FOLD_LETTERS = str.maketrans({
+    "ı": "i", "ø": "o", "ł": "l", "đ": "d", "ð": "d", "þ": "th", "æ": "ae", "œ": "oe",
+})
+_TOKEN = re.compile(r"\w+")
+_EMPTY = frozenset()
+
+# How well a book matches one query term, best first: the term is a whole word
+# of the title; it starts a word of the title or is a whole word of the author;
+# it starts a word of the author. A book's score is the sum over all terms.
+TERM_SCORES = (4, 2, 1)
+# Queries with more terms than this score each candidate term by term instead of
+# trying every combination of per-term scores, as there are 3 ** terms of those.
+MAX_COMBINED_TERMS = 4
+
+
+def normalize(text):
+    """Case-folds text and strips accents, e.g. "Önce Işık" -> "once isik"."""
+    folded = text.casefold()
+    if folded.isascii():
+        # Most titles and names: nothing to decompose or strip.
+        return folded
+    decomposed = unicodedata.normalize("NFKD", folded)
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return stripped.translate(_FOLD_LETTERS)
+
+
+def tokenize(text):
+    """Splits normalized text into word tokens."""
+    return _TOKEN.findall(normalize(text))
+
+
+class SearchIndex:
+    """Maps title and author tokens to the books that contain them."""
+
+    FIELDS = ("title", "author")
+
+    def __init__(self):
+        # field -> token -> set of mapping keys
+        self._postings = {field: {} for field in self.FIELDS}
+        # Every token of either field in sorted order, so prefixes can be resolved with bisect.
+        self._vocabulary = []
+
+    def rebuild(self, items):
+        self._postings = {field: {} for field in self.FIELDS}
+        for key, book in items:
+            for field in self.FIELDS:
+                postings = self._postings[field]
+                for token in tokenize(getattr(book, field)):
+                    postings.setdefault(token, set()).add(key)
+        self._vocabulary = sorted(set().union(*self._postings.values()))
+
+    def add(self, key, book):
+        for field in self.FIELDS:
+            postings = self._postings[field]
+            for token in tokenize(getattr(book, field)):
+                if token not in postings:
+                    if not self._known(token):
+                        insort(self._vocabulary, token)
+                    postings[token] = set()
+                postings[token].add(key)
+
+    def discard(self, key, book):
+        for field in self.FIELDS:
+            postings = self._postings[field]
+            for token in tokenize(getattr(book, field)):
+                keys = postings.get(token)
+                if keys is None:
+                    continue
+                keys.discard(key)
+                if not keys:
+                    del postings[token]
+                    if not self._known(token):
+                        del self._vocabulary[bisect_left(self._vocabulary, token)]
+
+    def _known(self, token):
+        return any(token in postings for postings in self._postings.values())
+
+    def _expand(self, prefix):
+        """Returns every indexed token that starts with the prefix."""
+        start = bisect_left(self._vocabulary, prefix)
+        stop = bisect_left(self._vocabulary, prefix + "\U0010ffff", start)
+        return self._vocabulary[start:stop]
+
+    def search(self, query, limit=20):
+        """
+        Returns up to `limit` (mapping key, score) pairs for books matching every term.
+
+        Results are ordered by descending score. For short queries,
+        combinations of per-term scores are tried best first, each by walking
+        the smallest set of matches and probing the others, so the work stops
+        as soon as the page is full. Longer queries walk the books that match
+        the rarest term and score each of them.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        tiers = [_TermMatches(self, term) for term in terms]
+        if not all(tiers):
+            return []
+        if len(tiers) > MAX_COMBINED_TERMS:
+            return self._score_each(tiers, limit)
+        combinations = sorted(product(TERM_SCORES, repeat=len(terms)), key=sum, reverse=True)
+
+        results = []
+        for scores in combinations:
+            matches = sorted((tier.with_score(score) for tier, score in zip(tiers, scores)), key=len)
+            if not len(matches[0]):
+                continue
+            total = sum(scores)
+            for key in matches[0]:
+                if all(key in other for other in matches[1:]):
+                    results.append((key, total))
+                    if len(results) == limit:
+                        return results
+        return results
+
+    @staticmethod
+    def _score_each(tiers, limit):
+        """Scores every book that matches the rarest term against all terms; linear in the terms."""
+        tiers = sorted(tiers, key=lambda tier: len(tier.matches))
+        results = []
+        for key in tiers[0].matches:
+            total = 0
+            for tier in tiers:
+                score = tier.score_of(key)
+                if not score:
+                    break
+                total += score
+            else:
+                results.append((key, total))
+        return heapq.nlargest(limit, results, key=lambda result: result[1])
+
+
+class _TermMatches:
+    """
+    The books that match one query term, split by how well they match.
+
+    The groups for each score in TERM_SCORES are disjoint. They are lazy
+    views over the postings, built on first use, so nothing is copied and a
+    query whose best matches already fill the page never expands a short
+    prefix into all of its tokens.
+    """
+
+    def __init__(self, index, term):
+        self._index = index
+        self._term = term
+
+    @cached_property
+    def _expansions(self):
+        return self._index._expand(self._term)
+
+    def _prefix(self, field):
+        postings = self._index._postings[field]
+        return _Union([postings[token] for token in self._expansions if token in postings])
+
+    @cached_property
+    def title_exact(self):
+        return self._index._postings["title"].get(self._term, _EMPTY)
+
+    @cached_property
+    def author_exact(self):
+        return self._index._postings["author"].get(self._term, _EMPTY)
+
+    @cached_property
+    def title_prefix(self):
+        return self._prefix("title")
+
+    @cached_property
+    def author_prefix(self):
+        return self._prefix("author")
+
+    @cached_property
+    def matches(self):
+        """Every book that matches the term, whatever the score."""
+        return _Union([self.title_prefix, self.author_prefix])
+
+    def __bool__(self):
+        return len(self.matches) > 0
+
+    def score_of(self, key):
+        """The score of one book for this term, or 0 if it does not match."""
+        if key in self.title_exact:
+            return 4
+        if key in self.title_prefix or key in self.author_exact:
+            return 2
+        return 1 if key in self.author_prefix else 0
+
+    def with_score(self, score):
+        if score == 4:
+            return self.title_exact
+        if score == 2:
+            return _Difference(_Union([self.title_prefix, self.author_exact]), [self.title_exact])
+        return _Difference(self.author_prefix, [self.title_prefix, self.author_exact])
+
+
+class _Union:
+    """A read-only view of the union of several sets of keys."""
+
+    # Past this many sets, probing each one costs more than building the union.
+    MAX_PARTS = 8
+
+    def __init__(self, parts):
+        self._parts = [part for part in parts if len(part)]
+        # An upper bound, which is all the search needs to order its probes.
+        self._size = sum(len(part) for part in self._parts)
+
+    @cached_property
+    def _probe_parts(self):
+        if len(self._parts) > self.MAX_PARTS:
+            return [set().union(*self._parts)]
+        return self._parts
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, key):
+        return any(key in part for part in self._probe_parts)
+
+    def __iter__(self):
+        parts = self._probe_parts
+        if len(parts) == 1:
+            yield from parts[0]
+            return
+        for position, part in enumerate(parts):
+            for key in part:
+                if not any(key in earlier for earlier in parts[:position]):
+                    yield key
+
+
+class _Difference:
+    """A read-only view of the keys in one set but in none of the excluded ones."""
+
+    def __init__(self, base, excluded):
+        self._base = base
+        self._excluded = [part for part in excluded if len(part)]
+
+    def __len__(self):
+        return len(self._base)
+
+    def __contains__(self, key):
+        return key in self._base and not any(key in part for part in self._excluded)
+
+    def __iter__(self):
+        for key in self._base:
+            if not any(key in part for part in self._excluded):
+                yield key
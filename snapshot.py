@@ -0,0 +1,287 @@
+"""
+A binary snapshot of library.json that opens in constant time.
+
+Parsing library.json means decoding every record and building a Book for
+each before the first request is served. The snapshot holds the same
+catalog in a form that can be memory-mapped and used as it is:
+
+* a header, which also records the size and modification time of the JSON
+  file it was made from, so a snapshot of an older JSON file is never used;
+* the records, each a small fixed header followed by its UTF-8 strings;
+* the record offsets in catalog order, for iteration;
+* an open-addressing hash table from key to record offset, for lookups.
+
+`SnapshotBookMap` puts a mutable mapping on top: Books are only built when
+they are read, and changes are kept in memory until the next snapshot is
+written. The snapshot is a cache of library.json for this machine; it is
+rebuilt from the JSON file whenever it is missing or out of date.
+"""
+import mmap
+import os
+import struct
+import zlib
+from array import array
+from collections.abc import MutableMapping
+from book import Book
+
+MAGIC = b"LIBSNAP1"
+# magic, record count, JSON size, JSON mtime (ns), order offset, table offset, table slots
+_HEADER = struct.Struct("=8sQQqQQQ")
+# year, available, copy number, then the byte lengths of title, author, ISBN and date_added
+_RECORD = struct.Struct("=iBxxxIIIII")
+# The date_added length of a book that has none.
+_NO_DATE = 0xFFFFFFFF
+
+
+def _key_bytes(isbn, copy):
+    """The hashed form of a mapping key: the ISBN, or ISBN and copy number for a repeated ISBN."""
+    return isbn.encode("utf-8") if not copy else f"{isbn}\x00{copy}".encode("utf-8")
+
+
+def _split_key(key):
+    """Returns (isbn, copy) for a key made by `storage.index_by_isbn`, or None for anything else."""
+    if isinstance(key, str):
+        return key, 0
+    if isinstance(key, tuple) and len(key) == 2 and isinstance(key[0], str) and isinstance(key[1], int):
+        return key
+    return None
+
+
+def _source_stat(source_path):
+    stat = os.stat(source_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def write_snapshot(path, books, source_path):
+    """
+    Writes a snapshot of books, in catalog order, for the JSON file at `source_path`.
+
+    Repeated ISBNs get the same private keys as `storage.index_by_isbn`.
+    The file is written under a temporary name and renamed into place.
+    Returns False if it could not be renamed, e.g. because the old snapshot
+    is still mapped on Windows; it is then rebuilt on the next load.
+    """
+    temp_path = path + ".tmp"
+    offsets = array("Q")
+    hashes = array("I")
+    seen = {}
+    with open(temp_path, "wb") as f:
+        f.write(bytes(_HEADER.size))
+        position = _HEADER.size
+        for book in books:
+            isbn = book.isbn
+            copy = seen.get(isbn, 0)
+            seen[isbn] = copy + 1
+            date_added = book.date_added
+            strings = [book.title.encode("utf-8"), book.author.encode("utf-8"), isbn.encode("utf-8"),
+                       b"" if date_added is None else date_added.encode("utf-8")]
+            lengths = [len(s) for s in strings]
+            if date_added is None:
+                lengths[3] = _NO_DATE
+            record = _RECORD.pack(book.year, bool(book.available), copy, *lengths) + b"".join(strings)
+            f.write(record)
+            offsets.append(position)
+            hashes.append(zlib.crc32(_key_bytes(isbn, copy)))
+            position += len(record)
+        # Align the arrays so they can be viewed in place.
+        padding = -position % 8
+        f.write(bytes(padding))
+        order_offset = position + padding
+        f.write(offsets.tobytes())
+
+        slots = 8
+        while slots < 2 * len(offsets):
+            slots *= 2
+        # A slot holds its record's offset plus one, and 0 when empty.
+        table = array("Q", bytes(8 * slots))
+        mask = slots - 1
+        for offset, key_hash in zip(offsets, hashes):
+            slot = key_hash & mask
+            while table[slot]:
+                slot = (slot + 1) & mask
+            table[slot] = offset + 1
+        table_offset = order_offset + 8 * len(offsets)
+        f.write(table.tobytes())
+        size, mtime_ns = _source_stat(source_path)
+        f.seek(0)
+        f.write(_HEADER.pack(MAGIC, len(offsets), size, mtime_ns, order_offset, table_offset, slots))
+        f.flush()
+        os.fsync(f.fileno())
+    try:
+        os.replace(temp_path, path)
+    except OSError:
+        os.remove(temp_path)
+        return False
+    return True
+
+
+class Snapshot:
+    """A memory-mapped, read-only snapshot file."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, self.count, self.source_size, self.source_mtime_ns, order_offset, table_offset, slots = \
+                _HEADER.unpack_from(self._mmap)
+            if magic != MAGIC:
+                raise ValueError(f"'{path}' is not a library snapshot")
+            self._order = memoryview(self._mmap)[order_offset:order_offset + 8 * self.count].cast("Q")
+            self._table = memoryview(self._mmap)[table_offset:table_offset + 8 * slots].cast("Q")
+        except Exception:
+            self._mmap.close()
+            raise
+        self._mask = slots - 1
+
+    def __len__(self):
+        return self.count
+
+    def matches(self, source_path):
+        """Tells whether this snapshot was made from the current version of the JSON file."""
+        try:
+            return _source_stat(source_path) == (self.source_size, self.source_mtime_ns)
+        except OSError:
+            return False
+
+    def _key_at(self, offset):
+        _, _, copy, title_len, author_len, isbn_len, _ = _RECORD.unpack_from(self._mmap, offset)
+        start = offset + _RECORD.size + title_len + author_len
+        isbn = str(self._mmap[start:start + isbn_len], "utf-8")
+        return isbn if not copy else (isbn, copy)
+
+    def _record_at(self, offset):
+        """Returns (key, Book) for the record at an offset."""
+        mm = self._mmap
+        year, available, copy, title_len, author_len, isbn_len, date_len = _RECORD.unpack_from(mm, offset)
+        author_start = offset + _RECORD.size + title_len
+        isbn_start = author_start + author_len
+        date_start = isbn_start + isbn_len
+        isbn = str(mm[isbn_start:date_start], "utf-8")
+        date_added = None if date_len == _NO_DATE else str(mm[date_start:date_start + date_len], "utf-8")
+        book = Book(str(mm[offset + _RECORD.size:author_start], "utf-8"), str(mm[author_start:isbn_start], "utf-8"),
+                    isbn, year, bool(available), date_added)
+        return (isbn if not copy else (isbn, copy)), book
+
+    def find(self, key):
+        """Returns the offset of the record with this key, or None."""
+        parts = _split_key(key)
+        if parts is None:
+            return None
+        isbn, copy = parts
+        slot = zlib.crc32(_key_bytes(isbn, copy)) & self._mask
+        while True:
+            entry = self._table[slot]
+            if not entry:
+                return None
+            if self._key_at(entry - 1) == key:
+                return entry - 1
+            slot = (slot + 1) & self._mask
+
+    def get(self, key):
+        """Returns the Book stored under a key, or None."""
+        offset = self.find(key)
+        return None if offset is None else self._record_at(offset)[1]
+
+    def keys(self):
+        for offset in self._order:
+            yield self._key_at(offset)
+
+    def items(self):
+        for offset in self._order:
+            yield self._record_at(offset)
+
+    def close(self):
+        self._order.release()
+        self._table.release()
+        self._mmap.close()
+
+
+def open_snapshot(path, source_path):
+    """Opens the snapshot at `path` if it exists and matches the JSON file at `source_path`, else returns None."""
+    try:
+        snapshot = Snapshot(path)
+    except (OSError, ValueError, struct.error):
+        return None
+    if not snapshot.matches(source_path):
+        snapshot.close()
+        return None
+    return snapshot
+
+
+class SnapshotBookMap(MutableMapping):
+    """
+    A mapping of key to Book that reads from a Snapshot and keeps changes in memory.
+
+    Like the other lazy backends, a Book read from the map is built on
+    access, and changes must be written back with `map[key] = book`, which
+    `Library.update_book` already does. Iteration follows dict semantics:
+    keys keep their place when updated, and new or re-added keys come last.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        # Snapshot keys whose book was replaced in place.
+        self._updated = {}
+        # Snapshot keys that were deleted (and may since have been re-added).
+        self._removed = set()
+        # Keys added since the snapshot was taken, in insertion order.
+        self._added = {}
+
+    def __getitem__(self, key):
+        book = self._added.get(key)
+        if book is not None:
+            return book
+        if key in self._removed:
+            raise KeyError(key)
+        book = self._updated.get(key)
+        if book is None:
+            book = self.snapshot.get(key)
+            if book is None:
+                raise KeyError(key)
+        return book
+
+    def __contains__(self, key):
+        if key in self._added:
+            return True
+        if key in self._removed:
+            return False
+        return key in self._updated or self.snapshot.find(key) is not None
+
+    def __setitem__(self, key, book):
+        if key in self._added or key in self._removed:
+            self._added[key] = book
+        elif key in self._updated or self.snapshot.find(key) is not None:
+            self._updated[key] = book
+        else:
+            self._added[key] = book
+
+    def __delitem__(self, key):
+        if key in self._added:
+            del self._added[key]
+        elif key not in self._removed and (key in self._updated or self.snapshot.find(key) is not None):
+            self._removed.add(key)
+            self._updated.pop(key, None)
+        else:
+            raise KeyError(key)
+
+    def __iter__(self):
+        removed = self._removed
+        for key in self.snapshot.keys():
+            if key not in removed:
+                yield key
+        yield from self._added
+
+    def __len__(self):
+        return len(self.snapshot) - len(self._removed) + len(self._added)
+
+    def values(self):
+        for key, book in self.items():
+            yield book
+
+    def items(self):
+        """Yields every (key, book) pair in order, decoding each snapshot record once."""
+        removed, updated = self._removed, self._updated
+        for key, book in self.snapshot.items():
+            if key not in removed:
+                yield key, updated.get(key, book)
+        yield from self._added.items()
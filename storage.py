@@ -0,0 +1,477 @@
+"""
+Storage backends for the Library.
+
+A backend hands the Library a mutable mapping of ISBN to Book through `load`,
+and is told about mutations through `persist`, one or more records at a time,
+so it can make the changes durable. `save` flushes everything and `close` releases files or connections.
+Each mutation runs inside `transaction()`. `version()` returns a counter that
+every persisted mutation bumps, from this process or another, and `persist`
+returns its new value; both are None for stores that cannot be shared. A
+Library compares versions to tell when its in-memory indexes are stale.
+
+* `JSONStorage` keeps the catalog in a dict and writes `library.json`, either in
+  full on every mutation or, with `journal=True`, through an append-only journal.
+  With `columnar=True` the catalog is held in a `columns.ColumnarBookMap`, and
+  with `snapshot=True` it is opened lazily from a binary `snapshot.Snapshot`
+  of the JSON file, so startup does not have to parse it. The file is read and
+  written with the fastest installed `jsoncodec` codec.
+* `SQLiteStorage` keeps the catalog in a SQLite database and only reads the rows
+  that are asked for, so memory use and startup time do not grow with the catalog.
+  Several processes, such as `uvicorn --workers N`, can share one database.
+"""
+import json
+import os
+import sqlite3
+import sys
+import threading
+from collections.abc import MutableMapping
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from book import Book
+from isbns import canonical_isbn
+from columns import ColumnarBookMap
+from journal import Journal
+from jsoncodec import get_codec
+from snapshot import SnapshotBookMap, open_snapshot, write_snapshot
+
+
+def index_by_isbn(books):
+    """Builds an insertion-ordered dict of books keyed by ISBN."""
+    indexed = {}
+    for book in books:
+        key = book.isbn
+        # Older data files can hold several records with the same ISBN
+        # (e.g. "N/A"). Keep them all; extra copies get a private key so
+        # that lookups by ISBN still resolve to the first one.
+        copy = 1
+        while key in indexed:
+            key = (book.isbn, copy)
+            copy += 1
+        indexed[key] = book
+    return indexed
+
+
+def remove_isbn(books, isbn):
+    """
+    Removes every record with the given ISBN from a mapping built by `index_by_isbn`.
+
+    Returns the removed (key, book) pairs, which is empty if nothing matched.
+    """
+    book = books.pop(isbn, None)
+    if book is None:
+        return []
+    removed = [(isbn, book)]
+    # Drop any duplicate records that were loaded for the same ISBN.
+    copy = 1
+    while (book := books.pop((isbn, copy), None)) is not None:
+        removed.append(((isbn, copy), book))
+        copy += 1
+    return removed
+
+
+class JSONStorage:
+    """Stores the whole catalog in memory and persists it to a JSON file."""
+
+    def __init__(self, filename="library.json", journal=False, columnar=False, snapshot=False, compact=False,
+                 codec=None):
+        """
+        With `journal=True`, mutations are appended to `<filename>.journal` and
+        only folded into `filename` when the journal grows large or the library
+        is saved explicitly, so the cost of a write no longer depends on the
+        size of the catalog. With `columnar=True`, books are kept in compact
+        columns rather than as one object each.
+
+        With `snapshot=True` (ignored with `columnar`), a binary snapshot is
+        kept in `<filename>.snap` and the catalog is read from it on demand,
+        so loading takes the same short time whatever the size of the
+        catalog. The snapshot is rewritten when the journal is compacted and
+        when the storage is closed after a save, and rebuilt from the JSON
+        file when it is missing or older than the file.
+
+        `codec` names the `jsoncodec` codec to read and write the file with
+        (by default LIBRARY_JSON_CODEC or the fastest installed). With
+        `compact=True` the file is written without indentation, which makes
+        it smaller and quicker to write and to parse.
+        """
+        self.filename = filename
+        self.codec = get_codec(codec)
+        self.indent = not compact
+        self.columnar = columnar
+        self.snapshot_path = filename + ".snap" if snapshot and not columnar else None
+        self.journal = Journal(filename + ".journal") if journal else None
+        self._snapshot = None
+        # The books last written to the JSON file while the snapshot lags behind it.
+        self._unsnapshotted = None
+        self._compaction_lock = threading.Lock()
+
+    def transaction(self):
+        """Mutations need no extra isolation: the file belongs to this process alone."""
+        return nullcontext()
+
+    def version(self):
+        """A JSON file is not shared between processes, so there is no version to track."""
+        return None
+
+    def load(self):
+        """Loads books from the snapshot, if there is a current one, or the JSON file."""
+        if self.snapshot_path is not None:
+            self._snapshot = open_snapshot(self.snapshot_path, self.filename)
+            if self._snapshot is not None:
+                books = SnapshotBookMap(self._snapshot)
+                if self.journal is not None:
+                    self._replay_journal(books)
+                return books
+        books = self._load_json()
+        if self.snapshot_path is not None and os.path.exists(self.filename):
+            # Make the next start fast.
+            write_snapshot(self.snapshot_path, books.values(), self.filename)
+        if self.journal is not None:
+            self._replay_journal(books)
+        return books
+
+    def _load_json(self):
+        """Loads books from the JSON file, ensuring UTF-8 encoding is used."""
+        try:
+            with open(self.filename, 'rb') as f:
+                books_data = self.codec.loads(f.read())
+                loaded_books = []
+                for data in books_data:
+                    # For backward compatibility, add a default date if it's missing
+                    if 'date_added' not in data:
+                        data['date_added'] = datetime(1970, 1, 1).isoformat()
+                    book = Book(**data)
+                    # Many books share an author and an import date; store each value once.
+                    book.author = sys.intern(book.author)
+                    if book.date_added is not None:
+                        book.date_added = sys.intern(book.date_added)
+                    loaded_books.append(book)
+        except (FileNotFoundError, json.JSONDecodeError):
+            loaded_books = []
+        books = index_by_isbn(loaded_books)
+        if self.columnar:
+            books = ColumnarBookMap(books.items())
+        return books
+
+    def _replay_journal(self, books):
+        """Re-applies journaled mutations that are not yet part of the snapshot."""
+        for record in self.journal.records():
+            if record["op"] == "add":
+                book = Book(**record["book"])
+                books.setdefault(book.isbn, book)
+            elif record["op"] == "update":
+                book = books.get(record["isbn"])
+                if book:
+                    for key, value in record["changes"].items():
+                        setattr(book, key, value)
+                    books[record["isbn"]] = book
+            elif record["op"] == "remove":
+                remove_isbn(books, record["isbn"])
+
+    def persist(self, records, books):
+        """Makes a group of mutations durable, either via the journal or a single full save."""
+        if self.journal is None:
+            self.save(books)
+            return
+        for record in records:
+            self.journal.append(record)
+        if self.journal.needs_compaction():
+            self.compact(books, background=True)
+
+    def save(self, books):
+        """
+        Saves the current list of books to the JSON file using UTF-8.
+
+        The file is replaced atomically, so a crash or a concurrent reader
+        never sees it half-written.
+        """
+        if self.journal is not None:
+            self.compact(books)
+            return
+        snapshot = list(books.values())
+        self._write_file(snapshot)
+        if self.snapshot_path is not None:
+            # Rewriting the snapshot too would double the cost of every
+            # mutation; `close` does it once.
+            self._unsnapshotted = snapshot
+
+    def compact(self, books, background=False):
+        """
+        Folds the journal into a fresh snapshot of the JSON file.
+
+        The in-memory state is captured and the journal rotated synchronously;
+        writing the snapshot can then happen on a background thread. A
+        background compaction is skipped if another one is still running.
+        """
+        if not self._compaction_lock.acquire(blocking=not background):
+            return
+        try:
+            # The Library replaces a Book rather than changing it, so these
+            # objects stay as they are while they are written out.
+            snapshot = list(books.values())
+            self.journal.rotate()
+        except Exception:
+            self._compaction_lock.release()
+            raise
+        if background:
+            threading.Thread(target=self._write_snapshot, args=(snapshot,), daemon=True).start()
+        else:
+            self._write_snapshot(snapshot)
+
+    def _write_snapshot(self, snapshot):
+        """Atomically replaces the JSON file with the snapshot and drops the rotated journal."""
+        try:
+            self._write_file(snapshot, binary=True)
+            self.journal.discard_rotated()
+        finally:
+            self._compaction_lock.release()
+
+    def _write_file(self, snapshot, binary=False):
+        """
+        Writes the books to a temporary file, syncs it and renames it over the JSON file.
+
+        With `binary=True` the binary snapshot is rewritten to match, if snapshots are enabled.
+        """
+        temp_filename = self.filename + ".tmp"
+        with open(temp_filename, 'wb') as f:
+            f.write(self.codec.dumps(snapshot, indent=self.indent))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_filename, self.filename)
+        if binary and self.snapshot_path is not None:
+            # The old snapshot may still be mapped and in use, and Windows
+            # refuses to rename over a mapped file; `close` retries once it is unmapped.
+            written = write_snapshot(self.snapshot_path, snapshot, self.filename)
+            self._unsnapshotted = None if written else snapshot
+
+    def close(self):
+        """Waits for any running compaction, closes the journal, and unmaps the snapshot and brings it up to date."""
+        if self.journal is not None:
+            with self._compaction_lock:
+                self.journal.close()
+        if self._snapshot is not None:
+            # Unmap first: the new snapshot is renamed over this file.
+            self._snapshot.close()
+            self._snapshot = None
+        if self._unsnapshotted is not None:
+            write_snapshot(self.snapshot_path, self._unsnapshotted, self.filename)
+            self._unsnapshotted = None
+
+
+class SQLiteBookMap(MutableMapping):
+    """A mapping of ISBN to Book that reads and writes rows of the `books` table on demand."""
+
+    _COLUMNS = "title, author, isbn, year, available, date_added"
+
+    def __init__(self, connection):
+        self._db = connection
+
+    @staticmethod
+    def _to_book(row):
+        title, author, isbn, year, available, date_added = row
+        return Book(title, author, isbn, year, bool(available), date_added)
+
+    def __getitem__(self, isbn):
+        row = None
+        if isinstance(isbn, str):
+            row = self._db.execute(f"SELECT {self._COLUMNS} FROM books WHERE isbn = ?", (isbn,)).fetchone()
+        if row is None:
+            raise KeyError(isbn)
+        return self._to_book(row)
+
+    def __setitem__(self, isbn, book):
+        # An upsert keeps the rowid, and with it the insertion order, of existing rows.
+        self._db.execute(
+            f"INSERT INTO books ({self._COLUMNS}, canonical_isbn) VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(isbn) DO UPDATE SET title = excluded.title, author = excluded.author, "
+            "year = excluded.year, available = excluded.available, date_added = excluded.date_added, "
+            "canonical_isbn = excluded.canonical_isbn",
+            (book.title, book.author, isbn, book.year, int(book.available), book.date_added,
+             canonical_isbn(book.isbn)),
+        )
+
+    def __delitem__(self, isbn):
+        deleted = 0
+        if isinstance(isbn, str):
+            deleted = self._db.execute("DELETE FROM books WHERE isbn = ?", (isbn,)).rowcount
+        if not deleted:
+            raise KeyError(isbn)
+
+    def __contains__(self, isbn):
+        if not isinstance(isbn, str):
+            return False
+        return self._db.execute("SELECT 1 FROM books WHERE isbn = ?", (isbn,)).fetchone() is not None
+
+    def __iter__(self):
+        for (isbn,) in self._db.execute("SELECT isbn FROM books ORDER BY rowid"):
+            yield isbn
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM books").fetchone()[0]
+
+    def values(self):
+        """Yields every book in insertion order with a single query."""
+        for row in self._db.execute(f"SELECT {self._COLUMNS} FROM books ORDER BY rowid"):
+            yield self._to_book(row)
+
+    def items(self):
+        """Yields every (ISBN, book) pair in insertion order with a single query."""
+        for book in self.values():
+            yield book.isbn, book
+
+    def key_for_isbn(self, canonical):
+        """
+        Returns the key of the first book stored under any notation of a canonical ISBN-13, or None.
+
+        This takes the place of `indexes.IsbnIndex`, which every process would
+        otherwise have to rebuild from the whole table after another one writes.
+        """
+        row = self._db.execute("SELECT isbn FROM books WHERE canonical_isbn = ? ORDER BY rowid LIMIT 1",
+                               (canonical,)).fetchone()
+        return row[0] if row is not None else None
+
+
+class SQLiteStorage:
+    """Stores the catalog in a SQLite database in WAL mode."""
+
+    def __init__(self, filename="library.db"):
+        self.filename = filename
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS books (
+                isbn TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                author TEXT NOT NULL,
+                year INTEGER NOT NULL,
+                available INTEGER NOT NULL DEFAULT 1,
+                date_added TEXT,
+                canonical_isbn TEXT
+            );
+            CREATE INDEX IF NOT EXISTS books_author ON books (author);
+            CREATE INDEX IF NOT EXISTS books_year ON books (year);
+            CREATE INDEX IF NOT EXISTS books_date_added ON books (date_added);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+            INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+        """)
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(books)")]
+        if "canonical_isbn" not in columns:
+            # A database from before the column: fill it in once.
+            self._db.execute("ALTER TABLE books ADD COLUMN canonical_isbn TEXT")
+            self._db.executemany("UPDATE books SET canonical_isbn = ? WHERE isbn = ?",
+                                 [(canonical_isbn(isbn), isbn) for (isbn,) in self._db.execute("SELECT isbn FROM books")])
+        self._db.execute("CREATE INDEX IF NOT EXISTS books_canonical_isbn ON books (canonical_isbn)")
+        self._db.commit()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Runs a mutation as one write transaction.
+
+        BEGIN IMMEDIATE takes the database's write lock up front, so a check
+        such as "is this ISBN taken?" and the write that follows cannot
+        interleave with another process's writes.
+        """
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._db.rollback()
+            raise
+        if self._db.in_transaction:
+            self._db.commit()
+
+    @property
+    def connection(self):
+        """The database connection, for tables kept next to the catalog, such as the loans of `circulation`."""
+        return self._db
+
+    def version(self):
+        """Returns the change counter, which every committed mutation from any process bumps."""
+        return self._db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    def load(self):
+        """Returns a live view of the `books` table; no rows are read up front."""
+        return SQLiteBookMap(self._db)
+
+    def persist(self, records, books):
+        """Bumps the change counter and commits it with the mutations' row changes. Returns the new version."""
+        (version,) = self._db.execute("UPDATE meta SET value = value + 1 WHERE key = 'version' RETURNING value").fetchone()
+        self._db.commit()
+        return version
+
+    def save(self, books):
+        """Commits any outstanding changes."""
+        self._db.commit()
+
+    def close(self):
+        """Commits and closes the database connection."""
+        self._db.commit()
+        self._db.close()
+
+
+STORAGE_BACKENDS = {
+    "json": lambda path, columnar, snapshot, compact: JSONStorage(path or "library.json", columnar=columnar,
+                                                                  snapshot=snapshot, compact=compact),
+    "journal": lambda path, columnar, snapshot, compact: JSONStorage(path or "library.json", journal=True,
+                                                                     columnar=columnar, snapshot=snapshot,
+                                                                     compact=compact),
+    "sqlite": lambda path, columnar, snapshot, compact: SQLiteStorage(path or "library.db"),
+}
+
+
+def open_storage(backend=None, path=None, columnar=None, snapshot=None, compact=None):
+    """
+    Opens a storage backend by name.
+
+    Defaults come from the LIBRARY_STORAGE ("json", "journal" or "sqlite"),
+    LIBRARY_PATH, LIBRARY_COLUMNAR ("1" to hold a JSON catalog in columns)
+    LIBRARY_SNAPSHOT ("0" to parse the JSON file on every start instead
+    of keeping a binary snapshot) and LIBRARY_COMPACT_JSON ("1" to write the
+    JSON file without indentation) environment variables, so `api.py` and
+    `main.py` can pick a backend at startup without code changes.
+    """
+    backend = backend or os.environ.get("LIBRARY_STORAGE", "json")
+    path = path or os.environ.get("LIBRARY_PATH")
+    if columnar is None:
+        columnar = os.environ.get("LIBRARY_COLUMNAR") == "1"
+    if snapshot is None:
+        snapshot = os.environ.get("LIBRARY_SNAPSHOT") != "0"
+    if compact is None:
+        compact = os.environ.get("LIBRARY_COMPACT_JSON") == "1"
+    try:
+        factory = STORAGE_BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown storage backend '{backend}'. Choose one of: {', '.join(STORAGE_BACKENDS)}.")
+    return factory(path, columnar, snapshot, compact)
+
+
+def migrate_json_to_sqlite(json_filename="library.json", db_filename="library.db"):
+    """
+    Copies every book from a JSON library file into a SQLite database.
+
+    The database uses the ISBN as its primary key, so only the first record of
+    each ISBN is kept. Returns a (copied, skipped) tuple of counts.
+    """
+    books = JSONStorage(json_filename).load()
+    storage = SQLiteStorage(db_filename)
+    target = storage.load()
+    copied = skipped = 0
+    for key, book in books.items():
+        if not isinstance(key, str) or key in target:
+            skipped += 1
+            continue
+        target[key] = book
+        copied += 1
+    storage.close()
+    return copied, skipped
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    source = args[0] if args else "library.json"
+    target = args[1] if len(args) > 1 else "library.db"
+    copied, skipped = migrate_json_to_sqlite(source, target)
+    print(f"Copied {copied} books from '{source}' to '{target}'.")
+    if skipped:
+        print(f"Skipped {skipped} records whose ISBN was already present.")
@@ -1,14 +1,23 @@
+import asyncio
 import pytest
 from fastapi.testclient import TestClient
 import os
 import json
+import time
 
-# Import the app and the Library class
+import functools
+import httpx
+
+# Import the app
+import api
 from api import app
+from openlibrary import OpenLibraryClient
+from http_cache import ResponseCache
+from isbns import make_isbn
 from library import Library
 
-@pytest.fixture
-def client(monkeypatch, tmp_path):
+@pytest.fixture(params=["json", "sqlite"])
+def client(request, monkeypatch, tmp_path):
     """
     This fixture creates a temporary, isolated environment for each test function.
     
@@ -21,14 +30,14 @@ def client(monkeypatch, tmp_path):
     # Create an empty library file to start fresh
     test_library_path.write_text("[]", encoding="utf-8")
 
-    # This is the magic: We tell our Library class to use the temporary file
-    # instead of the real "library.json" whenever it's initialized during tests.
-    # We define a proper function for __init__ that doesn't return a value.
-    def mock_init(self, filename=str(test_library_path)):
-        self.filename = filename
-        self.books = self.load_books()
-
-    monkeypatch.setattr(Library, '__init__', mock_init)
+    # Point the API at the temporary file instead of the real "library.json".
+    # The storage backend is chosen from these variables when the app starts,
+    # and every test runs once against each backend.
+    if request.param == "sqlite":
+        test_library_path = tmp_path / "test_library.db"
+    monkeypatch.setenv("LIBRARY_STORAGE", request.param)
+    monkeypatch.setenv("LIBRARY_PATH", str(test_library_path))
+    monkeypatch.setenv("OPENLIBRARY_CACHE_PATH", str(tmp_path / "openlibrary_cache.db"))
 
     # The 'with' statement ensures FastAPI's lifespan events run correctly
     # for a clean startup and shutdown within the test.
@@ -105,3 +114,332 @@ def test_remove_existing_book(client):
 
     get_response = client.get("/books/66666")
     assert get_response.status_code == 404
+
+def test_list_books_with_query_parameters(client):
+    """Test filtering, sorting and paging of the book list, with the total in a header."""
+    for isbn, title, year in [("1", "Charlie", 2001), ("2", "Alpha", 1999), ("3", "Bravo", 2010)]:
+        client.post("/books", json={"title": title, "author": "Tester", "isbn": isbn, "year": year})
+
+    response = client.get("/books", params={"sort": "title_asc", "limit": 2})
+    assert [b["title"] for b in response.json()] == ["Alpha", "Bravo"]
+    assert response.headers["X-Total-Count"] == "3"
+
+    response = client.get("/books", params={"year_from": 2000, "sort": "year_desc", "offset": 1})
+    assert [b["isbn"] for b in response.json()] == ["1"]
+    assert response.headers["X-Total-Count"] == "2"
+
+    assert client.get("/books", params={"sort": "shelf_asc"}).status_code == 400
+
+def test_search_books(client):
+    """Test the full-text search endpoint."""
+    client.post("/books", json={"title": "Ademden Önce", "author": "London, Jack", "isbn": "1", "year": 2019})
+    client.post("/books", json={"title": "Martin Eden", "author": "London, Jack", "isbn": "2", "year": 1909})
+
+    response = client.get("/search", params={"q": "ademden ONCE"})
+    assert response.status_code == 200
+    assert [b["isbn"] for b in response.json()] == ["1"]
+    assert len(client.get("/search", params={"q": "lond"}).json()) == 2
+
+def test_conditional_get_and_invalidation(client):
+    """Test that an unchanged catalog answers If-None-Match with 304 and a change issues a new ETag."""
+    client.post("/books", json={"title": "A", "author": "Author", "isbn": "1", "year": 2000})
+    response = client.get("/books", params={"sort": "title_asc"})
+    etag = response.headers["etag"]
+    assert response.headers["x-total-count"] == "1"
+
+    cached = client.get("/books", params={"sort": "title_asc"}, headers={"If-None-Match": etag})
+    assert cached.status_code == 304 and cached.content == b""
+    assert client.get("/books/1", headers={"If-None-Match": etag}).status_code == 304
+    # If-Modified-Since only answers 304 once the change before the last one is a second old.
+    api.app_state["library"]._previous_modified -= 1
+    since = client.get("/books", headers={"If-Modified-Since": response.headers["last-modified"]})
+    assert since.status_code == 304
+
+    client.put("/books/1", json={"title": "B", "author": "Author", "isbn": "1", "year": 2000})
+    changed = client.get("/books", params={"sort": "title_asc"}, headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["etag"] != etag
+    assert [b["title"] for b in changed.json()] == ["B"]
+    assert client.get("/books/1").json()["title"] == "B"
+    assert client.get("/books/2").status_code == 404
+
+def test_if_modified_since_sees_changes_in_the_same_second(client):
+    """Test that a change in the same second as the Last-Modified a client holds is not answered with 304."""
+    client.post("/books", json={"title": "A", "author": "Author", "isbn": "1", "year": 2000})
+    library = api.app_state["library"]
+    # Pin every change to one second, as fast successive requests would be.
+    library._last_modified = library._previous_modified = 1_700_000_000.1
+    response = client.get("/books")
+    library._changed(library._version + 1)
+    library._last_modified = 1_700_000_000.9
+    changed = client.get("/books", headers={"If-Modified-Since": response.headers["last-modified"]})
+    assert changed.status_code == 200
+
+    library._previous_modified = 1_699_999_999.5
+    current = client.get("/books", headers={"If-Modified-Since": changed.headers["last-modified"]})
+    assert current.status_code == 304
+
+def test_large_responses_are_compressed(client):
+    """Test that a large list is gzip-encoded for clients that accept it, and served the same from the cache."""
+    for n in range(30):
+        client.post("/books", json={"title": f"Book {n}", "author": "Author", "isbn": str(n), "year": 2000})
+    first = client.get("/books", headers={"Accept-Encoding": "gzip"})
+    second = client.get("/books", headers={"Accept-Encoding": "gzip"})
+    plain = client.get("/books", headers={"Accept-Encoding": "identity"})
+    assert first.headers["content-encoding"] == "gzip"
+    assert first.json() == second.json() == plain.json()
+    assert len(first.json()) == 30 and first.headers["x-total-count"] == "30"
+    assert "content-encoding" not in plain.headers
+
+    # The two representations have strong ETags of their own, and either revalidates.
+    assert first.headers["etag"] == second.headers["etag"] != plain.headers["etag"]
+    assert first.headers["etag"].endswith('-gzip"')
+    for response in (first, plain):
+        cached = client.get("/books", headers={"Accept-Encoding": "gzip", "If-None-Match": response.headers["etag"]})
+        assert cached.status_code == 304 and cached.headers["etag"] == response.headers["etag"]
+
+def test_response_cache_drops_old_versions_and_stays_within_its_size():
+    """Test that caching a newer version evicts every older one, and that bodies are bounded in bytes."""
+    cache = ResponseCache(max_bytes=100)
+    cache.put("a", 1, b"x" * 40)
+    cache.put("b", 1, b"x" * 40)
+    cache.put("c", 2, b"x" * 10)
+    assert cache.get("a", 1) is None and cache.get("b", 1) is None and cache.get("c", 2) is not None
+    cache.put("d", 2, b"x" * 60)
+    cache.put("e", 2, b"x" * 60)
+    assert cache.get("c", 2) is None and cache.get("d", 2) is None and cache.get("e", 2) is not None
+
+def test_change_feed(client):
+    """Test that a client can catch up from the version of its last response."""
+    client.post("/books", json={"title": "A", "author": "Author", "isbn": "1", "year": 2000})
+    version = int(client.get("/books").headers["x-library-version"])
+    client.put("/books/1", json={"title": "B", "author": "Author", "isbn": "1", "year": 2000})
+    client.delete("/books/1")
+
+    feed = client.get("/books/changes", params={"since": version}).json()
+    assert feed["reset"] is False
+    assert [(change["op"], change["isbn"]) for change in feed["changes"]] == [("update", "1"), ("remove", "1")]
+    assert client.get("/books/changes", params={"since": feed["version"]}).json()["changes"] == []
+    assert client.get("/books/changes", params={"since": -1}).json()["reset"] is True
+
+def test_batch_update_and_remove(client):
+    """Test that PATCH and DELETE /books change many books in one version, or none if any is unknown."""
+    for n in range(4):
+        client.post("/books", json={"title": f"Book {n}", "author": "Author", "isbn": str(n), "year": 2000})
+    version = int(client.get("/books").headers["x-library-version"])
+
+    response = client.patch("/books", json={"isbns": ["0", "1", "2"], "changes": {"available": False}})
+    assert response.status_code == 200
+    assert [(r["isbn"], r["status"], r["book"]["available"]) for r in response.json()["results"]] == [
+        ("0", "updated", False), ("1", "updated", False), ("2", "updated", False)]
+    feed = client.get("/books/changes", params={"since": version}).json()
+    assert feed["version"] == version + 1 and len(feed["changes"]) == 3
+
+    rejected = client.request("DELETE", "/books", json={"isbns": ["0", "missing"]})
+    assert rejected.status_code == 404
+    assert [r["status"] for r in rejected.json()["detail"]["results"]] == ["unchanged", "not_found"]
+    assert client.get("/books/0").status_code == 200
+
+    assert client.patch("/books", json={"isbns": ["3"], "changes": {"isbn": "9"}}).status_code == 422
+    removed = client.request("DELETE", "/books", json={"isbns": ["0", "3"]})
+    assert [r["status"] for r in removed.json()["results"]] == ["removed", "removed"]
+    assert [b["isbn"] for b in client.get("/books").json()] == ["1", "2"]
+
+def test_batch_treats_notations_of_one_book_as_one(client):
+    """Test that a batch naming one book in two notations changes it once and reports it once."""
+    client.post("/books", json={"title": "Book", "author": "Author", "isbn": "0-8044-2957-X", "year": 2000})
+    response = client.patch("/books", json={"isbns": ["080442957X", "9780804429573"], "changes": {"year": 2001}})
+    assert [(r["isbn"], r["status"]) for r in response.json()["results"]] == [("080442957X", "updated")]
+    response = client.request("DELETE", "/books", json={"isbns": ["9780804429573", "0-8044-2957-X", "080442957X"]})
+    assert response.json()["results"] == [{"isbn": "9780804429573", "status": "removed"}]
+    assert client.get("/books").json() == []
+
+def test_stats(client):
+    """Test that /stats counts the collection and follows changes."""
+    for n, (author, year) in enumerate([("Le Guin", 1969), ("Le Guin", 1974), ("Banks", 1987)]):
+        client.post("/books", json={"title": f"Book {n}", "author": author, "isbn": str(n), "year": year})
+    client.put("/books/2", json={"title": "Book 2", "author": "Banks", "isbn": "2", "year": 1987, "available": False})
+    stats = client.get("/stats", params={"top_authors": 1}).json()
+    assert (stats["total"], stats["available"], stats["checked_out"]) == (3, 2, 1)
+    assert stats["top_authors"] == [{"author": "Le Guin", "count": 2}]
+    assert stats["by_decade"] == {"1960": 1, "1970": 1, "1980": 1}
+    assert sum(stats["by_month_added"].values()) == 3
+
+    client.delete("/books/0")
+    assert client.get("/stats").json()["by_year"] == {"1974": 1, "1987": 1}
+
+def test_isbn_notations(client):
+    """Test that a valid ISBN is stored as ISBN-13 and found in any notation, and that typos are refused on request."""
+    response = client.post("/books", json={"title": "Martin Eden", "author": "Jack London", "isbn": "0-14-018772-3", "year": 1909})
+    assert response.status_code == 201 and response.json()["isbn"] == "9780140187724"
+    assert client.get("/books/0140187723").json()["title"] == "Martin Eden"
+    assert client.post("/books", json={"title": "Again", "author": "Jack London", "isbn": "9780140187724", "year": 1909}).status_code == 400
+    typo = {"title": "Typo", "author": "Jack London", "isbn": "0140187724", "year": 1909}
+    assert client.post("/books", params={"check_isbn": "true"}, json=typo).status_code == 422
+    assert client.post("/books", json=typo).json()["isbn"] == "0140187724"
+
+def test_export(client):
+    """Test that the export streams every book as NDJSON or CSV, gzip-compressed on request."""
+    for n in range(3):
+        client.post("/books", json={"title": f"Book {n}", "author": "Author", "isbn": str(n), "year": 2000 + n})
+    response = client.get("/books/export", headers={"Accept-Encoding": "identity"})
+    assert response.status_code == 200 and response.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line)["isbn"] for line in response.text.splitlines()] == ["0", "1", "2"]
+    assert "content-encoding" not in response.headers
+
+    response = client.get("/books/export", params={"format": "csv"}, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.text.splitlines()[0] == "title,author,isbn,year,available,date_added" and len(response.text.splitlines()) == 4
+    assert client.get("/books/export", params={"format": "xml"}).status_code == 400
+
+def test_duplicates(client):
+    """Test the duplicate report and the opt-in duplicate check when adding a book."""
+    client.post("/books", json={"title": "Suç ve Ceza", "author": "Dostoyevski, Fyodor", "isbn": "1", "year": 1866})
+    client.post("/books", json={"title": "Suc ve Ceza", "author": "Fyodor Dostoyevski", "isbn": "2", "year": 2015})
+    client.post("/books", json={"title": "Budala", "author": "Fyodor Dostoyevski", "isbn": "3", "year": 1869})
+    response = client.get("/books/duplicates")
+    assert response.headers["x-total-count"] == "1"
+    assert [book["isbn"] for book in response.json()["clusters"][0]["books"]] == ["1", "2"]
+
+    book = {"title": "Budala", "author": "F. M. Dostoyevski", "isbn": "4", "year": 2020}
+    response = client.post("/books", params={"check_duplicates": True}, json=book)
+    assert response.status_code == 409
+    assert [match["book"]["isbn"] for match in response.json()["detail"]["candidates"]] == ["3"]
+    assert client.post("/books", json=book).status_code == 201
+    assert client.get("/books/duplicates").headers["x-total-count"] == "2"
+
+def test_metrics(client):
+    """Test that /metrics reports request latency by route template and Library operations."""
+    client.post("/books", json={"title": "Counted", "author": "Author", "isbn": "1", "year": 2000})
+    client.get("/books/1")
+    metrics = client.get("/metrics")
+    assert metrics.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'http_request_duration_seconds_count{method="GET",route="/books/{isbn}",status="200"}' in metrics.text
+    assert 'library_operation_seconds_count{operation="add"}' in metrics.text
+    # The profiler is opt-in.
+    assert client.post("/debug/profiler").status_code == 404
+
+def test_circulation(client):
+    """Test checking a book out and back in, and the loan listings."""
+    client.post("/books", json={"title": "Lent", "author": "Author", "isbn": "1", "year": 2000})
+    response = client.post("/books/1/checkout", json={"borrower": "ada", "days": 7})
+    assert response.status_code == 201
+    assert response.json()["borrower"] == "ada" and response.json()["returned"] is None
+    assert client.get("/books/1").json()["available"] is False
+    assert client.post("/books/1/checkout", json={"borrower": "bob"}).status_code == 409
+    assert client.post("/books/2/checkout", json={"borrower": "bob"}).status_code == 404
+
+    assert [l["isbn"] for l in client.get("/loans", params={"borrower": "ada"}).json()] == ["1"]
+    assert client.get("/loans/overdue").json() == []
+    assert [l["isbn"] for l in client.get("/loans/overdue", params={"as_of": "2999-01-01"}).json()] == ["1"]
+
+    assert client.post("/books/1/return").json()["returned"] is not None
+    assert client.post("/books/1/return").status_code == 409
+    assert client.get("/books/1").json()["available"] is True
+    assert client.get("/loans", params={"borrower": "ada"}).json() == []
+    assert len(client.get("/books/1/loans").json()) == 1
+
+def test_edits_keep_lent_books_unavailable(client):
+    """Test that edits cannot make a lent book available, and that a lent book cannot be removed."""
+    for isbn in ("1", "2"):
+        client.post("/books", json={"title": f"Book {isbn}", "author": "Author", "isbn": isbn, "year": 2000})
+    client.post("/books/1/checkout", json={"borrower": "ada"})
+
+    # The web UI's edit form leaves `available` out.
+    response = client.put("/books/1", json={"title": "Renamed", "author": "Author", "isbn": "1", "year": 2000})
+    assert response.status_code == 200 and response.json()["available"] is False
+    assert client.put("/books/1", json={"title": "Renamed", "author": "Author", "isbn": "1", "year": 2000,
+                                        "available": True}).status_code == 409
+    response = client.patch("/books", json={"isbns": ["1", "2"], "changes": {"available": True}})
+    assert response.status_code == 409
+    assert response.json()["detail"]["results"] == [{"isbn": "1", "status": "on_loan"}, {"isbn": "2", "status": "unchanged"}]
+    assert client.patch("/books", json={"isbns": ["1", "2"], "changes": {"year": 2001}}).status_code == 200
+
+    assert client.delete("/books/1").status_code == 409
+    assert client.request("DELETE", "/books", json={"isbns": ["2", "1"]}).status_code == 409
+    assert [b["isbn"] for b in client.get("/books").json()] == ["1", "2"]
+    assert client.get("/books/1").json()["available"] is False
+    assert client.post("/books/1/checkout", json={"borrower": "bob"}).status_code == 409
+
+    client.post("/books/1/return")
+    assert client.delete("/books/1").status_code == 204
+    assert client.get("/loans/overdue", params={"as_of": "2999-01-01"}).json() == []
+
+def test_fetch_openlibrary_info(monkeypatch, tmp_path):
+    """Test that the OpenLibrary lookup goes through the client created at startup."""
+    payload = {"numFound": 1, "docs": [{"title": "Remote Book", "author_name": ["Remote Author"], "first_publish_year": 2001}]}
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, json=payload))
+    monkeypatch.setattr(api, "OpenLibraryClient", functools.partial(OpenLibraryClient, transport=transport))
+    monkeypatch.setenv("LIBRARY_PATH", str(tmp_path / "library.json"))
+    monkeypatch.setenv("OPENLIBRARY_CACHE_PATH", str(tmp_path / "openlibrary_cache.db"))
+
+    with TestClient(app) as client:
+        response = client.get("/openlibrary/1234567890")
+        client.get("/openlibrary/1234567890")
+        stats = client.get("/openlibrary/cache/stats").json()
+    assert response.status_code == 200
+    assert response.json() == {"title": "Remote Book", "author": "Remote Author", "year": 2001, "isbn": "1234567890"}
+    assert stats["hits"] == 1 and stats["misses"] == 1
+
+def test_bulk_import(monkeypatch, tmp_path):
+    """Test that a bulk import runs in the background and reports its progress."""
+    def handler(request):
+        isbn = request.url.params["isbn"]
+        if isbn == "missing":
+            return httpx.Response(200, json={"numFound": 0, "docs": []})
+        return httpx.Response(200, json={"numFound": 1, "docs": [{"title": f"Book {isbn}", "author_name": ["A"]}]})
+    transport = httpx.MockTransport(handler)
+    monkeypatch.setattr(api, "OpenLibraryClient", functools.partial(OpenLibraryClient, transport=transport))
+    monkeypatch.setenv("LIBRARY_PATH", str(tmp_path / "library.json"))
+    monkeypatch.setenv("OPENLIBRARY_CACHE_PATH", str(tmp_path / "openlibrary_cache.db"))
+
+    with TestClient(app) as client:
+        client.post("/books", json={"title": "Existing", "author": "A", "isbn": "1", "year": 2000})
+        response = client.post("/books/bulk", json={"isbns": ["1", "2", "3", "missing"], "rate": 100})
+        assert response.status_code == 202
+        job_id = response.json()["job_id"]
+        for _ in range(100):
+            job = client.get(f"/books/bulk/{job_id}").json()
+            if job["finished"]:
+                break
+            time.sleep(0.01)
+        assert client.get("/books/bulk/unknown").status_code == 404
+        assert [b["isbn"] for b in client.get("/books").json()] == ["1", "2", "3"]
+    assert job["finished"]
+    assert job["added"] == ["2", "3"] and job["skipped"] == ["1"]
+    assert job["failed"] == [{"isbn": "missing", "error": "Not found on OpenLibrary"}]
+
+def test_bulk_imports_are_forgotten_and_cancelled(monkeypatch, tmp_path):
+    """Test that old finished imports are dropped and running ones are cancelled on shutdown."""
+    async def handler(request):
+        isbn = request.url.params["isbn"]
+        if isbn == make_isbn(1):
+            await asyncio.sleep(3600)
+        return httpx.Response(200, json={"numFound": 1, "docs": [{"title": f"Book {isbn}", "author_name": ["A"]}]})
+    transport = httpx.MockTransport(handler)
+    monkeypatch.setattr(api, "OpenLibraryClient", functools.partial(OpenLibraryClient, transport=transport))
+    monkeypatch.setattr(api, "MAX_FINISHED_IMPORTS", 1)
+    monkeypatch.setenv("LIBRARY_PATH", str(tmp_path / "library.json"))
+    monkeypatch.setenv("OPENLIBRARY_CACHE_PATH", str(tmp_path / "openlibrary_cache.db"))
+
+    def wait_for(client, job_id):
+        for _ in range(100):
+            if client.get(f"/books/bulk/{job_id}").json()["finished"]:
+                return
+            time.sleep(0.01)
+
+    with TestClient(app) as client:
+        first = client.post("/books/bulk", json={"isbns": ["1"], "rate": 100}).json()["job_id"]
+        wait_for(client, first)
+        second = client.post("/books/bulk", json={"isbns": ["2"], "rate": 100}).json()["job_id"]
+        wait_for(client, second)
+        assert client.get(f"/books/bulk/{first}").status_code == 404
+        assert client.get(f"/books/bulk/{second}").status_code == 200
+
+        monkeypatch.setattr(api, "IMPORT_JOB_TTL", 0)
+        assert client.get(f"/books/bulk/{second}").status_code == 404
+        slow = client.post("/books/bulk", json={"isbns": [make_isbn(1)], "rate": 100}).json()["job_id"]
+        task, _ = api.app_state["imports"][slow]
+    assert task.cancelled()
+    library = Library(str(tmp_path / "library.json"))
+    assert [b.isbn for b in library.books] == ["1", "2"]
+    library.close()
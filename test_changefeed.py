@@ -0,0 +1,44 @@
+import asyncio
+import json
+from changefeed import ChangeNotifier, stream_changes
+from library import Library, Book
+
+def parse(message):
+    """Returns (event, data) of one SSE message, or (None, None) for a comment."""
+    fields = dict(line.split(": ", 1) for line in message.strip().splitlines() if not line.startswith(":"))
+    return fields.get("event"), json.loads(fields["data"]) if "data" in fields else None
+
+def test_stream_pushes_changes_as_they_happen(tmp_path):
+    """Test that a mutation on another thread wakes the stream, which sends the new records."""
+    library = Library(filename=str(tmp_path / "library.json"))
+    start = library.version
+
+    async def follow():
+        notifier = ChangeNotifier(asyncio.get_running_loop())
+        library.subscribe(notifier.notify)
+        disconnected = False
+        async def is_disconnected():
+            return disconnected
+        stream = stream_changes(library, notifier, start, is_disconnected, poll_interval=5)
+        assert parse(await stream.__anext__()) == (None, None)
+        await asyncio.to_thread(library.add_book, Book("A", "Author", "1", 2000))
+        event, data = parse(await asyncio.wait_for(stream.__anext__(), 2))
+        disconnected = True
+        return event, data
+
+    event, data = asyncio.run(follow())
+    assert event == "changes"
+    assert data["version"] == start + 1
+    assert [(change["op"], change["book"]["isbn"]) for change in data["changes"]] == [("add", "1")]
+
+def test_stream_resets_clients_that_are_too_far_behind(tmp_path):
+    library = Library(filename=str(tmp_path / "library.json"))
+
+    async def first_event():
+        notifier = ChangeNotifier(asyncio.get_running_loop())
+        async def is_disconnected():
+            return False
+        stream = stream_changes(library, notifier, library.version - 1, is_disconnected)
+        return parse(await stream.__anext__())
+
+    assert asyncio.run(first_event()) == ("reset", {"version": library.version})
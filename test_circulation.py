@@ -0,0 +1,94 @@
+import pytest
+from datetime import date
+from circulation import Circulation, CirculationError, SQLiteCirculation, open_circulation
+from library import Book, Library
+from storage import SQLiteStorage
+
+
+@pytest.fixture
+def setup(tmp_path):
+    """A library of four books and its loans, on a clock the test can move."""
+    library = Library(filename=str(tmp_path / "library.json"))
+    for n in range(4):
+        library.add_book(Book(f"Book {n}", "Author", str(n), 2000))
+    clock = {"today": date(2024, 1, 1)}
+    circulation = Circulation(library, str(tmp_path / "library.json.loans"), today=lambda: clock["today"])
+    yield library, circulation, clock
+    circulation.close()
+
+def test_checkout_and_return(setup):
+    """Test that loans follow the book's availability and are kept as history."""
+    library, circulation, clock = setup
+    loan = circulation.checkout("0", "ada")
+    assert (loan.borrower, loan.checked_out, loan.due) == ("ada", "2024-01-01", "2024-01-15")
+    assert library.find_book("0").available is False
+    with pytest.raises(CirculationError):
+        circulation.checkout("0", "bob")
+    with pytest.raises(KeyError):
+        circulation.checkout("missing", "bob")
+
+    clock["today"] = date(2024, 1, 10)
+    assert circulation.check_in("0").returned == "2024-01-10"
+    assert library.find_book("0").available is True
+    assert circulation.current_loan("0") is None
+    with pytest.raises(CirculationError):
+        circulation.check_in("0")
+
+    circulation.checkout("0", "bob")
+    assert [l.borrower for l in circulation.history("0")] == ["ada", "bob"]
+
+def test_borrower_and_overdue_indexes(setup):
+    """Test the loans of a borrower and the overdue scan by due date."""
+    library, circulation, clock = setup
+    circulation.checkout("0", "ada", days=7)
+    circulation.checkout("1", "bob", days=3)
+    circulation.checkout("2", "ada", days=30)
+    assert [l.isbn for l in circulation.on_loan_to("ada")] == ["0", "2"]
+    assert circulation.on_loan_to("nobody") == []
+
+    # A loan due on a day is not overdue until the day after.
+    assert circulation.overdue(date(2024, 1, 4)) == []
+    assert [l.isbn for l in circulation.overdue(date(2024, 1, 9))] == ["1", "0"]
+    clock["today"] = date(2024, 3, 1)
+    circulation.check_in("1")
+    assert [l.isbn for l in circulation.overdue()] == ["0", "2"]
+    assert [l.isbn for l in circulation.on_loan_to("bob")] == []
+
+def test_loans_survive_a_restart(setup, tmp_path):
+    """Test that the loan journal is replayed into the same loans and indexes."""
+    library, circulation, clock = setup
+    circulation.checkout("0", "ada")
+    circulation.checkout("1", "bob")
+    circulation.check_in("0")
+    circulation.close()
+
+    reopened = Circulation(library, str(tmp_path / "library.json.loans"), today=lambda: clock["today"])
+    assert reopened.current_loan("0") is None
+    assert reopened.on_loan_to("bob")[0].isbn == "1"
+    assert [l.loan_id for l in reopened.history("0")] == [1]
+    assert reopened.checkout("2", "ada").loan_id == 3
+    reopened.close()
+
+def test_workers_sharing_sqlite_share_the_loans(tmp_path):
+    """Test that two libraries on one SQLite database, like two API workers, see and respect each other's loans."""
+    path = str(tmp_path / "library.db")
+    first, second = Library(storage=SQLiteStorage(path)), Library(storage=SQLiteStorage(path))
+    for n in range(2):
+        first.add_book(Book(f"Book {n}", "Author", str(n), 2000))
+    desks = [open_circulation(library) for library in (first, second)]
+    assert all(isinstance(desk, SQLiteCirculation) for desk in desks)
+
+    loan = desks[0].checkout("0", "ada")
+    with pytest.raises(CirculationError):
+        desks[1].checkout("0", "bob")
+    assert desks[1].current_loan("0") == loan and second.find_book("0").available is False
+    assert desks[1].checkout("1", "bob").loan_id != loan.loan_id
+
+    assert desks[1].check_in("0").returned is not None
+    assert desks[0].current_loan("0") is None and first.find_book("0").available is True
+    assert [l.borrower for l in desks[0].on_loan_to("bob")] == ["bob"]
+    assert [l.isbn for l in desks[0].overdue(date(2999, 1, 1))] == ["1"]
+    assert [l.loan_id for l in desks[0].history("0")] == [loan.loan_id]
+    for desk, library in zip(desks, (first, second)):
+        desk.close()
+        library.close()
@@ -0,0 +1,61 @@
+import io
+import json
+import pytest
+from converter import convert_library_format, convert_record, iter_export
+from storage import SQLiteStorage
+
+EXPORT = {
+    "101": {"title": "Ademden Önce", "primaryauthor": "Sait Faik", "isbn": {"0": "9789750806"}, "date": "1950", "entrydate": "2024-05-01"},
+    "102": {"title": "Martin Eden", "primaryauthor": "Jack London", "isbn": ["9780140187724"], "date": "c. 1909", "entrydate": "2024-05-02"},
+    "103": {"title": "No ISBN", "primaryauthor": "Anon", "originalisbn": "0000000001", "date": 1999, "entrydate": "2024-05-03"},
+    "104": {"title": "Also No ISBN", "primaryauthor": "Anon", "date": "2001", "entrydate": "2024-05-04"},
+}
+
+@pytest.fixture
+def export_file(tmp_path):
+    path = tmp_path / "export.json"
+    path.write_text(json.dumps(EXPORT, indent=2, ensure_ascii=False), encoding="utf-8")
+    return path
+
+def test_streaming_output_matches_whole_file_conversion(export_file, tmp_path, capsys):
+    """Test that the streamed library.json is byte-for-byte what json.dump of the full list gives."""
+    output = tmp_path / "library.json"
+    assert convert_library_format(str(export_file), str(output), chunk_size=7) == 4
+    assert "Kept 2 ISBNs with a wrong check digit" in capsys.readouterr().out
+    expected = [convert_record(record, book_id) for book_id, record in EXPORT.items()]
+    assert output.read_text(encoding="utf-8") == json.dumps(expected, indent=4, ensure_ascii=False)
+    assert [book["year"] for book in expected] == [1950, 0, 1999, 2001]
+    # Invalid ISBNs are kept as they are, as the Library keeps them; a record without one gets a placeholder of its own.
+    assert [book["isbn"] for book in expected] == ["9789750806", "9780140187724", "0000000001", "N/A-104"]
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 64, 1 << 16])
+def test_iter_export_handles_any_chunk_boundary(chunk_size):
+    """Test that records split across reads, including numbers and non-ASCII text, decode intact."""
+    text = json.dumps({"1": {"title": "Işık", "date": 12345}, "2": {"n": [1.5, None, True]}})
+    assert list(iter_export(io.StringIO(text), chunk_size)) == [("1", {"title": "Işık", "date": 12345}), ("2", {"n": [1.5, None, True]})]
+    assert list(iter_export(io.StringIO(" { } "), chunk_size)) == []
+
+@pytest.mark.parametrize("text", ['{"1": {"title": "x"}', '{"1": {"title": "x"}} []', '[1, 2]', '{"1" {}}'])
+def test_invalid_export_leaves_no_output(tmp_path, text):
+    """Test that a malformed export is reported and no output file is left behind."""
+    source = tmp_path / "export.json"
+    source.write_text(text)
+    output = tmp_path / "library.json"
+    assert convert_library_format(str(source), str(output)) is None
+    assert list(tmp_path.iterdir()) == [source]
+
+def test_ndjson_output(export_file, tmp_path):
+    output = tmp_path / "library.ndjson"
+    convert_library_format(str(export_file), str(output), output_format="ndjson")
+    lines = output.read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)["title"] for line in lines] == [record["title"] for record in EXPORT.values()]
+
+def test_sqlite_output_skips_repeated_isbns(export_file, tmp_path):
+    """Test that converting straight into SQLite keeps the first record of each ISBN."""
+    output = tmp_path / "library.db"
+    convert_library_format(str(export_file), str(output), output_format="sqlite")
+    assert convert_library_format(str(export_file), str(output), output_format="sqlite") == 0
+    storage = SQLiteStorage(str(output))
+    books = storage.load()
+    assert [book.title for book in books.values()] == ["Ademden Önce", "Martin Eden", "No ISBN", "Also No ISBN"]
+    storage.close()
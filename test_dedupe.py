@@ -0,0 +1,66 @@
+import random
+import pytest
+from benchmarks.catalog import MemoryStorage
+from book import Book
+from dedupe import MIN_SCORE, DuplicateBookError, DuplicateIndex
+from library import Library
+from storage import index_by_isbn
+
+CATALOG = [
+    Book("Suç ve Ceza", "Dostoyevski, Fyodor", "1", 1866),
+    Book("Suc ve Ceza", "Fyodor Dostoyevski", "2", 2015),
+    Book("SUÇ VE CEZA", "Fyodor Dostoevsky", "N/A", 1990),
+    Book("Crime and Punishment", "Fyodor Dostoevsky", "3", 1866),
+    Book("The Brothers Karamazov", "Fyodor Dostoevsky", "4", 1880),
+    Book("Brothers Karamazov", "Dostoevsky, F.", "5", 1990),
+    Book("Harry Potter 1", "J. K. Rowling", "6", 1997),
+    Book("Harry Potter 2", "Rowling, J.K.", "7", 1998),
+    Book("Untitled", "N/A", "N/A", 0),
+    Book("Untitled", "N/A", "N/A", 0),
+]
+
+
+def clusters_of(index):
+    return sorted(sorted(map(str, keys)) for score, keys in index.clusters())
+
+
+def test_clusters_group_editions_and_spelling_variants():
+    """Test that accent, case, word-order and transliteration variants cluster, but numbered volumes do not."""
+    index = DuplicateIndex()
+    index.rebuild(index_by_isbn(CATALOG).items())
+    assert clusters_of(index) == [["('N/A', 1)", "('N/A', 2)"], ["1", "2", "N/A"], ["4", "5"]]
+    assert all(0.75 <= score <= 1 for score, keys in index.clusters())
+
+
+def test_index_follows_changes_and_large_blocks():
+    """Test add/discard against a rebuild, and that blocks too large to compare pairwise still find neighbours."""
+    rng = random.Random(0)
+    titles = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(12)) for _ in range(200)]
+    books = [Book(f"Deneme {title}", "Atay, Oğuz", str(n), 1970) for n, title in enumerate(titles)]
+    books.append(Book(f"Deneme {titles[26]}", "Oğuz Atay", "dup", 2001))
+    incremental = DuplicateIndex()
+    for key, book in index_by_isbn(books).items():
+        incremental.add(key, book)
+    assert clusters_of(incremental) == [["26", "dup"]]
+    incremental.discard("dup", books[-1])
+    assert clusters_of(incremental) == []
+    assert [key for key, score in incremental.candidates(Book(f"DENEME {titles[26]}", "O. Atay", "x", 1))] == ["26"]
+
+
+def test_library_duplicate_check():
+    """Test that add_book refuses a probable duplicate only when asked to, and that the report updates."""
+    library = Library(storage=MemoryStorage(CATALOG[:6]))
+    assert [len(cluster["books"]) for cluster in library.duplicates()] == [3, 2]
+
+    book = Book("Karamazov Kardeşler", "Dostoyevski", "8", 2000)
+    assert library.possible_duplicates(book) == []
+    copy = Book("Crime & Punishment", "F. Dostoevsky", "9", 2000)
+    with pytest.raises(DuplicateBookError) as raised:
+        library.add_book(copy, check_duplicates=True)
+    assert [match.isbn for match, score in raised.value.candidates] == ["3"]
+    assert MIN_SCORE <= raised.value.candidates[0][1] < 1
+    assert library.find_book("9") is None
+    assert library.add_book(copy)
+    assert [len(cluster["books"]) for cluster in library.duplicates()] == [3, 2, 2]
+    library.remove_book("3")
+    assert [len(cluster["books"]) for cluster in library.duplicates()] == [3, 2]
@@ -0,0 +1,60 @@
+import csv
+import gzip
+import io
+import json
+import pytest
+from book import Book
+from export import export_chunks, export_library, format_for, gzip_chunks
+from library import Library
+from storage import JSONStorage, index_by_isbn
+
+BOOKS = [Book(f"Kitap {n}, \"ışık\"", f"Yazar {n % 3}", str(n), 1990 + n, n % 2 == 0,
+              None if n % 5 == 0 else "2024-01-01T00:00:00") for n in range(25)]
+
+
+@pytest.fixture
+def library(tmp_path):
+    path = str(tmp_path / "library.json")
+    JSONStorage(path).save(index_by_isbn(BOOKS))
+    library = Library(path)
+    yield library
+    library.close()
+
+def test_formats_hold_every_book(library):
+    """Test that NDJSON, CSV and JSON exports read back as the catalog, however it is chunked."""
+    expected = [book.to_dict() for book in BOOKS]
+    for chunk_size in (1, 7, 1000):
+        ndjson = b"".join(export_chunks(library, "ndjson", chunk_size))
+        assert [json.loads(line) for line in ndjson.splitlines()] == expected
+        assert json.loads(b"".join(export_chunks(library, "json", chunk_size))) == expected
+        rows = list(csv.DictReader(io.StringIO(b"".join(export_chunks(library, "csv", chunk_size)).decode("utf-8"))))
+        assert [row["title"] for row in rows] == [book.title for book in BOOKS]
+        assert rows[1]["available"] == "False" and rows[0]["date_added"] == ""
+    with pytest.raises(ValueError):
+        export_chunks(library, "xml")
+
+def test_empty_library(tmp_path):
+    """Test that an empty catalog exports as valid, empty documents."""
+    library = Library(str(tmp_path / "library.json"))
+    assert b"".join(export_chunks(library, "json")) == b"[]"
+    assert b"".join(export_chunks(library, "ndjson")) == b""
+    assert b"".join(export_chunks(library, "csv")).decode("utf-8").splitlines() == ["title,author,isbn,year,available,date_added"]
+
+def test_export_is_not_blocked_by_changes(library):
+    """Test that the library can change between chunks, and that the export skips what was removed."""
+    chunks = export_chunks(library, "ndjson", chunk_size=10)
+    first = next(chunks)
+    library.remove_book("20")
+    library.update_book("15", title="Changed")
+    library.add_book(Book("Added later", "Yazar", "100", 2020))
+    titles = [json.loads(line)["title"] for line in (first + b"".join(chunks)).splitlines()]
+    assert len(titles) == 24 and "Changed" in titles and "Added later" not in titles
+
+def test_export_file(library, tmp_path):
+    """Test that the CLI export picks the format from the file name and gzips .gz files."""
+    assert format_for("backup.CSV.gz") == ("csv", True) and format_for("backup") == ("ndjson", False)
+    path = str(tmp_path / "backup.json.gz")
+    assert export_library(library, path) > 0
+    with gzip.open(path) as f:
+        assert len(json.load(f)) == 25
+    assert gzip.decompress(b"".join(gzip_chunks(iter([b"a" * 100, b"", b"b"])))) == b"a" * 100 + b"b"
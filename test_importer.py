@@ -0,0 +1,56 @@
+import asyncio
+import httpx
+from importer import import_isbns, read_isbns
+from library import Library, Book
+from openlibrary import OpenLibraryClient
+
+def found(title):
+    return {"numFound": 1, "docs": [{"title": title, "author_name": ["Some Author"], "first_publish_year": 2000}]}
+
+def handler(request):
+    isbn = request.url.params["isbn"]
+    if isbn == "missing":
+        return httpx.Response(200, json={"numFound": 0, "docs": []})
+    if isbn == "broken":
+        return httpx.Response(404)
+    return httpx.Response(200, json=found(f"Book {isbn}"))
+
+def run_import(library, isbns, **options):
+    async def go():
+        async with OpenLibraryClient(transport=httpx.MockTransport(handler), backoff=0) as client:
+            return await import_isbns(library, client, isbns, rate=None, **options)
+    return asyncio.run(go())
+
+def test_import_adds_found_books_in_input_order(tmp_path):
+    """Test that found books are added in input order and repeats are looked up once."""
+    library = Library(str(tmp_path / "library.json"))
+    report = run_import(library, ["3", "1", "3", "2"])
+    assert report.added == ["3", "1", "2"]
+    assert report.total == 3 and report.done == 3 and report.finished
+    assert [book.isbn for book in library.books] == ["3", "1", "2"]
+    assert Library(str(tmp_path / "library.json")).find_book("1").title == "Book 1"
+
+def test_import_reports_skips_and_failures(tmp_path):
+    """Test that existing ISBNs are skipped and misses and errors are reported per ISBN."""
+    library = Library(str(tmp_path / "library.json"))
+    library.add_book(Book("Existing", "Author", "1", 1999))
+    progress = []
+    report = run_import(library, ["1", "missing", "broken", "2"], progress=lambda r: progress.append(r.done))
+    assert report.added == ["2"]
+    assert report.skipped == ["1"]
+    assert sorted(failure["isbn"] for failure in report.failed) == ["broken", "missing"]
+    assert progress[-1] == 4
+    assert library.find_book("1").title == "Existing"
+
+def test_import_writes_once(tmp_path, monkeypatch):
+    """Test that a bulk import persists all of its books in one write."""
+    library = Library(str(tmp_path / "library.json"))
+    writes = []
+    monkeypatch.setattr(library.storage, "save", lambda books: writes.append(len(books)))
+    run_import(library, [str(n) for n in range(20)], concurrency=4)
+    assert writes == [20]
+
+def test_read_isbns_skips_blank_and_comment_lines(tmp_path):
+    path = tmp_path / "isbns.txt"
+    path.write_text("# wishlist\n111\n\n  222  \n")
+    assert read_isbns(path) == ["111", "222"]
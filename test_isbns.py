@@ -0,0 +1,34 @@
+import pytest
+from isbns import (InvalidISBNError, canonical_isbn, has_wrong_check_digit, is_placeholder, isbn10, make_isbn,
+                   normalize_isbn, placeholder_isbn)
+
+
+def test_any_notation_has_one_canonical_form():
+    """Test that ISBN-10 and ISBN-13, with or without separators, give the same ISBN-13."""
+    for text in ("9754709076", "975-470-907-6", " 978-975-470-907-0 ", "978 9754709070"):
+        assert canonical_isbn(text) == "9789754709070"
+    assert canonical_isbn("0-8044-2957-x") == "9780804429573"
+    assert isbn10("9780804429573") == "080442957X"
+    assert isbn10("9791032305690") is None
+
+
+def test_invalid_isbns():
+    """Test that wrong check digits are flagged and kept, or refused when strict, and that other identifiers are kept."""
+    assert canonical_isbn("9754709077") is None and canonical_isbn("9789754709075") is None
+    for text in ("9754709077", "978-975-470-907-5"):
+        assert has_wrong_check_digit(text) and normalize_isbn(f" {text} ") == text
+        with pytest.raises(InvalidISBNError):
+            normalize_isbn(text, strict=True)
+    for text in (" 12345 ", "N/A", "9754709076"):
+        assert not has_wrong_check_digit(text)
+    assert normalize_isbn(" 12345 ", strict=True) == "12345"
+    assert normalize_isbn("N/A") == "N/A"
+    assert [make_isbn(n) for n in (0, 42)] == [canonical_isbn(make_isbn(n)) for n in (0, 42)]
+    assert make_isbn(975470907) == "9789754709070"
+
+
+def test_placeholders():
+    """Test that records without an ISBN get distinct placeholders that are recognized as such."""
+    assert placeholder_isbn(104) == "N/A-104" != placeholder_isbn(105)
+    assert all(is_placeholder(text) for text in ("N/A", "n/a", "N/A-104", " ", "unknown"))
+    assert not is_placeholder("9789754709070") and not is_placeholder("12345")
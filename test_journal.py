@@ -0,0 +1,77 @@
+import json
+import time
+from journal import Journal
+from library import Book, Library
+
+
+def test_mutations_are_replayed_without_rewriting_the_file(tmp_path):
+    """Test that journaled mutations survive a restart before any compaction."""
+    path = str(tmp_path / "library.json")
+    library = Library(filename=path, journal=True)
+    library.add_book(Book("Kept", "Author", "111", 2020))
+    library.add_book(Book("Removed", "Author", "222", 2021))
+    library.update_book("111", title="Kept and Updated")
+    library.remove_book("222")
+    library.close()
+
+    assert not (tmp_path / "library.json").exists()
+
+    reopened = Library(filename=path, journal=True)
+    assert [b.title for b in reopened.books] == ["Kept and Updated"]
+    assert reopened.find_book("111").date_added is not None
+    reopened.close()
+
+def test_save_compacts_journal_into_snapshot(tmp_path):
+    """Test that saving writes a full snapshot and empties the journal."""
+    path = str(tmp_path / "library.json")
+    library = Library(filename=path, journal=True)
+    library.add_book(Book("Snap", "Shot", "333", 2022))
+    library.save_books()
+
+    assert json.loads((tmp_path / "library.json").read_text(encoding="utf-8"))[0]["isbn"] == "333"
+    assert library.storage.journal.size == 0
+    assert not (tmp_path / "library.json.journal.1").exists()
+    library.close()
+
+def test_compaction_triggers_past_size_threshold(tmp_path):
+    """Test that a journal past its threshold is folded into the snapshot."""
+    path = str(tmp_path / "library.json")
+    library = Library(filename=path, journal=True)
+    library.storage.journal.compact_bytes = 1
+    library.add_book(Book("Big", "Journal", "444", 2023))
+    library.close()  # waits for the background compaction
+
+    assert json.loads((tmp_path / "library.json").read_text(encoding="utf-8"))[0]["isbn"] == "444"
+    assert Library(filename=path, journal=True).find_book("444") is not None
+
+def test_torn_last_record_is_ignored(tmp_path):
+    """Test that a partially written final record does not break replay."""
+    journal = Journal(str(tmp_path / "library.json.journal"))
+    journal.append({"op": "remove", "isbn": "555"})
+    journal.close()
+    with open(journal.path, 'a', encoding='utf-8') as f:
+        f.write('{"op": "add", "bo')
+
+    assert list(Journal(journal.path).records()) == [{"op": "remove", "isbn": "555"}]
+
+def test_records_appended_after_a_torn_line_are_replayed(tmp_path):
+    """Test that reopening a journal cuts off a torn line, so records appended after a crash are not lost."""
+    journal = Journal(str(tmp_path / "library.json.journal"))
+    journal.append({"op": "remove", "isbn": "555"})
+    journal.close()
+    with open(journal.path, 'a', encoding='utf-8') as f:
+        f.write('{"op": "add", "bo')
+
+    journal = Journal(journal.path)
+    journal.append({"op": "remove", "isbn": "666"})
+    journal.close()
+    assert list(Journal(journal.path).records()) == [{"op": "remove", "isbn": "555"}, {"op": "remove", "isbn": "666"}]
+
+def test_idle_journal_is_synced(tmp_path):
+    """Test that a record appended just after a sync is synced once the writes stop."""
+    journal = Journal(str(tmp_path / "library.json.journal"), sync_interval=0.05)
+    journal.append({"op": "remove", "isbn": "555"})
+    assert journal._pending == 1
+    time.sleep(0.3)
+    assert journal._pending == 0
+    journal.close()
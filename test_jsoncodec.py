@@ -0,0 +1,66 @@
+import json
+import pytest
+from book import Book
+from circulation import Loan
+from jsoncodec import CODECS, get_codec
+from library import Library
+from storage import JSONStorage, index_by_isbn
+
+BOOKS = [Book("Kürk Mantolu Madonna", "Sabahattin Ali", "9789753638029", 1943, True, "2024-01-01T00:00:00"),
+         Book("Untitled", "Anonymous", "1", 0, False, None)]
+
+
+@pytest.mark.parametrize("name", CODECS)
+def test_codecs_encode_records_directly(name):
+    """Test that every codec encodes books and loans like their dicts, and decodes its own output."""
+    codec = CODECS[name]
+    content = {"books": BOOKS, "loan": Loan(1, "1", "Ayşe", "2024-01-01", "2024-01-15"), "counts": {1943: 1}}
+    expected = {"books": [book.to_dict() for book in BOOKS],
+                "loan": {"loan_id": 1, "isbn": "1", "borrower": "Ayşe", "checked_out": "2024-01-01",
+                         "due": "2024-01-15", "returned": None},
+                "counts": {"1943": 1}}
+    for indent in (False, True):
+        data = codec.dumps(content, indent=indent)
+        assert isinstance(data, bytes) and "Kürk".encode("utf-8") in data
+        assert codec.loads(data) == expected
+    assert b"\n" not in codec.dumps(content)
+    with pytest.raises(json.JSONDecodeError):
+        codec.loads(b"[{")
+
+
+def test_stdlib_codec_matches_json_module():
+    """Test that the stdlib codec writes what json.dump wrote before, indented and compact."""
+    dicts = [book.to_dict() for book in BOOKS]
+    codec = get_codec("json")
+    assert codec.dumps(BOOKS, indent=True) == json.dumps(dicts, indent=4, ensure_ascii=False).encode("utf-8")
+    assert codec.dumps(BOOKS) == json.dumps(dicts, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+@pytest.mark.parametrize("name", CODECS)
+def test_indented_output_is_the_same_with_every_codec(name):
+    """Test that every codec indents exactly like the json module, so the library file does not depend on the codec."""
+    content = [{"books": BOOKS, "nested": {"empty": [], "none": {}, "text": "a  b\n\tc", "deep": [[1, {"x": [2]}]]}}]
+    for obj in (BOOKS, content, [], {}):
+        assert CODECS[name].dumps(obj, indent=True) == get_codec("json").dumps(obj, indent=True)
+
+def test_codec_selection(monkeypatch):
+    """Test that LIBRARY_JSON_CODEC picks the codec and that unknown names are rejected."""
+    monkeypatch.delenv("LIBRARY_JSON_CODEC", raising=False)
+    assert get_codec() is next(iter(CODECS.values()))
+    monkeypatch.setenv("LIBRARY_JSON_CODEC", "json")
+    assert get_codec().name == "json"
+    with pytest.raises(ValueError):
+        get_codec("yaml")
+
+
+@pytest.mark.parametrize("name", CODECS)
+def test_compact_library_file(tmp_path, name):
+    """Test that a compact library file is smaller and reads back the same, with any codec."""
+    indented, compact = str(tmp_path / "indented.json"), str(tmp_path / "compact.json")
+    for path, is_compact in ((indented, False), (compact, True)):
+        JSONStorage(path, compact=is_compact, codec=name).save(index_by_isbn(BOOKS))
+    with open(compact, 'rb') as f:
+        assert b"\n" not in f.read()
+    assert len(open(compact, 'rb').read()) < len(open(indented, 'rb').read())
+    for path in (indented, compact):
+        assert Library(storage=JSONStorage(path, codec="json")).books == BOOKS
@@ -1,6 +1,10 @@
 import pytest
 import os
+import sqlite3
+import threading
+from isbns import InvalidISBNError, isbn10, make_isbn
 from library import Book, Library
+from storage import SQLiteStorage
 
 @pytest.fixture
 def library_fixture():
@@ -41,3 +45,275 @@ def test_update_book(library_fixture):
     updated_book = library_fixture.find_book("44556")
     assert updated_book.title == "Updated Title"
 
+
+def test_duplicate_isbns_in_file_are_preserved(tmp_path):
+    """Test that records sharing an ISBN in the data file survive a load/save cycle."""
+    path = tmp_path / "dupes.json"
+    path.write_text(
+        '[{"title": "A", "author": "X", "isbn": "N/A", "year": 2000},'
+        ' {"title": "B", "author": "Y", "isbn": "N/A", "year": 2001}]',
+        encoding="utf-8",
+    )
+    library = Library(filename=str(path))
+    assert len(library.books) == 2
+    assert library.find_book("N/A").title == "A"
+
+    library.save_books()
+    assert [b.title for b in Library(filename=str(path)).books] == ["A", "B"]
+
+    library.remove_book("N/A")
+    assert library.books == []
+
+def test_query_sorts_filters_and_pages(library_fixture):
+    """Test server-side sorting, filtering and paging of the collection."""
+    library_fixture.add_book(Book("Beta", "Woolf, Virginia", "1", 1927))
+    library_fixture.add_book(Book("alpha", "London, Jack", "2", 1903))
+    library_fixture.add_book(Book("Gamma", "Woolf, Virginia", "3", 1931))
+
+    books, total = library_fixture.query(sort="title_asc", limit=2)
+    assert [b.title for b in books] == ["alpha", "Beta"]
+    assert total == 3
+
+    books, total = library_fixture.query(author="woolf", sort="year_desc", offset=1)
+    assert [b.isbn for b in books] == ["1"]
+    assert total == 2
+
+    books, total = library_fixture.query(year_from=1920, year_to=1930)
+    assert [b.isbn for b in books] == ["1"]
+    assert total == 1
+
+def test_query_orderings_follow_mutations(library_fixture):
+    """Test that the maintained orderings stay in sync with updates and removals."""
+    library_fixture.add_book(Book("B", "Author", "1", 2000))
+    library_fixture.add_book(Book("C", "Author", "2", 2000))
+    assert [b.isbn for b in library_fixture.query(sort="title_asc")[0]] == ["1", "2"]
+
+    library_fixture.update_book("2", title="A")
+    library_fixture.add_book(Book("D", "Author", "3", 2000))
+    library_fixture.remove_book("1")
+    assert [b.isbn for b in library_fixture.query(sort="title_asc")[0]] == ["2", "3"]
+    assert [b.isbn for b in library_fixture.query(sort="title_desc")[0]] == ["3", "2"]
+
+def test_concurrent_readers_and_writers(tmp_path):
+    """Test that threads adding, updating, removing and querying at once leave a consistent library."""
+    library = Library(filename=str(tmp_path / "library.json"))
+    errors = []
+
+    def writer(start):
+        try:
+            for n in range(start, start + 25):
+                library.add_book(Book(f"Title {n}", "Author", str(n), 2000))
+                library.update_book(str(n), title=f"Updated {n}")
+                if n % 5 == 0:
+                    library.remove_book(str(n))
+        except Exception as e:
+            errors.append(e)
+
+    def reader():
+        try:
+            for _ in range(50):
+                books, total = library.query(sort="title_asc")
+                assert len(books) == total
+                assert all(book.title.startswith(("Title", "Updated")) for book in books)
+                library.search("updated")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(start,)) for start in (0, 100, 200)]
+    threads += [threading.Thread(target=reader) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    expected = {str(n) for start in (0, 100, 200) for n in range(start, start + 25) if n % 5}
+    assert {book.isbn for book in library.books} == expected
+    assert {book.isbn for book in Library(filename=str(tmp_path / "library.json")).books} == expected
+    assert os.listdir(tmp_path) == ["library.json"]
+
+def test_changes_since(tmp_path, monkeypatch):
+    """Test that the change log reports mutations after a version and asks for a reload when it cannot."""
+    library = Library(filename=str(tmp_path / "library.json"))
+    notified = []
+    library.subscribe(notified.append)
+    start = library.version
+    library.add_book(Book("A", "Author", "1", 2000))
+    library.update_book("1", title="B")
+    library.remove_book("1")
+    library.remove_book("missing")
+
+    version, changes = library.changes_since(start)
+    assert [change["op"] for change in changes] == ["add", "update", "remove"]
+    assert changes[1] == {"op": "update", "isbn": "1", "changes": {"title": "B"}, "version": start + 2}
+    assert notified == [start + 1, start + 2, start + 3] and version == start + 3
+    assert library.changes_since(version) == (version, [])
+    assert library.changes_since(start - 1) == (version, None)
+
+    # Once the oldest changes fall out of the log, older versions must reload.
+    monkeypatch.setattr("library.CHANGE_LOG_SIZE", 2)
+    library.add_book(Book("C", "Author", "2", 2000))
+    assert library.changes_since(start)[1] is None
+    assert [change["op"] for change in library.changes_since(version)[1]] == ["add"]
+
+def test_batch_persists_once(tmp_path, monkeypatch):
+    """Test that a batch writes its mutations to storage in one go and notifies once."""
+    library = Library(filename=str(tmp_path / "library.json"))
+    for n in range(5):
+        library.add_book(Book(f"Book {n}", "Author", str(n), 2000))
+    writes = []
+    monkeypatch.setattr(library.storage, "persist", lambda records, books: writes.append(list(records)))
+    notified = []
+    library.subscribe(notified.append)
+
+    with library.batch():
+        for n in range(4):
+            library.update_book(str(n), available=False)
+        with library.batch():
+            library.remove_book("4")
+        assert library.find_book("0").available is False
+
+    assert [[record["op"] for record in records] for records in writes] == [["update"] * 4 + ["remove"]]
+    assert len(notified) == 1
+    assert [book.available for book in library.books] == [False] * 4
+
+def test_failed_batch_changes_nothing(tmp_path):
+    """Test that an exception inside a batch undoes its changes and writes nothing."""
+    library = Library(filename=str(tmp_path / "library.json"))
+    library.add_book(Book("Kept", "Author", "1", 2000))
+    library.add_book(Book("Also Kept", "Author", "2", 2000))
+    version = library.version
+
+    with pytest.raises(RuntimeError):
+        with library.batch():
+            library.update_book("1", title="Changed")
+            library.remove_book("2")
+            library.add_book(Book("New", "Author", "3", 2000))
+            raise RuntimeError("abort")
+
+    assert sorted(book.title for book in library.books) == ["Also Kept", "Kept"]
+    assert [b.isbn for b in library.query(sort="title_asc")[0]] == ["2", "1"]
+    assert library.version == version
+    assert sorted(b.title for b in Library(filename=str(tmp_path / "library.json")).books) == ["Also Kept", "Kept"]
+
+def test_isbn_notations_resolve_to_one_book(tmp_path):
+    """Test that any notation of a valid ISBN finds, updates and removes the same book."""
+    path = tmp_path / "library.json"
+    path.write_text('[{"title": "Legacy", "author": "X", "isbn": "9754709076", "year": 2000}]', encoding="utf-8")
+    library = Library(str(path), journal=True)
+    assert library.find_book("978-975-470-907-0").title == "Legacy"
+    assert library.add_book(Book("Copy", "X", "975-470-907-6", 2000)) is False
+
+    book = Book("New", "Y", "0-8044-2957-X", 2001)
+    assert library.add_book(book) and book.isbn == "9780804429573"
+    assert library.find_book("080442957x") is book
+    with pytest.raises(InvalidISBNError):
+        library.add_book(Book("Typo", "Z", "0-8044-2957-1", 2001), check_isbn=True)
+    # Without the check, a wrong check digit is kept as entered, as the converter keeps it.
+    assert library.add_book(Book("Typo", "Z", "0-8044-2957-1", 2001))
+    assert library.find_book("0-8044-2957-1").title == "Typo"
+    library.remove_book("0-8044-2957-1")
+
+    library.update_book("9789754709070", title="Legacy, revised")
+    library.remove_book("080442957X")
+    # The journal names each book by the ISBN it is stored under, so it replays.
+    library.storage.journal.close()
+    reopened = Library(str(path), journal=True)
+    assert [(b.isbn, b.title) for b in reopened.books] == [("9754709076", "Legacy, revised")]
+    reopened.close()
+
+def test_stats_follow_mutations(library_fixture):
+    """Test that the incrementally kept statistics match a recount after every kind of change."""
+    for n in range(6):
+        library_fixture.add_book(Book(f"Book {n}", f"Author {n % 3}", str(n), 1990 + n * 3))
+    stats = library_fixture.stats(top_authors=2)
+    assert stats["top_authors"] == [{"author": "Author 0", "count": 2}, {"author": "Author 1", "count": 2}]
+
+    library_fixture.update_book("0", author="Author 2", available=False)
+    library_fixture.remove_book("1")
+    with pytest.raises(RuntimeError):
+        with library_fixture.batch():
+            library_fixture.remove_book("2")
+            raise RuntimeError("abandoned")
+
+    stats = library_fixture.stats(top_authors=3)
+    assert stats["top_authors"] == [{"author": "Author 2", "count": 3}, {"author": "Author 0", "count": 1},
+                                    {"author": "Author 1", "count": 1}]
+    assert (stats["total"], stats["available"], stats["checked_out"]) == (5, 4, 1)
+    assert stats["by_year"] == {1990: 1, 1996: 1, 1999: 1, 2002: 1, 2005: 1}
+    assert stats["by_decade"] == {1990: 3, 2000: 2}
+
+def test_catching_up_with_another_process_takes_the_write_lock(tmp_path):
+    """Test that reads which notice another process's change refresh under the write lock, never beside other readers."""
+    path = str(tmp_path / "library.db")
+    writer, reader = Library(storage=SQLiteStorage(path)), Library(storage=SQLiteStorage(path))
+    refreshes = []
+    refresh = reader._refresh
+    def checked_refresh():
+        refreshes.append((reader._lock._writing, reader._lock._readers))
+        refresh()
+    reader._refresh = checked_refresh
+
+    reads = [lambda: reader.version, lambda: reader.changes_since(0), lambda: reader.query(sort="title_asc"),
+             lambda: reader.search("book"), lambda: reader.stats(), lambda: reader.duplicates(),
+             lambda: reader.find_book("0-8044-2957-X")]
+    for n, read in enumerate(reads):
+        writer.add_book(Book(f"Book {n}", "Author", str(n), 2000))
+        read()
+    assert len(refreshes) == len(reads) and all(state == (True, 0) for state in refreshes)
+
+    # Readers racing a writer never see the change log mutated under them.
+    errors = []
+    def read_changes():
+        try:
+            for _ in range(200):
+                reader.changes_since(reader.version - 1)
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=read_changes) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for n in range(50):
+        writer.update_book("0", title=f"Book 0, edition {n}")
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    writer.close()
+    reader.close()
+
+def test_sqlite_resolves_other_notations_without_an_index(tmp_path):
+    """Test that a shared SQLite library finds other notations by query, so another process's writes cost no rebuild."""
+    path = str(tmp_path / "library.db")
+    # A database from before the canonical_isbn column, with a book under a hyphenated ISBN-10.
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE books (isbn TEXT PRIMARY KEY, title TEXT NOT NULL, author TEXT NOT NULL, "
+               "year INTEGER NOT NULL, available INTEGER NOT NULL DEFAULT 1, date_added TEXT)")
+    db.execute("INSERT INTO books VALUES ('975-470-907-6', 'Old', 'Author', 2000, 1, NULL)")
+    db.commit()
+    db.close()
+
+    first, second = Library(storage=SQLiteStorage(path)), Library(storage=SQLiteStorage(path))
+    assert first.find_book("9789754709070").title == "Old"
+    assert second.add_book(Book("Old again", "Author", "9754709076", 2000)) is False
+    for n in range(3):
+        assert first.add_book(Book(f"Book {n}", "Author", make_isbn(n), 2000))
+        assert second.add_book(Book(f"Book {n} again", "Author", isbn10(make_isbn(n)), 2000)) is False
+    assert second.find_book(isbn10(make_isbn(2))).title == "Book 2"
+    assert "isbn" not in first._indexes and "isbn" not in second._indexes
+    first.close()
+    second.close()
+
+def test_add_books_adds_like_add_book_in_one_write(tmp_path):
+    """Test that add_books skips what add_book skips, across notations, and writes to storage once."""
+    library = Library(str(tmp_path / "library.json"))
+    library.add_book(Book("Existing", "Author", "0-8044-2957-X", 2000))
+    writes = []
+    persist = library.storage.persist
+    library.storage.persist = lambda records, books: writes.append(len(records)) or persist(records, books)
+
+    added = library.add_books([Book("Again", "Author", "9780804429573", 2000), Book("New", "Author", make_isbn(1), 2001),
+                               Book("New again", "Author", isbn10(make_isbn(1)), 2001)])
+    assert [book.title for book in added] == ["New"]
+    assert added[0].date_added is not None
+    assert writes == [1]
+    assert [book.title for book in library.books] == ["Existing", "New"]
@@ -0,0 +1,40 @@
+import threading
+import time
+from locks import RWLock
+
+def test_readers_share_the_lock():
+    """Test that several readers can hold the lock at the same time."""
+    lock = RWLock()
+    inside = threading.Barrier(3, timeout=2)
+    def reader():
+        with lock.read():
+            inside.wait()
+    threads = [threading.Thread(target=reader) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not inside.broken
+
+def test_writer_excludes_readers_and_goes_first():
+    """Test that a waiting writer blocks newly arriving readers and runs before them."""
+    lock = RWLock()
+    events = []
+    def writer():
+        with lock.write():
+            events.append("write")
+    def reader():
+        with lock.read():
+            events.append("read")
+
+    with lock.read():
+        writing = threading.Thread(target=writer)
+        writing.start()
+        time.sleep(0.05)
+        reading = threading.Thread(target=reader)
+        reading.start()
+        time.sleep(0.05)
+        assert events == []
+    writing.join(timeout=2)
+    reading.join(timeout=2)
+    assert events == ["write", "read"]
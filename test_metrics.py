@@ -0,0 +1,36 @@
+import pytest
+from metrics import Registry
+
+
+def test_render_counters_and_histograms():
+    """Test the text exposition of a counter and a cumulative histogram."""
+    registry = Registry()
+    errors = registry.counter("errors_total", "Errors.", ["kind"])
+    latency = registry.histogram("latency_seconds", "Latency.", ["route"], buckets=(0.1, 1.0))
+    errors.inc(kind='say "hi"')
+    errors.inc(2, kind='say "hi"')
+    latency.observe(0.05, route="/books")
+    latency.observe(0.1, route="/books")
+    latency.observe(3.0, route="/books")
+
+    assert registry.render().splitlines() == [
+        "# HELP errors_total Errors.",
+        "# TYPE errors_total counter",
+        'errors_total{kind="say \\"hi\\""} 3',
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{route="/books",le="0.1"} 2',
+        'latency_seconds_bucket{route="/books",le="1.0"} 2',
+        'latency_seconds_bucket{route="/books",le="+Inf"} 3',
+        'latency_seconds_sum{route="/books"} 3.15',
+        'latency_seconds_count{route="/books"} 3',
+    ]
+
+def test_timer_observes_failures_too():
+    """Test that a timed block is recorded even when it raises."""
+    latency = Registry().histogram("latency_seconds", "Latency.", ["operation"])
+    with latency.time(operation="find"):
+        pass
+    with pytest.raises(KeyError), latency.time(operation="find"):
+        raise KeyError("missing")
+    assert latency.count(operation="find") == 2
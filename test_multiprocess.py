@@ -0,0 +1,60 @@
+"""
+A multi-process load test of one SQLite library shared by several workers,
+the way `uvicorn --workers N` shares it.
+"""
+import multiprocessing
+from library import Library, Book
+from storage import SQLiteStorage
+
+WORKERS = 4
+BOOKS_PER_WORKER = 30
+
+def worker(path, number, barrier, results):
+    """Adds books of its own and races the other workers for shared ISBNs, then reports what it sees."""
+    library = Library(storage=SQLiteStorage(path))
+    # Build the indexes before the others write, so they can only be right if they are refreshed.
+    library.query(sort="title_asc")
+    library.search("book")
+    barrier.wait()
+    wins = 0
+    for n in range(BOOKS_PER_WORKER):
+        library.add_book(Book(f"Book {number}-{n}", f"Worker {number}", f"{number}-{n}", 2000 + n))
+        wins += library.add_book(Book(f"Shared {n}", f"Worker {number}", f"shared-{n}", 1990))
+        if n % 3 == 0:
+            library.update_book(f"{number}-{n}", title=f"Book {number}-{n} (revised)")
+        if n % 5 == 0:
+            library.remove_book(f"{number}-{n}")
+        # Every worker must read its own writes straight away.
+        assert library.find_book(f"shared-{n}") is not None
+    barrier.wait()
+    books, total = library.query(sort="title_asc")
+    results.put((number, wins, [book.isbn for book in books], total, len(library.search("revised", limit=1000))))
+    library.close()
+
+def test_workers_sharing_sqlite_stay_consistent(tmp_path):
+    path = str(tmp_path / "library.db")
+    SQLiteStorage(path).close()
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(WORKERS)
+    results = context.Queue()
+    processes = [context.Process(target=worker, args=(path, number, barrier, results)) for number in range(WORKERS)]
+    for process in processes:
+        process.start()
+    reports = [results.get(timeout=60) for _ in processes]
+    for process in processes:
+        process.join(timeout=60)
+        assert process.exitcode == 0
+
+    library = Library(storage=SQLiteStorage(path))
+    expected, total = library.query(sort="title_asc")
+    expected = [book.isbn for book in expected]
+    # Every shared ISBN was added by exactly one worker, and no worker's books were lost.
+    assert sum(wins for _, wins, _, _, _ in reports) == BOOKS_PER_WORKER
+    own = [f"{number}-{n}" for number in range(WORKERS) for n in range(BOOKS_PER_WORKER) if n % 5]
+    assert sorted(expected) == sorted(own + [f"shared-{n}" for n in range(BOOKS_PER_WORKER)])
+    revised = sum(1 for number in range(WORKERS) for n in range(BOOKS_PER_WORKER) if n % 3 == 0 and n % 5)
+    # Each worker's cached indexes were refreshed to the same final state.
+    for number, wins, isbns, seen_total, revised_seen in reports:
+        assert isbns == expected and seen_total == total
+        assert revised_seen == revised
+    library.close()
@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import threading
+import httpx
+import pytest
+from openlibrary import MISS, LookupCache, OpenLibraryClient
+
+FOUND = {"numFound": 1, "docs": [{"title": "Martin Eden", "author_name": ["Jack London"], "first_publish_year": 1909}]}
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+def lookup(handler, isbn="9780140187724", **client_options):
+    """Looks up one ISBN through a client wired to a local mock transport."""
+    async def fetch():
+        async with OpenLibraryClient(transport=httpx.MockTransport(handler), backoff=0, **client_options) as client:
+            return await client.get_book_details(isbn)
+    return run(fetch())
+
+def test_lookup_sends_isbn_to_search_api():
+    """Test that the ISBN is passed to search.json and the first result is parsed."""
+    requests = []
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json=FOUND)
+
+    assert lookup(handler) == {"title": "Martin Eden", "author": "Jack London", "year": 1909, "isbn": "9780140187724"}
+    assert requests[0].url.path == "/search.json"
+    assert requests[0].url.params["isbn"] == "9780140187724"
+
+def test_transient_failures_are_retried():
+    """Test that 503s and connection errors are retried until a response arrives."""
+    outcomes = [httpx.Response(503), httpx.ConnectError("reset"), httpx.Response(200, json=FOUND)]
+    def handler(request):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    assert lookup(handler)["title"] == "Martin Eden"
+    assert outcomes == []
+
+def test_gives_up_after_retries():
+    """Test that a persistently failing server yields None after the allowed retries."""
+    calls = []
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(503)
+
+    assert lookup(handler, retries=2) is None
+    assert len(calls) == 3
+
+def test_client_errors_are_not_retried():
+    """Test that a 404 is reported straight away rather than retried."""
+    calls = []
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(404)
+
+    assert lookup(handler) is None
+    assert len(calls) == 1
+
+def test_connections_are_reused_across_lookups():
+    """Test that one client instance serves many lookups concurrently."""
+    def handler(request):
+        return httpx.Response(200, json=FOUND)
+
+    async def fetch_many():
+        async with OpenLibraryClient(transport=httpx.MockTransport(handler)) as client:
+            return await asyncio.gather(*(client.get_book_details(str(i)) for i in range(10)))
+
+    assert [book["isbn"] for book in run(fetch_many())] == [str(i) for i in range(10)]
+
+class FakeClock:
+    """A settable clock for exercising cache expiry."""
+    def __init__(self):
+        self.now = 1000.0
+    def __call__(self):
+        return self.now
+
+def counting_handler(payload):
+    calls = []
+    def handler(request):
+        calls.append(request.url.params["isbn"])
+        return httpx.Response(200, json=payload)
+    return handler, calls
+
+def cached_lookups(handler, cache, isbns):
+    async def fetch():
+        async with OpenLibraryClient(transport=httpx.MockTransport(handler), backoff=0, cache=cache) as client:
+            return [await client.get_book_details(isbn) for isbn in isbns]
+    return run(fetch())
+
+def test_repeat_lookups_are_served_from_cache(tmp_path):
+    """Test that a repeated lookup does not reach OpenLibrary again."""
+    handler, calls = counting_handler(FOUND)
+    cache = LookupCache(str(tmp_path / "cache.db"))
+    results = cached_lookups(handler, cache, ["1", "1", "1"])
+
+    assert calls == ["1"]
+    assert results[0] == results[2]
+    assert cache.stats["hits"] == 2 and cache.stats["misses"] == 1
+
+def test_isbn_notations_share_a_cache_entry(tmp_path):
+    """Test that ISBN-10, ISBN-13 and hyphenated forms of one ISBN are looked up once, as the ISBN-13."""
+    handler, calls = counting_handler(FOUND)
+    cache = LookupCache(str(tmp_path / "cache.db"))
+    results = cached_lookups(handler, cache, ["0140187723", "978-0-14-018772-4", "9780140187724"])
+
+    assert calls == ["9780140187724"]
+    assert [result["isbn"] for result in results] == ["9780140187724"] * 3
+
+def test_not_found_is_cached_with_short_ttl(tmp_path):
+    """Test negative caching and its expiry."""
+    clock = FakeClock()
+    handler, calls = counting_handler({"numFound": 0, "docs": []})
+    cache = LookupCache(str(tmp_path / "cache.db"), ttl=1000, negative_ttl=10, clock=clock)
+
+    cached_lookups(handler, cache, ["404", "404"])
+    assert calls == ["404"]
+    assert cache.stats["negative_hits"] == 1
+
+    clock.now += 11
+    cache = LookupCache(str(tmp_path / "cache.db"), ttl=1000, negative_ttl=10, clock=clock)
+    cached_lookups(handler, cache, ["404"])
+    assert calls == ["404", "404"]
+
+def test_cache_survives_restarts(tmp_path):
+    """Test that the disk tier answers lookups made by an earlier process."""
+    handler, calls = counting_handler(FOUND)
+    cached_lookups(handler, LookupCache(str(tmp_path / "cache.db")), ["1"])
+
+    cache = LookupCache(str(tmp_path / "cache.db"))
+    assert cached_lookups(handler, cache, ["1"])[0]["title"] == "Martin Eden"
+    assert calls == ["1"]
+    assert cache.stats["disk_hits"] == 1
+
+def test_memory_tier_is_bounded():
+    """Test that the in-memory tier evicts the least recently used entry."""
+    cache = LookupCache(path=None, maxsize=2)
+    cache.put("1", {"title": "One"})
+    cache.put("2", {"title": "Two"})
+    cache.get("1")
+    cache.put("3", {"title": "Three"})
+    assert cache.get("2") is MISS
+    assert cache.get("1") == {"title": "One"}
+
+def test_failures_are_not_cached():
+    """Test that a failed request is retried on the next lookup instead of cached."""
+    handler_calls = []
+    def handler(request):
+        handler_calls.append(request)
+        return httpx.Response(500)
+
+    cache = LookupCache(path=None)
+    assert cached_lookups(handler, cache, ["1"]) == [None]
+    assert cache.get("1") is MISS
+
+def test_expired_rows_are_deleted_on_open(tmp_path):
+    """Test that opening the cache drops expired rows from the disk tier."""
+    clock = FakeClock()
+    cache = LookupCache(str(tmp_path / "cache.db"), ttl=1000, negative_ttl=10, clock=clock)
+    cache.put("1", {"title": "One"})
+    cache.put("404", None)
+    cache.close()
+
+    clock.now += 11
+    cache = LookupCache(str(tmp_path / "cache.db"), ttl=1000, negative_ttl=10, clock=clock)
+    assert cache.info()["disk_entries"] == 1
+    assert cache.get("1") == {"title": "One"}
+    cache.close()
+
+def test_lookups_are_written_to_disk_off_the_event_loop(tmp_path, caplog):
+    """Test that a looked-up result is committed on a worker thread, and a miss is logged."""
+    handler, calls = counting_handler({"numFound": 0, "docs": []})
+    cache = LookupCache(str(tmp_path / "cache.db"))
+    store, threads = cache._store, []
+    def recording_store(*args):
+        threads.append(threading.current_thread())
+        store(*args)
+    cache._store = recording_store
+
+    with caplog.at_level(logging.INFO, logger="openlibrary"):
+        assert cached_lookups(handler, cache, ["404"]) == [None]
+    assert threads and threading.main_thread() not in threads
+    assert "No book found with ISBN 404" in caplog.text
+    assert LookupCache(str(tmp_path / "cache.db")).get("404") is None
@@ -0,0 +1,28 @@
+import threading
+import time
+from profiler import SamplingProfiler
+
+
+def busy_waiting(stop):
+    while not stop.is_set():
+        time.sleep(0.001)
+
+def test_samples_other_threads_until_stopped():
+    """Test that a running profiler records the stacks of other threads, and stops cleanly."""
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_waiting, args=(stop,))
+    worker.start()
+    profiler = SamplingProfiler()
+    try:
+        assert profiler.start(interval=0.001)
+        assert not profiler.start()
+        time.sleep(0.1)
+        report = profiler.stop()
+    finally:
+        stop.set()
+        worker.join()
+
+    assert not profiler.running and profiler.stop() is None
+    stack, count = next(line for line in report.splitlines() if "busy_waiting" in line).rsplit(" ", 1)
+    assert stack.split(";")[-1].startswith("busy_waiting (test_profiler.py:")
+    assert int(count) > 0
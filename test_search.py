@@ -0,0 +1,55 @@
+import time
+import pytest
+import search
+from library import Book, Library
+from search import normalize, tokenize
+
+@pytest.fixture
+def library_fixture(tmp_path):
+    """Fixture to create a temporary library with a few multilingual titles."""
+    library = Library(filename=str(tmp_path / "library.json"))
+    library.add_book(Book("Spinoza Problemi - Nazi Subayinin Paradoksu", "Yalom, Irvin D.", "1", 2012))
+    library.add_book(Book("Ademden Önce", "London, Jack", "2", 2019))
+    library.add_book(Book("Işığın Peşinde", "Önal, Ayşe", "3", 2020))
+    library.add_book(Book("Jack and the Beanstalk", "Anonymous", "4", 1807))
+    return library
+
+def test_normalize_strips_accents_and_case():
+    """Test that Turkish and other accented letters fold to their base letters."""
+    assert normalize("Önce IŞIK İstanbul") == "once isik istanbul"
+    assert tokenize("Spinoza Problemi - Nazi") == ["spinoza", "problemi", "nazi"]
+
+def test_search_is_accent_insensitive_and_prefix_based(library_fixture):
+    """Test search-as-you-type style queries against accented titles."""
+    assert [b.isbn for b in library_fixture.search("once")] == ["2"]
+    assert [b.isbn for b in library_fixture.search("isig pes")] == ["3"]
+    assert [b.isbn for b in library_fixture.search("spin prob")] == ["1"]
+    assert library_fixture.search("spinoza beanstalk") == []
+
+def test_search_ranks_title_matches_first(library_fixture):
+    """Test that a title match outranks an author match."""
+    assert [b.isbn for b in library_fixture.search("jack")] == ["4", "2"]
+
+def test_search_index_follows_mutations(library_fixture):
+    """Test that the index is updated on add, update and remove."""
+    library_fixture.search("once")  # build the index
+    library_fixture.update_book("2", title="Martin Eden")
+    library_fixture.remove_book("1")
+    library_fixture.add_book(Book("Önce Sonra", "Yazar", "5", 2021))
+
+    assert [b.isbn for b in library_fixture.search("once")] == ["5"]
+    assert [b.isbn for b in library_fixture.search("eden")] == ["2"]
+    assert library_fixture.search("spinoza") == []
+
+def test_long_queries_are_scored_term_by_term(library_fixture, monkeypatch):
+    """Test that long queries, matching or not, are answered quickly and ranked like short ones."""
+    start = time.perf_counter()
+    assert library_fixture.search(" ".join(f"word{n}" for n in range(30))) == []
+    assert library_fixture.search("spinoza " + " ".join(f"p{n}" for n in range(30))) == []
+    assert library_fixture.search("j ja jac jack jack. a an and") == [library_fixture.find_book("4")]
+    assert time.perf_counter() - start < 1
+
+    queries = ("jack", "on", "a", "isig pes", "spin prob")
+    combined = {query: library_fixture.search(query) for query in queries}
+    monkeypatch.setattr(search, "MAX_COMBINED_TERMS", 0)
+    assert {query: library_fixture.search(query) for query in queries} == combined
@@ -0,0 +1,121 @@
+import json
+import os
+import random
+from book import Book
+from library import Library
+from snapshot import SnapshotBookMap, open_snapshot, write_snapshot
+from storage import JSONStorage, index_by_isbn
+
+
+def write_json(path, books):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump([book.to_dict() for book in books], f)
+
+def test_snapshot_map_behaves_like_a_dict(tmp_path):
+    """Test lookups, updates, removals, re-adds and order against the dict the JSON loader builds."""
+    books = [Book(f"Kitap {n} ışık", f"Yazar {n % 3}", str(n % 40), 1990 + n, n % 2 == 0,
+                  None if n % 5 == 0 else "2024-01-01") for n in range(50)]  # ISBNs 0-9 repeat
+    source, path = str(tmp_path / "library.json"), str(tmp_path / "library.json.snap")
+    write_json(source, books)
+    assert write_snapshot(path, books, source)
+
+    expected = index_by_isbn(books)
+    actual = SnapshotBookMap(open_snapshot(path, source))
+    assert list(actual.items()) == list(expected.items())
+    assert actual["3"] == expected["3"] and actual[("3", 1)] == expected[("3", 1)]
+    assert "missing" not in actual and ("3", 2) not in actual and 7 not in actual
+
+    rng = random.Random(1)
+    for step in range(300):
+        key = rng.choice(list(expected) + ["new1", "new2", "3"])
+        action = rng.random()
+        if action < 0.4 and key in expected:
+            del expected[key]
+            del actual[key]
+        elif action < 0.8:
+            book = Book(f"Step {step}", "Author", key if isinstance(key, str) else key[0], 2000)
+            expected[key] = book
+            actual[key] = book
+        assert (key in actual) == (key in expected)
+    assert list(actual) == list(expected)
+    assert list(actual.values()) == list(expected.values())
+    assert len(actual) == len(expected)
+
+def test_stale_or_broken_snapshots_are_ignored(tmp_path):
+    """Test that a snapshot of an older JSON file, or a file that is not a snapshot, is not used."""
+    source, path = str(tmp_path / "library.json"), str(tmp_path / "library.json.snap")
+    write_json(source, [Book("Old", "Author", "1", 2000)])
+    write_snapshot(path, [Book("Old", "Author", "1", 2000)], source)
+    write_json(source, [Book("New", "Author", "1", 2000), Book("Newer", "Author", "2", 2001)])
+    os.utime(source, ns=(0, 0))
+    assert open_snapshot(path, source) is None
+
+    with open(path, 'wb') as f:
+        f.write(b"not a snapshot")
+    assert open_snapshot(path, source) is None
+    assert [b.title for b in Library(storage=JSONStorage(source, snapshot=True)).books] == ["New", "Newer"]
+
+def test_library_starts_from_the_snapshot(tmp_path):
+    """Test that a library reopens from its snapshot and that changes reach the next one."""
+    path = str(tmp_path / "library.json")
+    write_json(path, [Book(f"Book {n}", "Author", str(n), 2000 + n) for n in range(5)])
+    library = Library(storage=JSONStorage(path, snapshot=True))  # parses the JSON and writes the snapshot
+    library.close()
+
+    library = Library(storage=JSONStorage(path, snapshot=True))
+    assert isinstance(library._books, SnapshotBookMap)
+    assert len(library) == 5 and library.find_book("3").title == "Book 3"
+    library.update_book("3", title="Book Three")
+    library.remove_book("0")
+    library.add_book(Book("Book 5", "Author", "5", 2005))
+    assert [b.isbn for b in library.query(sort="year_desc")[0]] == ["5", "4", "3", "2", "1"]
+    library.close()
+
+    reopened = Library(storage=JSONStorage(path, snapshot=True))
+    assert isinstance(reopened._books, SnapshotBookMap)
+    assert [(b.isbn, b.title) for b in reopened.books] == [("1", "Book 1"), ("2", "Book 2"), ("3", "Book Three"),
+                                                           ("4", "Book 4"), ("5", "Book 5")]
+    reopened.close()
+    assert [b.title for b in Library(path).books][2] == "Book Three"
+
+def test_journal_is_replayed_over_the_snapshot(tmp_path):
+    """Test that journaled changes after the last compaction are applied on top of the snapshot."""
+    path = str(tmp_path / "library.json")
+    library = Library(storage=JSONStorage(path, journal=True, snapshot=True))
+    library.add_book(Book("Kept", "Author", "1", 2000))
+    library.save_books()  # compacts: JSON file and snapshot
+    library.add_book(Book("Journaled", "Author", "2", 2001))
+    library.update_book("1", available=False)
+    library.storage.journal.close()  # a crash: no compaction, no close
+
+    reopened = Library(storage=JSONStorage(path, journal=True, snapshot=True))
+    assert isinstance(reopened._books, SnapshotBookMap)
+    assert [(b.title, b.available) for b in reopened.books] == [("Kept", False), ("Journaled", True)]
+    reopened.close()
+
+def test_snapshot_is_unmapped_before_it_is_replaced(tmp_path, monkeypatch):
+    """Test that the snapshot is brought up to date even where a mapped file cannot be renamed over (Windows)."""
+    path = str(tmp_path / "library.json")
+    write_json(path, [Book("One", "Author", "1", 2000)])
+    Library(storage=JSONStorage(path, snapshot=True)).close()  # writes the snapshot
+    opened = []
+
+    def replace(src, dst):
+        if dst.endswith(".snap") and opened and opened[-1]._snapshot is not None:
+            raise PermissionError(dst)
+        os.rename(src, dst)
+
+    monkeypatch.setattr("snapshot.os.replace", replace)
+    for journal in (False, True):
+        storage = JSONStorage(path, journal=journal, snapshot=True)
+        library = Library(storage=storage)
+        assert storage._snapshot is not None
+        opened.append(storage)
+        library.add_book(Book(f"Journal {journal}", "Author", str(2 + journal), 2001))
+        library.save_books()  # with a journal, a compaction that cannot replace the snapshot
+        library.close()
+        assert open_snapshot(storage.snapshot_path, path) is not None
+
+    reopened = Library(storage=JSONStorage(path, snapshot=True))
+    assert [b.title for b in reopened.books] == ["One", "Journal False", "Journal True"]
+    reopened.close()
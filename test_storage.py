@@ -0,0 +1,84 @@
+import json
+import sqlite3
+import pytest
+from library import Book, Library
+from storage import JSONStorage, SQLiteStorage, migrate_json_to_sqlite, open_storage
+
+@pytest.fixture
+def sqlite_library(tmp_path):
+    """Fixture to create a Library backed by a temporary SQLite database."""
+    library = Library(storage=SQLiteStorage(str(tmp_path / "library.db")))
+    yield library
+    library.close()
+
+def test_sqlite_crud_round_trip(sqlite_library, tmp_path):
+    """Test that add, update and remove are persisted to the database."""
+    sqlite_library.add_book(Book("First", "Author A", "111", 2001))
+    sqlite_library.add_book(Book("Second", "Author B", "222", 2002))
+    sqlite_library.update_book("111", title="First, Revised", available=False)
+    sqlite_library.remove_book("222")
+    assert sqlite_library.add_book(Book("Dup", "Author C", "111", 2003)) is False
+
+    reopened = Library(storage=SQLiteStorage(str(tmp_path / "library.db")))
+    assert [b.title for b in reopened.books] == ["First, Revised"]
+    book = reopened.find_book("111")
+    assert book.available is False
+    assert book.date_added is not None
+    reopened.close()
+
+def test_sqlite_keeps_insertion_order_across_updates(sqlite_library):
+    """Test that updating a book does not move it to the end of the listing."""
+    for isbn in ("1", "2", "3"):
+        sqlite_library.add_book(Book(f"Book {isbn}", "Author", isbn, 2000))
+    sqlite_library.update_book("1", year=1999)
+    assert [b.isbn for b in sqlite_library.books] == ["1", "2", "3"]
+
+def test_sqlite_schema_uses_wal_and_indexes(sqlite_library, tmp_path):
+    """Test that the database runs in WAL mode with the secondary indexes in place."""
+    db = sqlite3.connect(str(tmp_path / "library.db"))
+    assert db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    indexes = {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {"books_author", "books_year", "books_date_added"} <= indexes
+    db.close()
+
+def test_migrate_json_to_sqlite(tmp_path):
+    """Test the one-shot migration, including records with repeated ISBNs."""
+    json_path = tmp_path / "library.json"
+    json_path.write_text(json.dumps([
+        {"title": "A", "author": "X", "isbn": "1", "year": 2000},
+        {"title": "B", "author": "Y", "isbn": "2", "year": 2001, "available": False},
+        {"title": "C", "author": "Z", "isbn": "1", "year": 2002},
+    ]), encoding="utf-8")
+    db_path = str(tmp_path / "library.db")
+
+    assert migrate_json_to_sqlite(str(json_path), db_path) == (2, 1)
+
+    library = Library(storage=SQLiteStorage(db_path))
+    assert [(b.title, b.available) for b in library.books] == [("A", True), ("B", False)]
+    library.close()
+
+def test_open_storage_from_environment(monkeypatch, tmp_path):
+    """Test that the backend and path can be chosen through environment variables."""
+    monkeypatch.setenv("LIBRARY_STORAGE", "sqlite")
+    monkeypatch.setenv("LIBRARY_PATH", str(tmp_path / "env.db"))
+    storage = open_storage()
+    assert isinstance(storage, SQLiteStorage)
+    storage.close()
+
+    with pytest.raises(ValueError):
+        open_storage("yaml")
+
+def test_columnar_json_library(tmp_path):
+    """Test that a columnar catalog behaves like the plain one and survives compaction."""
+    path = str(tmp_path / "library.json")
+    library = Library(storage=JSONStorage(path, columnar=True))
+    for isbn in range(1, 7):
+        library.add_book(Book(f"Book {isbn}", "Shared, Author", str(isbn), 2000 + isbn))
+    library.update_book("2", available=False, title="Book Two")
+    for isbn in ("1", "3", "5", "6"):
+        library.remove_book(isbn)  # enough holes to trigger a compaction
+
+    assert [(b.isbn, b.title, b.available) for b in library.books] == [("2", "Book Two", False), ("4", "Book 4", True)]
+    assert [b.isbn for b in library.query(sort="year_desc")[0]] == ["4", "2"]
+    library.add_book(Book("Book 7", "Shared, Author", "7", 2007))
+    assert [b.isbn for b in Library(filename=path).books] == ["2", "4", "7"]